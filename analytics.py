@@ -0,0 +1,128 @@
+"""
+Per-user betting statistics: hit rate, exact scores, points, best round and current streak.
+
+Statistics are aggregates updated incrementally as match results come in (see SeasonAnalytics.apply_results),
+so answering "my stats" is a dict lookup, never a scan over predictions or score strings.
+"""
+import logging
+import threading
+from dataclasses import dataclass, asdict
+from typing import Iterable, Literal
+import config
+from database import Database
+from utilities import initialize_logging
+
+FINISHED_STATUSES: frozenset[str] = frozenset({'FT', 'AET', 'PEN'})
+
+PredictionOutcome = Literal['score', 'diff', 'result', 'miss']
+
+initialize_logging()
+
+
+def score_prediction(predicted_home: int, predicted_away: int, home: int, away: int) \
+        -> tuple[int, PredictionOutcome]:
+    """Returns the points a prediction earns and what exactly it guessed."""
+    if (predicted_home, predicted_away) == (home, away):
+        return config.POINTS_PER_SCORE, 'score'
+    if predicted_home - predicted_away == home - away:
+        return config.POINTS_PER_DIFF, 'diff'
+    if (predicted_home > predicted_away) - (predicted_home < predicted_away) == (home > away) - (home < away):
+        return config.POINTS_PER_RESULT, 'result'
+    return 0, 'miss'
+
+
+@dataclass
+class UserStats:
+    telegram_id: int
+    season_api_id: int
+    season_year: int
+    predictions: int = 0
+    hits: int = 0
+    exact_scores: int = 0
+    points: int = 0
+    current_streak: int = 0
+    best_streak: int = 0
+    best_round: int | None = None
+    best_round_points: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.predictions if self.predictions else 0.0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class SeasonAnalytics:
+    def __init__(self, database: Database):
+        self.db = database
+        self._stats: dict[tuple[int, int, int], UserStats] = {}  # (telegram_id, season_api_id, season_year)
+        self._round_points: dict[tuple[int, int, int, int], int] = {}  # stats key + round -> points
+        self._processed: set[int] = set()
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        """Loads precomputed statistics from the database, call once at startup."""
+        stats = {(r['telegram_id'], r['season_api_id'], r['season_year']): UserStats(**r)
+                 for r in self.db.read_user_stats()}
+        round_points = {(r['telegram_id'], r['season_api_id'], r['season_year'], r['round']): r['points']
+                        for r in self.db.read_user_round_points()}
+        processed = self.db.read_processed_results()
+        with self._lock:
+            self._stats, self._round_points, self._processed = stats, round_points, processed
+        logging.info(f"User statistics loaded. Users: {len(stats)}, results accounted for: {len(processed)}.")
+
+    def get_user_stats(self, telegram_id: int, season_api_id: int, season_year: int) -> UserStats | None:
+        return self._stats.get((telegram_id, season_api_id, season_year))
+
+    def apply_results(self, matches: Iterable[dict]) -> None:
+        """Accounts for every finished match not accounted for yet, in kickoff order so that streaks are right."""
+        for m in sorted(matches, key=lambda m: m['match_datetime']):
+            if m['status_short'] in FINISHED_STATUSES and m['home_goals'] is not None \
+                    and m['match_id'] not in self._processed:
+                self.apply_result(m)
+
+    def apply_result(self, match: dict) -> None:
+        match_id, season, year, round_ = match['match_id'], match['season_api_id'], match['season_year'], match['round']
+        bets = self.db.read_match_bets(match_id)
+
+        with self._lock:
+            if match_id in self._processed:
+                return
+            updated_stats, updated_rounds = [], []
+            for b in bets:
+                points, outcome = score_prediction(b['home_goals'], b['away_goals'],
+                                                   match['home_goals'], match['away_goals'])
+                key = (b['telegram_id'], season, year)
+                # Work on copies, memory is only updated once the database has the new values
+                stats = UserStats(**self._stats[key].to_dict()) if key in self._stats else UserStats(*key)
+                stats.predictions += 1
+                stats.points += points
+                if points:
+                    stats.hits += 1
+                    stats.current_streak += 1
+                    stats.best_streak = max(stats.best_streak, stats.current_streak)
+                else:
+                    stats.current_streak = 0
+                if outcome == 'score':
+                    stats.exact_scores += 1
+
+                round_key = (*key, round_)
+                round_points = self._round_points.get(round_key, 0) + points
+                if round_points > stats.best_round_points:
+                    stats.best_round, stats.best_round_points = round_, round_points
+
+                updated_stats.append(stats)
+                updated_rounds.append((round_key, round_points))
+
+            self.db.store_processed_result(
+                match_id,
+                [s.to_dict() for s in updated_stats],
+                [{'telegram_id': t, 'season_api_id': s, 'season_year': y, 'round': r, 'points': p}
+                 for (t, s, y, r), p in updated_rounds]
+            )
+            for s in updated_stats:
+                self._stats[(s.telegram_id, s.season_api_id, s.season_year)] = s
+            self._round_points.update(updated_rounds)
+            self._processed.add(match_id)
+        logging.info(f"Result of match {match_id} accounted for in statistics of {len(bets)} users.")
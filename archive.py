@@ -0,0 +1,222 @@
+"""
+Columnar archive of finished contests.
+
+An inactive contest is moved out of the live tables together with its matches, bets and user statistics
+into ARCHIVE_DIR/<season_api_id>_<year>/:
+    manifest.json               contest row, row counts and column types
+    <table>.<column>.i64        integer column, native int64 array
+    <table>.<column>.off/.str   text column, int64 offsets (rows + 1) into utf-8 data
+    <table>.<column>.nul        one byte per row, only for columns containing NULLs
+Archived seasons are read back through mmap, nothing is decoded until it is accessed, and can be
+restored into the live tables with bulk inserts. The archive is written before the contest is deleted,
+an archive found in place of a contest that is still live is the leftover of an interrupted run: it is
+checked against the live rows and the run resumes with the deletion.
+"""
+import array
+import json
+import logging
+import mmap
+import os
+import shutil
+from typing import Iterator
+import config
+from analytics import score_prediction
+from database import Database
+from utilities import initialize_logging
+
+ARCHIVE_FORMAT_VERSION = 2
+# Version 1 archives hold just the first two
+ARCHIVED_TABLES: tuple[str, ...] = ('matches', 'bets', 'user_stats', 'user_round_points', 'processed_results')
+NULL_INT = -2 ** 63
+
+initialize_logging()
+
+
+def _column_kind(values: list) -> str:
+    return 'int' if all(v is None or isinstance(v, int) for v in values) else 'str'
+
+
+def _write_column(directory: str, table: str, column: str, values: list) -> str:
+    kind = _column_kind(values)
+    base = os.path.join(directory, f'{table}.{column}')
+    if kind == 'int':
+        with open(f'{base}.i64', 'wb') as f:
+            array.array('q', (NULL_INT if v is None else int(v) for v in values)).tofile(f)
+    else:
+        offsets, data, position = array.array('q', [0]), bytearray(), 0
+        for v in values:
+            encoded = b'' if v is None else str(v).encode('UTF-8')
+            data += encoded
+            position += len(encoded)
+            offsets.append(position)
+        with open(f'{base}.off', 'wb') as f:
+            offsets.tofile(f)
+        with open(f'{base}.str', 'wb') as f:
+            f.write(data)
+    if any(v is None for v in values):
+        with open(f'{base}.nul', 'wb') as f:
+            f.write(bytes(v is None for v in values))
+    return kind
+
+
+def _map(path: str) -> memoryview:
+    if not os.path.getsize(path):
+        return memoryview(b'')
+    with open(path, 'rb') as f:
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+class StringColumn:
+    def __init__(self, offsets: memoryview, data: memoryview, nulls: memoryview | None):
+        self._offsets = offsets
+        self._data = data
+        self._nulls = nulls
+
+    def __len__(self):
+        return max(len(self._offsets) - 1, 0)
+
+    def __getitem__(self, i: int) -> str | None:
+        if self._nulls is not None and self._nulls[i]:
+            return None
+        return str(self._data[self._offsets[i]:self._offsets[i + 1]], 'UTF-8')
+
+    def __iter__(self) -> Iterator[str | None]:
+        return (self[i] for i in range(len(self)))
+
+
+class IntColumn:
+    def __init__(self, values: memoryview, nulls: memoryview | None):
+        self._values = values
+        self._nulls = nulls
+
+    def __len__(self):
+        return len(self._values)
+
+    def __getitem__(self, i: int) -> int | None:
+        if self._nulls is not None and self._nulls[i]:
+            return None
+        return self._values[i]
+
+    def __iter__(self) -> Iterator[int | None]:
+        return (self[i] for i in range(len(self)))
+
+
+class ArchivedSeason:
+    """Read-only view of an archived contest, columns are memory-mapped on first access."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, 'manifest.json'), encoding='UTF-8') as f:
+            self.manifest = json.load(f)
+        self.contest: dict = self.manifest['contest']
+        self._columns: dict[tuple[str, str], IntColumn | StringColumn] = {}
+
+    def column(self, table: str, column: str) -> IntColumn | StringColumn:
+        key = (table, column)
+        if key not in self._columns:
+            base = os.path.join(self.path, f'{table}.{column}')
+            nulls = _map(f'{base}.nul') if os.path.exists(f'{base}.nul') else None
+            if self.manifest['tables'][table]['columns'][column] == 'int':
+                self._columns[key] = IntColumn(_map(f'{base}.i64').cast('q'), nulls)
+            else:
+                self._columns[key] = StringColumn(_map(f'{base}.off').cast('q'), _map(f'{base}.str'), nulls)
+        return self._columns[key]
+
+    def rows(self, table: str) -> Iterator[tuple]:
+        columns = [self.column(table, c) for c in self.manifest['tables'][table]['columns']]
+        return zip(*columns)
+
+    def leaderboard(self) -> list[tuple[int, int]]:
+        """Returns (telegram_id, points) sorted by points, best first."""
+        results = {match_id: (home, away) for match_id, home, away in zip(
+            self.column('matches', 'match_id'), self.column('matches', 'home_goals'),
+            self.column('matches', 'away_goals')) if home is not None}
+        points: dict[int, int] = {}
+        for telegram_id, match_id, home, away in zip(
+                self.column('bets', 'telegram_id'), self.column('bets', 'match_id'),
+                self.column('bets', 'home_goals'), self.column('bets', 'away_goals')):
+            if match_id in results:
+                points[telegram_id] = points.get(telegram_id, 0) + score_prediction(home, away, *results[match_id])[0]
+        return sorted(points.items(), key=lambda p: p[1], reverse=True)
+
+
+def archive_path(contest: dict, archive_dir: str = config.ARCHIVE_DIR) -> str:
+    return os.path.join(archive_dir, f"{contest['season_api_id']}_{contest['year']}")
+
+
+def _read_season_tables(db: Database, season_api_id: int, year: int) -> dict[str, tuple[dict]]:
+    return {'matches': db.read_season_matches(season_api_id, year),
+            'bets': db.read_season_bets(season_api_id, year),
+            'user_stats': db.read_season_user_stats(season_api_id, year),
+            'user_round_points': db.read_season_user_round_points(season_api_id, year),
+            'processed_results': db.read_season_processed_results(season_api_id, year)}
+
+
+def _is_resumable(path: str, tables: dict[str, tuple[dict]]) -> bool:
+    """Whether an existing archive holds exactly the rows still in the live tables."""
+    try:
+        manifest = ArchivedSeason(path).manifest
+    except (OSError, ValueError) as e:
+        logging.error(f"Failed to read archive '{path}'. Exception: {e.__repr__()}")
+        return False
+    return all(manifest['tables'].get(t, {}).get('rows') == len(rows) for t, rows in tables.items())
+
+
+def _write_archive(path: str, contest: dict, tables: dict[str, tuple[dict]], db: Database) -> None:
+    tmp_path = f'{path}.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    manifest = {'version': ARCHIVE_FORMAT_VERSION, 'contest': contest, 'tables': {}}
+    for table, rows in tables.items():
+        columns = list(rows[0].keys()) if rows else db.read_column_names(table)
+        manifest['tables'][table] = {
+            'rows': len(rows),
+            'columns': {c: _write_column(tmp_path, table, c, [r[c] for r in rows]) for c in columns}
+        }
+    with open(os.path.join(tmp_path, 'manifest.json'), 'w', encoding='UTF-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, default=str, indent=2)
+    os.replace(tmp_path, path)  # the archive appears complete or not at all
+
+
+def export_contest(db: Database, season_api_id: int, year: int, archive_dir: str = config.ARCHIVE_DIR) -> str | None:
+    """Moves an inactive contest with its matches, bets and user statistics to the archive. Returns its path."""
+    contest = db.read_contest(season_api_id, year)
+    if contest is None or contest['is_active']:
+        logging.error(f"Failed to archive contest {season_api_id} ({year}). It doesn't exist or is still active.")
+        return None
+
+    tables = _read_season_tables(db, season_api_id, year)
+    path = archive_path(contest, archive_dir)
+    if os.path.exists(path):
+        # Written by a run interrupted before the deletion, unless it doesn't match what is live
+        if not _is_resumable(path, tables):
+            logging.error(f"Failed to archive contest {season_api_id} ({year}). "
+                          f"Archive '{path}' already exists and doesn't match the live rows.")
+            return None
+        logging.warning(f"Archive '{path}' already exists and matches the live rows. Resuming the archiving.")
+    else:
+        _write_archive(path, contest, tables, db)
+
+    db.delete_contest(season_api_id, year)
+    logging.info(f"Contest {season_api_id} ({year}) archived to '{path}'. "
+                 f"Matches: {len(tables['matches'])}, bets: {len(tables['bets'])}, "
+                 f"user statistics: {len(tables['user_stats'])}.")
+    return path
+
+
+def import_contest(db: Database, path: str) -> None:
+    """Restores an archived contest into the live tables, it comes back inactive."""
+    season = ArchivedSeason(path)
+    contest = dict(season.contest, is_active=0)
+    db.add_contest(contest)
+    for table in (t for t in ARCHIVED_TABLES if t in season.manifest['tables']):
+        db.insert_rows(table, tuple(season.manifest['tables'][table]['columns']), season.rows(table))
+    logging.info(f"Contest {contest['season_api_id']} restored from '{path}'.")
+
+
+def list_archived_seasons(archive_dir: str = config.ARCHIVE_DIR) -> list[ArchivedSeason]:
+    if not os.path.isdir(archive_dir):
+        return []
+    return [ArchivedSeason(os.path.join(archive_dir, d)) for d in sorted(os.listdir(archive_dir))
+            if os.path.exists(os.path.join(archive_dir, d, 'manifest.json'))]
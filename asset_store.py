@@ -0,0 +1,109 @@
+"""
+Content-addressed storage for images (team and league logos).
+
+Bytes live in the `assets` table keyed by their SHA-256, hot tables only keep the hash in `logo_hash`.
+Identical images (e.g. the default 'no logo' picture) are stored once.
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Iterator
+import config
+from utilities import initialize_logging
+
+STREAM_CHUNK_SIZE: int = 64 * 1024
+
+initialize_logging()
+
+
+def asset_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+class LazyAsset:
+    """A reference to a stored asset, the bytes are fetched on first access only."""
+
+    def __init__(self, store: 'AssetStore', hash_: str):
+        self.store = store
+        self.hash = hash_
+
+    @property
+    def data(self) -> memoryview | None:
+        return self.store.get(self.hash)
+
+    def stream(self, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[memoryview]:
+        return self.store.stream(self.hash, chunk_size)
+
+    def __repr__(self):
+        return f"LazyAsset({self.hash})"
+
+
+class AssetStore:
+    def __init__(self, database, cache_max_bytes: int = config.ASSET_CACHE_MAX_BYTES):
+        self.db = database
+        self.cache_max_bytes = cache_max_bytes
+        self._cache: OrderedDict[str, memoryview] = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, content: bytes) -> str:
+        """Stores the content unless it is already there. Returns its hash."""
+        hash_ = asset_hash(content)
+        with self.db:
+            self.db.cur.execute("INSERT IGNORE INTO assets (asset_hash, content, size) VALUES (%s, %s, %s)",
+                                (hash_, content, len(content)))
+        self._remember(hash_, memoryview(content).toreadonly())
+        return hash_
+
+    def get(self, hash_: str) -> memoryview | None:
+        """Returns a read-only view of the content, None if there's no such asset."""
+        with self._lock:
+            view = self._cache.get(hash_)
+            if view is not None:
+                self._cache.move_to_end(hash_)
+                return view
+        with self.db:
+            self.db.cur.execute("SELECT content FROM assets WHERE asset_hash = %s", (hash_,))
+            row = self.db.cur.fetchone()
+        if row is None:
+            logging.error(f"Asset '{hash_}' not found.")
+            return None
+        view = memoryview(bytes(row[0])).toreadonly()
+        self._remember(hash_, view)
+        return view
+
+    def stream(self, hash_: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[memoryview]:
+        """Yields the content chunk by chunk without ever holding all of it, cached content is sliced instead."""
+        with self._lock:
+            view = self._cache.get(hash_)
+        if view is not None:
+            for start in range(0, len(view), chunk_size):
+                yield view[start:start + chunk_size]
+            return
+
+        offset = 1  # SUBSTRING is 1-based
+        while True:
+            with self.db:
+                self.db.cur.execute("SELECT SUBSTRING(content, %s, %s) FROM assets WHERE asset_hash = %s",
+                                    (offset, chunk_size, hash_))
+                row = self.db.cur.fetchone()
+            if not row or not row[0]:
+                return
+            yield memoryview(bytes(row[0]))
+            offset += chunk_size
+
+    def ref(self, hash_: str | None) -> LazyAsset | None:
+        return LazyAsset(self, hash_) if hash_ else None
+
+    def _remember(self, hash_: str, view: memoryview) -> None:
+        if view.nbytes > self.cache_max_bytes:
+            return
+        with self._lock:
+            if hash_ in self._cache:
+                return
+            self._cache[hash_] = view
+            self._cache_bytes += view.nbytes
+            while self._cache_bytes > self.cache_max_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= evicted.nbytes
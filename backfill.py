@@ -0,0 +1,87 @@
+"""
+Backfill of past seasons (league, teams, fixtures) for historical statistics.
+
+Every season is a job in `backfill_jobs` going through the stages season -> teams -> fixtures -> done.
+A stage is one API request, its result is written with batched upserts before the job advances,
+so after a restart a job continues from the first unfinished stage and finished stages are never
+requested again. Backfill only spends what is left of the daily quota above BACKFILL_RESERVED_REQUESTS
+and simply stops until the next run (or the next counter reset) when that is used up.
+"""
+import logging
+import config
+from database import Database
+from stats_api import StatsAPIHandler, MATCH_COLUMNS
+from utilities import initialize_logging
+
+STAGES: tuple[str, ...] = ('season', 'teams', 'fixtures', 'done')
+
+initialize_logging()
+
+
+class BackfillRunner:
+    def __init__(self, stats_api: StatsAPIHandler, database: Database):
+        self.api = stats_api
+        self.db = database
+
+    def enqueue(self, league_country: str, league_name: str, first_year: int, last_year: int) -> int:
+        seasons = [(league_country, league_name, year) for year in range(first_year, last_year + 1)]
+        queued = self.db.enqueue_backfill_jobs(seasons)
+        logging.info(f"Backfill of {league_country} {league_name} {first_year}-{last_year} queued.")
+        return queued
+
+    def _quota_available(self) -> bool:
+        return self.db.read_requests_counter() < config.DAILY_REQUESTS_QUOTA - config.BACKFILL_RESERVED_REQUESTS
+
+    def run_pending(self) -> None:
+        """Advances unfinished jobs stage by stage while spare quota lasts."""
+        for job in self.db.read_unfinished_backfill_jobs():
+            while job['stage'] != 'done':
+                if not self._quota_available():
+                    logging.info("Backfill paused. No spare requests quota left for today.")
+                    return
+                if not self._run_stage(job):
+                    break
+
+    def _run_stage(self, job: dict) -> bool:
+        """Runs the current stage of the job. Returns whether the job advanced."""
+        stage, year = job['stage'], job['year']
+        season_name = f"{job['league_country']} {job['league_name']} {year}"
+
+        if stage == 'season':
+            season = self.api.get_season(job['league_country'], job['league_name'], year)
+            done = season is not None
+            if done:
+                job['season_api_id'] = season['season_api_id']
+                if self.db.read_contest(season['season_api_id'], year) is None:
+                    self.db.add_contest(season)
+        elif stage == 'teams':
+            teams = self.api.get_league_teams(job['season_api_id'], year)
+            done = bool(teams)
+            # Clubs that still play keep their current names and logos, only the ones gone since are added
+            self.db.insert_missing_teams(teams)
+        else:
+            contest = self.db.read_contest(job['season_api_id'], year)
+            if contest is None:
+                # The season stage stored nothing, add_contest() only logs a failed insert
+                logging.error(f"Backfill of {season_name} has no stored contest to request fixtures for.")
+                rows = []
+            else:
+                rows = self.api.get_calendar_rows(contest)
+            done = bool(rows)
+            self.db.upsert_match_rows(MATCH_COLUMNS, rows)
+
+        if not done:
+            job['attempts'] += 1
+            failed = job['attempts'] >= config.BACKFILL_MAX_ATTEMPTS
+            self.db.update_backfill_job(job['job_id'], attempts=job['attempts'],
+                                        status='failed' if failed else 'pending')
+            logging.warning(f"Backfill of {season_name} got no data at stage '{stage}'. "
+                            f"Attempt {job['attempts']}{', giving up' if failed else ''}.")
+            return False
+
+        job['stage'] = STAGES[STAGES.index(stage) + 1]
+        self.db.update_backfill_job(job['job_id'], stage=job['stage'], season_api_id=job['season_api_id'],
+                                    attempts=0, status='done' if job['stage'] == 'done' else 'pending')
+        job['attempts'] = 0
+        logging.info(f"Backfill of {season_name}: stage '{stage}' completed.")
+        return True
@@ -0,0 +1,338 @@
+"""
+Offline replay benchmarks.
+
+Replays recorded api-football responses (benchmarks/fixtures) and synthetic Telegram updates through
+StatsAPIHandler, Database and BetBot. Nothing leaves the machine: the statistics API is served by
+FakeStatsSession and the Telegram Bot API by FakeTelegram, so neither the daily quota nor Telegram is touched.
+
+Scenarios other than calendar_decoding need a database. With the MySQL backend (the default) that is a local
+MySQL (or compatible) server, configured with the usual MYSQL_DB_* variables. The benchmark works in its own
+database (MYSQL_DB_NAME, 'my_rpl_bet_bot_bench' by default, or BENCH_SQLITE_PATH) and drops it afterwards
+unless --keep-db is given. Results of backends other than MySQL are reported as 'scenario@backend'.
+
+    python benchmark.py                    # run and compare with benchmarks/baseline.json
+    python benchmark.py --save-baseline    # run and store the results as the new baseline
+    python benchmark.py -s message_handling -t 0.1
+    python benchmark.py -b mysql -b sqlite # the same scenarios on both backends
+"""
+import os
+
+os.environ.setdefault('MYSQL_DB_NAME', 'my_rpl_bet_bot_bench')
+os.environ.setdefault('TELEGRAM_TOKEN', '000000:BENCHMARK')
+os.environ.setdefault('ADMIN_ID', '1')
+os.environ.setdefault('TEST_ACCOUNT_ID', '2')
+os.environ.setdefault('STAT_API_KEY', 'benchmark')
+
+import argparse
+import itertools
+import json
+import statistics
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+from urllib.parse import urlparse
+import telebot
+from telebot import apihelper
+
+import config
+from bet_bot import BetBot, EventBus, ADMIN_ID
+from config import LEAGUES
+from database import Database
+from storage import BackendName, MySQLBackend, SQLiteBackend, DB_NAME
+from stats_api import StatsAPIHandler, MATCH_COLUMNS, decode_json, fixtures_to_rows
+
+FIXTURES_DIR = 'benchmarks/fixtures'
+BASELINE_PATH = 'benchmarks/baseline.json'
+DEFAULT_TOLERANCE = 0.2  # allowed relative slowdown before a scenario counts as a regression
+PRODUCTION_DB_NAME = 'my_rpl_bet_bot_db'
+BENCH_SQLITE_PATH = 'benchmarks/my_rpl_bet_bot_bench.sqlite3'
+UNAUTHORIZED_USER_ID = 999_999
+# Smallest valid PNG, served for every logo URL
+PNG_BYTES = bytes.fromhex('89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+                          '1f15c4890000000d49444154789c6360000002000100e221bc330000000049454e44ae426082')
+
+
+class FakeResponse:
+    """The part of requests.Response used by StatsAPIHandler and download_logo."""
+
+    def __init__(self, status_code: int, content: bytes = b''):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeStatsSession:
+    """Stands in for requests.Session: serves recorded api-football payloads by endpoint and a PNG for logos."""
+
+    def __init__(self, fixtures_dir: str = FIXTURES_DIR):
+        self.payloads: dict[str, bytes] = {}
+        for endpoint in ('countries', 'leagues', 'teams', 'fixtures'):
+            with open(os.path.join(fixtures_dir, f'{endpoint}.json'), 'rb') as f:
+                self.payloads[endpoint] = f.read()
+        self.requests_made = 0
+
+    def get(self, url: str, headers: dict = None, params: dict = None) -> FakeResponse:
+        self.requests_made += 1
+        path = urlparse(url).path
+        if path.endswith('.png'):
+            return FakeResponse(200, PNG_BYTES)
+        payload = self.payloads.get(path.strip('/'))
+        return FakeResponse(200, payload) if payload is not None else FakeResponse(404)
+
+
+class FakeTelegramResponse:
+    status_code = 200
+    reason = 'OK'
+
+    def __init__(self, result):
+        self._json = {'ok': True, 'result': result}
+        self.text = json.dumps(self._json)
+
+    def json(self):
+        return self._json
+
+
+class FakeTelegram:
+    """A telebot CUSTOM_REQUEST_SENDER answering Bot API calls locally."""
+
+    def __init__(self):
+        self.calls: dict[str, int] = {}
+        self._message_ids = itertools.count(1)
+
+    def __call__(self, method, request_url, params=None, files=None, timeout=None, proxies=None):
+        api_method = request_url.rsplit('/', 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        params = params or {}
+        if api_method == 'getMyCommands':
+            result = [c.to_dict() for c in BetBot.MENU_TELEBOT_COMMANDS]
+        elif api_method == 'sendMessage':
+            result = {'message_id': next(self._message_ids), 'date': int(time.time()),
+                      'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'}, 'text': params.get('text')}
+        else:
+            result = True
+        return FakeTelegramResponse(result)
+
+
+def make_update(update_id: int, user_id: int, text: str) -> telebot.types.Update:
+    message = {'message_id': update_id, 'date': int(time.time()), 'text': text,
+               'chat': {'id': user_id, 'type': 'private'},
+               'from': {'id': user_id, 'is_bot': False, 'first_name': 'Benchmark'}}
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+    return telebot.types.Update.de_json({'update_id': update_id, 'message': message})
+
+
+def synthetic_updates(count: int) -> list[telebot.types.Update]:
+    """A mix of commands, plain text and messages from strangers, roughly what the bot sees in a chat."""
+    pattern = [(ADMIN_ID, '/start'), (ADMIN_ID, '/help'), (ADMIN_ID, 'Привет'), (ADMIN_ID, '/admin'),
+               (ADMIN_ID, '/unknown'), (UNAUTHORIZED_USER_ID, '/start')]
+    return [make_update(i, *pattern[i % len(pattern)]) for i in range(1, count + 1)]
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    latencies: list[float] = field(default_factory=list)
+    total_seconds: float = 0
+
+    @property
+    def throughput(self) -> float:
+        return len(self.latencies) / self.total_seconds if self.total_seconds else 0
+
+    @property
+    def p50(self) -> float:
+        return statistics.median(self.latencies)
+
+    @property
+    def p95(self) -> float:
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def to_dict(self) -> dict:
+        return {'operations': len(self.latencies), 'throughput': self.throughput, 'p50': self.p50, 'p95': self.p95}
+
+
+def measure(name: str, operation: Callable[[], None], iterations: int,
+            setup: Callable[[], None] | None = None) -> BenchmarkResult:
+    """Runs operation `iterations` times, setup (if any) runs before each call and is not measured."""
+    result = BenchmarkResult(name)
+    for _ in range(iterations):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        operation()
+        elapsed = time.perf_counter() - started
+        result.latencies.append(elapsed)
+        result.total_seconds += elapsed
+    return result
+
+
+class ReplayBench:
+    def __init__(self, backend: BackendName = config.DB_BACKEND):
+        # FakeTelegram has no rate limits, pacing replies would only measure how long the benchmark sleeps
+        config.OUTBOX_GLOBAL_RATE = config.OUTBOX_CHAT_RATE = config.OUTBOX_CHAT_BURST = 1_000_000
+        self.telegram = FakeTelegram()
+        apihelper.CUSTOM_REQUEST_SENDER = self.telegram
+        self.session = FakeStatsSession()
+        self.db = Database(backend=MySQLBackend() if backend == 'mysql' else SQLiteBackend(BENCH_SQLITE_PATH))
+        self.api = StatsAPIHandler(database=self.db, session=self.session)
+        self.bot = BetBot(stats_api=self.api, database=self.db, event_bus=EventBus(), threaded=False)
+
+    def _execute(self, *queries: str) -> None:
+        with self.db:
+            for q in queries:
+                self.db.cur.execute(q)
+
+    def _clear_contest_data(self) -> None:
+        self._execute("DELETE FROM matches", "DELETE FROM contests", "DELETE FROM teams")
+        self.db.reset_requests_counter()
+
+    def contest_creation(self, iterations: int) -> BenchmarkResult:
+        return measure('contest_creation', lambda: self.bot._create_betting_contest(*LEAGUES[0]), iterations,
+                       self._clear_contest_data)
+
+    def calendar_sync(self, iterations: int) -> BenchmarkResult:
+        self._clear_contest_data()
+        contest = self.api.get_current_season(*LEAGUES[0])
+        self.db.add_contest(contest)
+        self.db.insert_missing_teams(self.api.get_league_teams(contest['season_api_id'], contest['year']))
+
+        def sync():
+            self.db.upsert_match_rows(MATCH_COLUMNS, self.api.get_calendar_rows(contest))
+
+        return measure('calendar_sync', sync, iterations, self.db.reset_requests_counter)
+
+    def message_handling(self, iterations: int) -> BenchmarkResult:
+        updates = iter(synthetic_updates(iterations))
+        return measure('message_handling', lambda: self.bot.process_new_updates([next(updates)]), iterations)
+
+
+def _read_fixtures_payload() -> bytes:
+    with open(os.path.join(FIXTURES_DIR, 'fixtures.json'), 'rb') as f:
+        return f.read()
+
+
+def calendar_decoding(iterations: int) -> BenchmarkResult:
+    """Decoding of a full season calendar response into match rows, no database needed."""
+    content = _read_fixtures_payload()
+    return measure('calendar_decoding', lambda: fixtures_to_rows(decode_json(content)['response'], 0, 0), iterations)
+
+
+def dict_calendar(content: bytes, season_api_id: int, year: int) -> list[dict]:
+    """The calendar decoding fixtures_to_rows() replaced: json.loads() and a dict per match, kept for comparison."""
+    return [
+        {
+            'match_id': m['fixture']['id'],
+            'season_api_id': season_api_id,
+            'season_year': year,
+            'match_datetime': m['fixture']['date'],
+            'round': int(m['league']['round'].split(' - ')[-1]),
+            'home_team_id': m['teams']['home']['id'],
+            'away_team_id': m['teams']['away']['id'],
+            'score': f"{m['goals']['home']}-{m['goals']['away']}",
+            'home_goals': m['goals']['home'],
+            'away_goals': m['goals']['away'],
+            'status_long': m['fixture']['status']['long'],
+            'status_short': m['fixture']['status']['short']
+        }
+        for m in json.loads(content)['response']
+    ]
+
+
+def calendar_decoding_dicts(iterations: int) -> BenchmarkResult:
+    """Same payload as calendar_decoding through the dict-based path, the reference it is compared with."""
+    content = _read_fixtures_payload()
+    return measure('calendar_decoding_dicts', lambda: dict_calendar(content, 0, 0), iterations)
+
+
+SCENARIOS: dict[str, int] = {'contest_creation': 5, 'calendar_sync': 20, 'message_handling': 500,
+                             'calendar_decoding': 200, 'calendar_decoding_dicts': 200}
+OFFLINE_SCENARIOS: dict[str, Callable[[int], BenchmarkResult]] = {'calendar_decoding': calendar_decoding,
+                                                                  'calendar_decoding_dicts': calendar_decoding_dicts}
+# Scenario -> the reference it is reported against when both run
+COMPARISONS: dict[str, str] = {'calendar_decoding': 'calendar_decoding_dicts'}
+
+
+def compare_with_baseline(results: list[BenchmarkResult], baseline: dict, tolerance: float) -> list[str]:
+    """Returns a description of every regression beyond tolerance."""
+    regressions = []
+    for r in results:
+        base = baseline.get(r.name)
+        if not base:
+            continue
+        if r.p50 > base['p50'] * (1 + tolerance):
+            regressions.append(f"{r.name}: p50 {r.p50 * 1000:.2f} ms vs baseline {base['p50'] * 1000:.2f} ms")
+        if r.throughput < base['throughput'] * (1 - tolerance):
+            regressions.append(f"{r.name}: throughput {r.throughput:.1f}/s vs baseline {base['throughput']:.1f}/s")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Offline replay benchmarks')
+    parser.add_argument('-s', '--scenario', action='append', choices=list(SCENARIOS),
+                        help='scenario to run, may be repeated (default: all)')
+    parser.add_argument('-t', '--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('-b', '--backend', action='append', choices=['mysql', 'sqlite'],
+                        help=f'storage backend, may be repeated to compare them (default: {config.DB_BACKEND})')
+    parser.add_argument('--keep-db', action='store_true', help='do not drop the benchmark database afterwards')
+    args = parser.parse_args()
+
+    names = args.scenario or list(SCENARIOS)
+    results = [OFFLINE_SCENARIOS[name](SCENARIOS[name]) for name in names if name in OFFLINE_SCENARIOS]
+    db_scenarios = [name for name in names if name not in OFFLINE_SCENARIOS]
+
+    backends = (args.backend or [config.DB_BACKEND]) if db_scenarios else []
+    if 'mysql' in backends and DB_NAME == PRODUCTION_DB_NAME:
+        print(f"Refusing to benchmark against '{PRODUCTION_DB_NAME}', set MYSQL_DB_NAME to a scratch database")
+        return 2
+    for backend in backends:
+        bench = ReplayBench(backend)
+        try:
+            backend_results = [getattr(bench, name)(SCENARIOS[name]) for name in db_scenarios]
+        finally:
+            bench.bot.outbox.stop()
+            if not args.keep_db:
+                bench.db.backend.drop()
+        if backend != 'mysql':
+            for r in backend_results:
+                r.name = f"{r.name}@{backend}"
+        results += backend_results
+
+    print(f"{'scenario':<28}{'ops':>8}{'ops/s':>12}{'p50 ms':>12}{'p95 ms':>12}")
+    for r in results:
+        print(f"{r.name:<28}{len(r.latencies):>8}{r.throughput:>12.1f}{r.p50 * 1000:>12.2f}{r.p95 * 1000:>12.2f}")
+
+    by_name = {r.name: r for r in results}
+    for name, reference in COMPARISONS.items():
+        if name in by_name and reference in by_name:
+            print(f"{name}: p50 {by_name[reference].p50 / by_name[name].p50:.2f}x faster than {reference}")
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+
+    if args.save_baseline:
+        baseline.update({r.name: r.to_dict() for r in results})
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Baseline saved to {BASELINE_PATH}")
+        return 0
+
+    if not baseline:
+        print(f"No baseline at {BASELINE_PATH}, run with --save-baseline to create one")
+        return 0
+
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    for r in regressions:
+        print(f"REGRESSION {r}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,25 @@
+import argparse
 import datetime
+import functools
 import logging
+import time
 import telebot
 from dotenv import load_dotenv
 from bot_text_messages import *
 import config
-from typing import List, Tuple, Callable, Union
+from typing import List, Tuple, Callable, Union, Iterable
 from stats_api import StatsAPIHandler
+from analytics import SeasonAnalytics
+from backfill import BackfillRunner
+import archive
 from database import Database
+from lifecycle import Lifecycle
+from cluster import ClusterNode
+from outbox import Outbox
+import scheduler
 from utilities import initialize_logging, load_confidentials_from_env
+import metrics
+from metrics import timed
 
 initialize_logging()
 # TODO use load_confidential_data.py
@@ -16,8 +28,8 @@ TELEGRAM_TOKEN: str = load_confidentials_from_env("TELEGRAM_TOKEN")
 # TODO get rid of test account id and read it from db
 ADMIN_ID = int(load_confidentials_from_env("ADMIN_ID"))
 TEST_ACCOUNT_ID = int(load_confidentials_from_env("TEST_ACCOUNT_ID"))
-COUNTRY: str = 'Russia'
-LEAGUE: str = 'Premier League'
+
+TELEGRAM_UPDATES = metrics.counter('telegram_updates_total', 'Updates received from Telegram')
 
 
 class EventBus:
@@ -41,6 +53,7 @@ class BetBot(telebot.TeleBot):
     MENU_COMMANDS_TEXT: List[Tuple[str, str]] = [
         ('start', 'Запустить бота'),
         ('help', 'Перечень доступных команд'),
+        ('stats', 'Моя статистика'),
         ('admin', 'Функционал администратора')
     ]
 
@@ -51,15 +64,19 @@ class BetBot(telebot.TeleBot):
     # Admin only commands available after inputting 'admin' command:
     ADMIN_COMMANDS_TEXT: List[str] = [
         'Создать соревнование',
-        'Команда 2',
-        'Команда 3'
+        'Архивировать завершенные сезоны',
+        'Загрузить прошлые сезоны'
     ]
 
-    def __init__(self, stats_api: StatsAPIHandler, database: Database, event_bus: EventBus):
-        super().__init__(token=TELEGRAM_TOKEN, parse_mode=None)
+    def __init__(self, stats_api: StatsAPIHandler, database: Database, event_bus: EventBus,
+                 analytics: SeasonAnalytics | None = None, threaded: bool = True):
+        super().__init__(token=TELEGRAM_TOKEN, parse_mode=None, threaded=threaded)
         self.api = stats_api
         self.db = database
         self.event_bus = event_bus
+        self.analytics = analytics
+        self.outbox = Outbox(self, database)
+        self.outbox.start()
 
         self.set_my_commands(commands=BetBot.MENU_TELEBOT_COMMANDS)
         self.commands = self.get_available_commands()
@@ -71,6 +88,11 @@ class BetBot(telebot.TeleBot):
             func=lambda query: 'admin' in query.data
         )
 
+    def process_new_updates(self, updates: List[telebot.types.Update]) -> None:
+        for u in updates:
+            TELEGRAM_UPDATES.inc(type='callback_query' if u.callback_query else 'message' if u.message else 'other')
+        super().process_new_updates(updates)
+
     def get_available_commands(self) -> List[str]:
         """Returns a list of / commands available for all users"""
         return [f'/{c.command}' for c in self.get_my_commands()]
@@ -78,12 +100,31 @@ class BetBot(telebot.TeleBot):
     def notify_admin(self, text: str) -> None:
         """Sends message to admin only"""
         prefix = f"{datetime.datetime.now().strftime(config.PREFERRED_TIME_FORMAT)}\n"
-        self.send_message(chat_id=ADMIN_ID, text=prefix + text, parse_mode='HTML')
+        self.outbox.send(chat_id=ADMIN_ID, text=prefix + text, parse_mode='HTML')
+
+    def broadcast(self, chat_ids: Iterable[int], text: str, parse_mode: str | None = None) -> int:
+        """Sends the same message to every chat at the pace Telegram allows. Returns the number of messages queued."""
+        return self.outbox.broadcast(chat_ids, text, parse_mode)
 
     def start(self):
         self.notify_admin('<b>Бот запущен!</b>')
         self.polling(none_stop=True)
 
+    def stop(self, timeout: float = config.SHUTDOWN_TIMEOUT) -> None:
+        """Stops polling and lets handlers finish the updates already received, for at most `timeout` seconds."""
+        self.stop_polling()
+        if not self.threaded:
+            return
+        deadline = time.monotonic() + timeout
+        while not self.worker_pool.tasks.empty() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        if not self.worker_pool.tasks.empty():
+            logging.warning(f"Bot stopped with {self.worker_pool.tasks.qsize()} updates left unhandled.")
+        for w in self.worker_pool.workers:
+            w.stop()  # exits after the update in hand
+        for w in self.worker_pool.workers:
+            w.join(max(deadline - time.monotonic(), 0))
+
     @staticmethod
     def authorized_users(message_handler: Callable) -> Callable:
         """
@@ -97,15 +138,17 @@ class BetBot(telebot.TeleBot):
 
         """
 
+        @functools.wraps(message_handler)
         def wrapper(self, message):
             if message.from_user.id not in self.allowed_users_ids:
                 self.delete_message(message.chat.id, message.id)
-                self.send_message(message.chat.id, BOT_ACCESS_DENIED_MESSAGE)
+                self.outbox.send(message.chat.id, BOT_ACCESS_DENIED_MESSAGE)
             else:
                 message_handler(self, message)
 
         return wrapper
 
+    @timed()
     @authorized_users
     def handle_message(self, message: telebot.types.Message) -> None:
         keyboard = None
@@ -115,8 +158,9 @@ class BetBot(telebot.TeleBot):
             response_message, keyboard = self.handle_command(message)
         else:
             response_message = 'Текстовые сообщения ботом не принимаются'
-        self.send_message(message.from_user.id, response_message, reply_markup=keyboard)
+        self.outbox.send(message.from_user.id, response_message, reply_markup=keyboard)
 
+    @timed()
     def handle_command(self, message: telebot.types.Message) \
             -> tuple[str, Union[telebot.types.InlineKeyboardMarkup, None]]:
 
@@ -128,6 +172,8 @@ class BetBot(telebot.TeleBot):
         elif message.text == '/help':
             commands_n_descriptions = ''.join([f'/{c.command} - {c.description}\n' for c in self.get_my_commands()])
             response_message = BOT_HELP_MESSAGE.format(commands_n_descriptions)
+        elif message.text == '/stats':
+            response_message = self._user_stats_message(message.from_user.id)
         elif message.text == '/admin':
             if message.from_user.id != ADMIN_ID:
                 response_message = BOT_ADMIN_COMMANDS_DENIED_MESSAGE
@@ -138,14 +184,32 @@ class BetBot(telebot.TeleBot):
             response_message = BOT_COMMAND_NOT_SUPPORTED_MESSAGE
         return (response_message, keyboard)
 
+    def _user_stats_message(self, telegram_id: int) -> str:
+        if not self.analytics:
+            return BOT_COMMAND_NOT_SUPPORTED_MESSAGE
+        messages = []
+        for c in self.db.read_active_contests():
+            stats = self.analytics.get_user_stats(telegram_id, c['season_api_id'], c['year'])
+            if stats:
+                messages.append(BOT_USER_STATS_MESSAGE.format(
+                    c['league_country'], c['league_name'], c['year'], c['year'] + 1,
+                    stats.predictions, stats.hits, stats.hit_rate, stats.exact_scores, stats.points,
+                    stats.current_streak, stats.best_streak, stats.best_round or '-', stats.best_round_points
+                ))
+        return ''.join(messages) or BOT_NO_USER_STATS_MESSAGE
+
+    @timed()
     def handle_admin_callback(self, callback_query: telebot.types.CallbackQuery) -> None:
         chat_id = callback_query.from_user.id
         message_id = callback_query.message.id
 
         if callback_query.data == 'admin_button1':
-            self._create_betting_contest()
+            for league_country, league_name in config.LEAGUES:
+                self._create_betting_contest(league_country, league_name)
         elif callback_query.data == 'admin_button2':
-            self._feature_not_ready_yet()
+            self._archive_finished_contests()
+        elif callback_query.data == 'admin_button3':
+            self._backfill_past_seasons()
         else:
             self._feature_not_ready_yet()
 
@@ -158,27 +222,32 @@ class BetBot(telebot.TeleBot):
         inline_keyboard.add(*buttons)
         return inline_keyboard
 
-    def _create_betting_contest(self) -> None:
-        logging.info('A command to create a new betting contest received...')
+    def _create_betting_contest(self, league_country: str, league_name: str) -> None:
+        logging.info(f"A command to create a new betting contest for '{league_country}, {league_name}' received...")
 
-        if self._current_football_season_already_in_db():
+        if self._current_football_season_already_in_db(league_country, league_name):
             return
 
-        if not self._country_supported():
+        if not self._country_supported(league_country):
             return
 
         logging.info('Creating new betting contest...')
         self.notify_admin(BOT_CREATING_NEW_BETTING_CONTEST)
 
-        current_football_season = self._create_current_football_season()
+        # Everything is downloaded first and stored in one transaction, an interrupted creation leaves nothing
+        current_football_season = self._download_current_football_season(league_country, league_name)
         if not current_football_season:
             return
 
-        season_api_id = current_football_season['season_api_id']
-        year = current_football_season['year']
-        self._update_team_list(season_api_id, year)
+        teams_list = self._download_team_list(current_football_season['season_api_id'],
+                                              current_football_season['year'])
+        self.notify_admin(BOT_CREATING_NEW_CALENDAR)
+        logging.info('Downloading season calendar...')
+        calendar = self._download_calendar(current_football_season)
+        if not calendar:
+            return
 
-        self._create_calendar(current_football_season)
+        self._store_betting_contest(current_football_season, teams_list, calendar)
 
         country = current_football_season['league_country']
         league = current_football_season['league_name']
@@ -186,15 +255,11 @@ class BetBot(telebot.TeleBot):
         logging.info(f"Betting contest for {country} {league} season {season}-{season + 1} created.")
         self.notify_admin( BOT_NEW_BETTING_CONTEST_CREATED.format(country, league, season, season + 1))
 
-    def _read_current_football_season(self) -> dict | None:
-        contests = self.db.read_contests()
-        for c in contests:
-            if c['is_active'] == 1:
-                return c
-        return None
+    def _read_current_football_season(self, league_country: str, league_name: str) -> dict | None:
+        return self.db.read_active_contest(league_country, league_name)
 
-    def _current_football_season_already_in_db(self) -> bool:
-        current_season = self._read_current_football_season()
+    def _current_football_season_already_in_db(self, league_country: str, league_name: str) -> bool:
+        current_season = self._read_current_football_season(league_country, league_name)
         if current_season:
             league_country = current_season['league_country']
             league_name = current_season['league_name']
@@ -207,25 +272,18 @@ class BetBot(telebot.TeleBot):
             return True
         return False
 
-    def _country_supported(self) -> bool:
-        if not self.api.country_supported(COUNTRY):
+    def _country_supported(self, country: str) -> bool:
+        if not self.api.country_supported(country):
             logging.error(f"Failed to create contest. "
-                          f"Could not find '{COUNTRY}' in the statistics service database. "
+                          f"Could not find '{country}' in the statistics service database. "
                           f"Country support may have ended.")
-            self.notify_admin(BOT_FAILED_TO_CREATE_BETTING_CONTEST_COUNTRY_NOT_SUPPORTED.format(COUNTRY))
+            self.notify_admin(BOT_FAILED_TO_CREATE_BETTING_CONTEST_COUNTRY_NOT_SUPPORTED.format(country))
             return False
         return True
 
-    def _create_current_football_season(self) -> None | dict[str, str | int]:
-        current_season = self._download_current_football_season()
-        if not current_season:
-            return
-        self._store_current_football_season_in_db(current_season)
-        return current_season
-
-    def _download_current_football_season(self) -> None | dict[str, str | int]:
+    def _download_current_football_season(self, league_country: str, league_name: str) \
+            -> None | dict[str, str | int]:
         self.notify_admin(BOT_ATTEMPT_TO_DOWNLOAD_CURRENT_SEASON_INFO)
-        league_country, league_name = COUNTRY, LEAGUE
         current_season = self.api.get_current_season(league_country, league_name)
         if not current_season:
             logging.error(f"Failed to create contest. "
@@ -237,24 +295,11 @@ class BetBot(telebot.TeleBot):
         logging.info(f"Current season '{league_name}, {league_country}' data obtained")
         return current_season
 
-    def _store_current_football_season_in_db(self, current_season: dict[str, str | int]) -> None:
-        self.notify_admin("Сохранение футбольного чемпионата в базе данных...")
-        self.db.add_contest(current_season)
-        self.notify_admin(BOT_CURRENT_FOOTBALL_SEASON_ADDED_TO_DB)
-
-    def _update_team_list(self, season_api_id: int, year: int) -> None:
+    def _download_team_list(self, season_api_id: int, year: int) -> list[dict]:
         self.notify_admin('Загружаем список команд чемпионата...')
         teams_list = self.api.get_league_teams(season_api_id, year)
         self.notify_admin('Команды загружены.')
-        self.db.insert_missing_teams(teams_list)
-        self.notify_admin('Обновляем команды в базе данных.')
-        self.notify_admin(BOT_TEAM_LIST_UPDATED)
-
-    def _create_calendar(self, current_season: dict[str, str | int]) -> None:
-        self.notify_admin(BOT_CREATING_NEW_CALENDAR)
-        logging.info('Downloading season calendar...')
-        calendar = self._download_calendar(current_season)
-        self._store_calendar_in_db(calendar)
+        return teams_list
 
     def _download_calendar(self, current_season: dict[str, str | int]) -> list[dict] | None:
         self.notify_admin('Загружаем календарь чемпионата...')
@@ -266,11 +311,54 @@ class BetBot(telebot.TeleBot):
         self.notify_admin(BOT_CALENDAR_DOWNLOADED)
         return full_calendar
 
-    def _store_calendar_in_db(self, calendar: list[dict]) -> None:
-        self.notify_admin('Сохраняем календарь в базе данных...')
-        self.db.insert_matches(calendar)
+    def _store_betting_contest(self, current_season: dict[str, str | int], teams_list: list[dict],
+                               calendar: list[dict]) -> None:
+        self.notify_admin('Сохраняем чемпионат, команды и календарь в базе данных...')
+        self.db.create_contest(current_season, teams_list, calendar)
+        # The first round may be less than a day away, too soon to wait for the next calendar sync
+        scheduler.schedule_round_reminders()
+        self.notify_admin(BOT_CURRENT_FOOTBALL_SEASON_ADDED_TO_DB)
+        self.notify_admin(BOT_TEAM_LIST_UPDATED)
         self.notify_admin(BOT_CALENDAR_ADDED_TO_DB)
 
+    def recover_incomplete_contests(self) -> None:
+        """Removes contests left without a calendar by an interrupted creation, so that they can be created again."""
+        incomplete = self.db.read_incomplete_contests()
+        for c in incomplete:
+            self.db.delete_contest(c['season_api_id'], c['year'])
+            logging.warning(f"Incomplete contest {c['league_country']} {c['league_name']} {c['year']} removed.")
+            self.notify_admin(BOT_INCOMPLETE_CONTEST_REMOVED.format(c['league_country'], c['league_name'],
+                                                                    c['year'], c['year'] + 1))
+        if incomplete:
+            scheduler.schedule_round_reminders()
+
+    def _archive_finished_contests(self) -> None:
+        finished = [c for c in self.db.read_contests() if not c['is_active']]
+        if not finished:
+            self.notify_admin(BOT_NO_FINISHED_CONTESTS_TO_ARCHIVE)
+            return
+        archived = 0
+        for c in finished:
+            path = archive.export_contest(self.db, c['season_api_id'], c['year'])
+            if path:
+                archived += 1
+                self.notify_admin(BOT_CONTEST_ARCHIVED.format(c['league_country'], c['league_name'], c['year'],
+                                                              c['year'] + 1))
+            else:
+                self.notify_admin(BOT_FAILED_TO_ARCHIVE_CONTEST.format(c['league_country'], c['league_name'],
+                                                                       c['year'], c['year'] + 1))
+        if archived and self.analytics:
+            self.analytics.load()  # drops the statistics of archived seasons
+
+    def _backfill_past_seasons(self) -> None:
+        runner = BackfillRunner(self.api, self.db)
+        for league_country, league_name in config.LEAGUES:
+            active = self.db.read_active_contest(league_country, league_name)
+            last_year = (active['year'] if active else datetime.date.today().year) - 1
+            runner.enqueue(league_country, league_name, config.BACKFILL_FIRST_YEAR, last_year)
+        scheduler.run_backfill_now()
+        self.notify_admin(BOT_BACKFILL_QUEUED.format(config.BACKFILL_FIRST_YEAR))
+
     def on_requests_quota_reached(self, used_quota: int) -> None:
         """
         Handles events when the daily requests quota is reached or significant thresholds are met.
@@ -309,13 +397,46 @@ class BetBot(telebot.TeleBot):
 if __name__ == "__main__":
     from pprint import pprint
 
+    parser = argparse.ArgumentParser(description='Football betting Telegram bot')
+    parser.add_argument('--cluster', action='store_true',
+                        help='run as one of several processes sharing the database, see cluster.py')
+    parser.add_argument('--metrics-port', type=int, default=config.METRICS_PORT)
+    args = parser.parse_args()
+
+    lifecycle = Lifecycle()
     event_bus = EventBus()
-    bot = BetBot(stats_api=StatsAPIHandler(), database=Database(), event_bus=EventBus())
+    db = Database(shared_cache=args.cluster)
+    db.warm_up_cache()
+    analytics = SeasonAnalytics(db)
+    analytics.load()
+    # In cluster mode updates are handled by the node's worker threads, one at a time each
+    bot = BetBot(stats_api=StatsAPIHandler(database=db), database=db, event_bus=event_bus, analytics=analytics,
+                 threaded=not args.cluster)
 
     # bot._create_betting_contest()
     # bot.create_calendar(235, 2023)
 
-    # scheduler.bot_scheduler.start()
+    metrics_server = metrics.start_http_server(args.metrics_port, config.METRICS_HOST)
     # scheduler.bot_scheduler.print_jobs()
 
-    bot.start()
+    if args.cluster:
+        # The leader recovers contests and starts the scheduler once elected
+        node = ClusterNode(bot, db)
+        run, on_signal = node.run, node.request_stop
+        lifecycle.on_shutdown('cluster', node.stop)
+    else:
+        bot.recover_incomplete_contests()
+        scheduler.init_scheduler(bot, db)
+        run, on_signal = bot.start, bot.stop_polling
+        lifecycle.on_shutdown('bot', bot.stop)
+
+    # Handlers may still schedule jobs while finishing, so the bot goes first
+    lifecycle.on_shutdown('scheduler', scheduler.shutdown_scheduler)
+    # Last to go, everything before it may still be sending messages
+    lifecycle.on_shutdown('outbox', bot.outbox.stop)
+    lifecycle.on_shutdown('metrics', metrics_server.shutdown)
+    lifecycle.install_signal_handlers(on_signal=on_signal)
+    try:
+        run()
+    finally:
+        lifecycle.shutdown()
@@ -98,4 +98,42 @@ BOT_CALENDAR_ADDED_TO_DB = '''
 '''
 BOT_NEW_BETTING_CONTEST_CREATED = '''
 Соревнование по ставкам <b>'{} {} сезона {}-{}'</b> создано!
-'''
\ No newline at end of file
+'''
+BOT_USER_STATS_MESSAGE = '''
+{} {} {}-{}
+
+Прогнозов: {}
+Угадано исходов: {} ({:.0%})
+Точных счетов: {}
+Очков: {}
+Текущая серия: {}
+Лучшая серия: {}
+Лучший тур: {} ({} очк.)
+'''
+BOT_NO_USER_STATS_MESSAGE = '''
+Статистика появится после первого сыгранного матча с вашим прогнозом.
+'''
+BOT_NO_FINISHED_CONTESTS_TO_ARCHIVE = '''
+Завершенных сезонов для архивации нет.
+'''
+BOT_CONTEST_ARCHIVED = '''
+Сезон <b>'{} {} {}-{}'</b> перенесен в архив.
+'''
+BOT_FAILED_TO_ARCHIVE_CONTEST = '''
+<b>Не удалось перенести в архив сезон '{} {} {}-{}'.</b>
+'''
+BOT_BACKFILL_QUEUED = '''
+Загрузка прошлых сезонов начиная с {} года поставлена в очередь.
+Она идет в фоне и использует только остаток дневного лимита запросов.
+'''
+BOT_INCOMPLETE_CONTEST_REMOVED = '''
+Создание сезона <b>'{} {} {}-{}'</b> было прервано, календарь не сохранен.
+Незавершенный сезон удален, его можно создать заново.
+'''
+BOT_ROUND_REMINDER = '''
+<b>{} {}, {} тур</b> начнется {} (МСК).
+Вы еще не сделали прогнозы на этот тур.
+
+{}
+'''
+BOT_ROUND_REMINDER_MATCH = '{} {} — {}'
@@ -0,0 +1,226 @@
+"""
+Cluster mode: several bot processes sharing one MySQL database.
+
+    python bet_bot.py --cluster --metrics-port 9108
+    python bet_bot.py --cluster --metrics-port 9109    # as many as needed, on any host
+
+Processes elect a leader through a lease row in `leader_leases`, renewed every LEADER_LEASE_RENEW_SECONDS
+and taken over by another process once it hasn't been renewed for LEADER_LEASE_SECONDS. Only the leader
+polls Telegram and runs the scheduler (counter reset, sync, backfill). Polled updates go to `work_queue`,
+every process, the leader included, claims and handles them. An update handled by a process that died
+is handed out again after WORK_QUEUE_VISIBILITY_TIMEOUT, one that keeps failing is given up after
+WORK_QUEUE_MAX_ATTEMPTS.
+
+Every process keeps reference data and user statistics in memory. Writes to them bump a row in
+`cache_versions` (Database(shared_cache=True)), each process checks those every CLUSTER_CACHE_CHECK_SECONDS
+and drops what another process changed, so a contest created on any node reaches the leader's sync.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import telebot
+from telebot import apihelper
+import config
+import metrics
+import scheduler
+from database import Database
+from utilities import initialize_logging
+
+LEADER_LEASE_NAME = 'leader'
+TELEGRAM_UPDATE_KIND = 'telegram_update'
+LONG_POLLING_TIMEOUT = 10  # seconds, shorter than the lease so a leader that lost it stops polling soon after
+
+IS_LEADER = metrics.gauge('cluster_is_leader', 'Whether this process currently holds the leader lease')
+LEADER_CHANGES = metrics.counter('cluster_leader_changes_total', 'Leadership acquired or lost by this process')
+WORK_ITEMS = metrics.counter('work_queue_items_total', 'Work queue items handled by outcome')
+# In-memory statistics of SeasonAnalytics are rebuilt from these
+STATS_TABLES: frozenset[str] = frozenset({'user_stats', 'user_round_points', 'processed_results'})
+
+WORK_ITEM_SECONDS = metrics.histogram('work_queue_item_seconds', 'Time to handle a single work queue item')
+
+initialize_logging()
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class ClusterNode:
+    def __init__(self, bot: telebot.TeleBot, database: Database, worker_id: str | None = None,
+                 worker_threads: int = config.CLUSTER_WORKER_THREADS):
+        self.bot = bot
+        self.db = database
+        self.worker_id = worker_id or default_worker_id()
+        self.worker_threads = worker_threads
+        self._stop = threading.Event()
+        self._leader = threading.Event()
+        self._lease_valid_until = 0.0
+        self._threads: list[threading.Thread] = []
+
+    @property
+    def is_leader(self) -> bool:
+        # Leadership is given up locally as soon as the lease may have expired, whether renewal failed or hung
+        return self._leader.is_set() and time.monotonic() < self._lease_valid_until
+
+    def run(self) -> None:
+        """Blocks until request_stop() is called."""
+        logging.info(f"Cluster node '{self.worker_id}' started.")
+        self._start_thread('cluster-poller', self._poll_updates)
+        self._start_thread('cluster-cache-watcher', self._watch_cache_versions)
+        for i in range(self.worker_threads):
+            self._start_thread(f'cluster-worker-{i + 1}', self._handle_updates)
+        while not self._stop.is_set():
+            try:
+                self._renew_leadership()
+            except Exception as e:
+                logging.exception(f"Failed to run leader duties. Error: {e.__repr__()}.")
+            self._stop.wait(config.LEADER_LEASE_RENEW_SECONDS)
+
+    def request_stop(self) -> None:
+        self._stop.set()
+
+    def stop(self, timeout: float = config.SHUTDOWN_TIMEOUT) -> None:
+        """Stops polling and claiming, waits for updates in hand and hands the lease over right away."""
+        self._stop.set()
+        deadline = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(max(deadline - time.monotonic(), 0))
+        if self._leader.is_set():
+            self._step_down()
+            self.db.release_lease(LEADER_LEASE_NAME, self.worker_id)
+
+    def _start_thread(self, name: str, target) -> None:
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _renew_leadership(self) -> None:
+        requested = time.monotonic()
+        try:
+            acquired = self.db.try_acquire_lease(LEADER_LEASE_NAME, self.worker_id, config.LEADER_LEASE_SECONDS)
+        except Exception as e:
+            logging.error(f"Failed to renew leader lease. Error: {e.__repr__()}.")
+            acquired = False
+
+        if acquired:
+            self._lease_valid_until = requested + config.LEADER_LEASE_SECONDS
+            if not self._leader.is_set():
+                self._become_leader()
+            self._leader_housekeeping()
+        elif self._leader.is_set():
+            self._step_down()
+
+    def _become_leader(self) -> None:
+        self._leader.set()
+        IS_LEADER.set(1)
+        LEADER_CHANGES.inc(change='acquired')
+        logging.info(f"Cluster node '{self.worker_id}' became the leader.")
+        if self.bot.analytics:
+            self.bot.analytics.load()  # results applied by the previous leader
+        self.bot.recover_incomplete_contests()
+        scheduler.start_or_resume_scheduler(self.bot, self.db)
+
+    def _step_down(self) -> None:
+        self._leader.clear()
+        IS_LEADER.set(0)
+        LEADER_CHANGES.inc(change='lost')
+        scheduler.pause_scheduler()
+        logging.warning(f"Cluster node '{self.worker_id}' is no longer the leader.")
+
+    def _leader_housekeeping(self) -> None:
+        requeued = self.db.requeue_stale_work(config.WORK_QUEUE_VISIBILITY_TIMEOUT)
+        if requeued:
+            logging.warning(f"{requeued} work queue items of unresponsive workers handed out again.")
+        self.db.delete_finished_work(config.WORK_QUEUE_RETENTION_HOURS)
+
+    def _poll_updates(self) -> None:
+        offset = None
+        while not self._stop.is_set():
+            if not self.is_leader:
+                offset = None  # a new term starts with whatever Telegram hasn't had confirmed
+                self._stop.wait(config.WORK_QUEUE_POLL_INTERVAL)
+                continue
+            try:
+                updates = apihelper.get_updates(self.bot.token, offset=offset, timeout=LONG_POLLING_TIMEOUT,
+                                                long_polling_timeout=LONG_POLLING_TIMEOUT)
+            except Exception as e:
+                logging.error(f"Failed to get updates from Telegram. Error: {e.__repr__()}.")
+                self._stop.wait(config.WORK_QUEUE_POLL_INTERVAL)
+                continue
+            if not updates:
+                continue
+            # Queued before the next call confirms them to Telegram, update_id makes re-polled ones no-ops
+            try:
+                queued = self.db.enqueue_work(TELEGRAM_UPDATE_KIND,
+                                              [(str(u['update_id']), json.dumps(u)) for u in updates])
+            except Exception as e:
+                # The offset stays, the same updates are polled again
+                logging.error(f"Failed to queue {len(updates)} updates. Error: {e.__repr__()}.")
+                self._stop.wait(config.WORK_QUEUE_POLL_INTERVAL)
+                continue
+            WORK_ITEMS.inc(queued, kind=TELEGRAM_UPDATE_KIND, outcome='queued')
+            if queued < len(updates):
+                WORK_ITEMS.inc(len(updates) - queued, kind=TELEGRAM_UPDATE_KIND, outcome='duplicate')
+                logging.info(f"{len(updates) - queued} of {len(updates)} updates were already queued, skipped.")
+            offset = updates[-1]['update_id'] + 1
+
+    def _watch_cache_versions(self) -> None:
+        seen: dict[str, int] = {}
+        while not self._stop.wait(config.CLUSTER_CACHE_CHECK_SECONDS):
+            try:
+                versions = self.db.read_cache_versions()
+                changed = [t for t, v in versions.items() if seen.get(t) != v]
+                if changed:
+                    self.db.cache.invalidate(*changed)
+                    # Only the leader applies results, a reload racing with that could count a result twice
+                    if self.bot.analytics and not self._leader.is_set() and STATS_TABLES.intersection(changed):
+                        self.bot.analytics.load()
+                    if self._leader.is_set() and 'contests' in changed:
+                        scheduler.schedule_round_reminders()  # a contest may have been created on another node
+                seen = versions
+            except Exception as e:
+                logging.error(f"Failed to check cache versions. Error: {e.__repr__()}.")
+
+    def _handle_updates(self) -> None:
+        while not self._stop.is_set():
+            try:
+                items = self.db.claim_work(TELEGRAM_UPDATE_KIND, self.worker_id, config.WORK_QUEUE_BATCH_SIZE)
+            except Exception as e:
+                logging.error(f"Failed to claim work. Error: {e.__repr__()}.")
+                items = ()
+            if not items:
+                self._stop.wait(config.WORK_QUEUE_POLL_INTERVAL)
+                continue
+            for i, item in enumerate(items):
+                if self._stop.is_set():
+                    # Claimed but not started, other workers take them right away instead of after a timeout
+                    for unhandled in items[i:]:
+                        self._finish_work(unhandled['item_id'], 'pending')
+                    break
+                self._handle_update(item)
+
+    def _handle_update(self, item: dict) -> None:
+        started = time.perf_counter()
+        try:
+            self.bot.process_new_updates([telebot.types.Update.de_json(item['payload'])])
+        except Exception as e:
+            failed = item['attempts'] + 1 >= config.WORK_QUEUE_MAX_ATTEMPTS
+            WORK_ITEMS.inc(kind=TELEGRAM_UPDATE_KIND, outcome='failed' if failed else 'retried')
+            logging.error(f"Failed to handle work queue item {item['item_id']}"
+                          f"{', giving up' if failed else ''}. Error: {e.__repr__()}.")
+            self._finish_work(item['item_id'], 'failed' if failed else 'pending')
+            return
+        finally:
+            WORK_ITEM_SECONDS.observe(time.perf_counter() - started, kind=TELEGRAM_UPDATE_KIND)
+        WORK_ITEMS.inc(kind=TELEGRAM_UPDATE_KIND, outcome='done')
+        self._finish_work(item['item_id'], 'done')
+
+    def _finish_work(self, item_id: int, status: str) -> None:
+        try:
+            self.db.finish_work(item_id, status)
+        except Exception as e:
+            # Left 'processing', the leader hands it out again after WORK_QUEUE_VISIBILITY_TIMEOUT
+            logging.error(f"Failed to mark work queue item {item_id} '{status}'. Error: {e.__repr__()}.")
@@ -10,3 +10,89 @@ REQUESTS_COUNTER_RESET_TIME: str = "00:00:00"
 POINTS_PER_SCORE = 4 # счёт в точности
 POINTS_PER_DIFF = 2 # разницу мячей
 POINTS_PER_RESULT = 1 # результат
+
+SCHEDULER_JOBSTORE: str = 'database'  # 'database' (persistent, MySQL) or 'memory' (fast startup, nothing persisted)
+SCHEDULER_MAX_WORKERS: int = 4  # jobs are short and I/O bound, a handful of threads is plenty
+SCHEDULER_MISFIRE_GRACE_TIME: int = 60 * 60  # seconds a missed run is still worth executing
+
+LOG_FILE: str = "MyRPLBetBot.log"
+LOG_LEVEL: str = "INFO"
+LOG_MAX_BYTES: int = 5 * 1024 * 1024
+LOG_BACKUP_COUNT: int = 5
+LOG_DEBUG_SAMPLE_RATE: float = 0.1  # share of DEBUG records actually written
+
+METRICS_HOST: str = '127.0.0.1'
+METRICS_PORT: int = 9108
+
+DB_POOL_SIZE: int = 5
+
+# Storage backend: 'mysql' (MYSQL_DB_* environment variables) or 'sqlite' (embedded, a single file)
+DB_BACKEND: str = 'mysql'
+SQLITE_PATH: str = 'db/my_rpl_bet_bot.sqlite3'
+SQLITE_BUSY_TIMEOUT_MS: int = 5000
+SQLITE_CACHE_KIB: int = 16 * 1024
+SQLITE_MMAP_BYTES: int = 256 * 1024 * 1024
+SQLITE_CACHED_STATEMENTS: int = 256
+
+COUNTRIES_CACHE_TTL: int = 7 * 24 * 60 * 60  # seconds, country support rarely changes
+
+# (country, league) pairs as named by the statistics API, a betting contest is run for each of them
+LEAGUES: list[tuple[str, str]] = [
+    ('Russia', 'Premier League'),
+]
+SYNC_WORKERS: int = 4
+SYNC_LIVE_SCORES_INTERVAL_MINUTES: int = 15
+# Live scores are polled only for leagues with a match that kicked off less than this ago and is unfinished
+SYNC_LIVE_MATCH_HOURS: int = 3
+# Part of the daily quota live scores never touch, left for calendar and teams syncs and contest creation
+SYNC_LIVE_SCORES_RESERVED_REQUESTS: int = 20
+SYNC_CALENDAR_TIME: str = "05:00:00"
+SYNC_TEAMS_DAY_OF_WEEK: str = 'mon'
+
+ASSET_CACHE_MAX_BYTES: int = 16 * 1024 * 1024
+REFERENCE_CACHE_MAX_ENTRIES: int = 256  # teams, active contests and round maps of every season read
+
+ARCHIVE_DIR: str = 'db/archive'
+INSERT_BATCH_SIZE: int = 1000
+
+BACKFILL_FIRST_YEAR: int = 2010  # earliest RPL season available in the statistics service
+BACKFILL_RESERVED_REQUESTS: int = 40  # part of the daily quota backfill never touches
+BACKFILL_INTERVAL_MINUTES: int = 30
+BACKFILL_MAX_ATTEMPTS: int = 5
+
+# Clubs scraped from premierliga.ru whose names don't resemble the api-football ones: scraped name -> api name
+TEAM_NAME_OVERRIDES: dict[str, str] = {
+    'Пари НН': 'Nizhny Novgorod',
+    'Pari NN': 'Nizhny Novgorod',
+}
+
+# Reminders to users without bets, hours before the first kickoff of each round
+REMINDER_HOURS_BEFORE_KICKOFF: tuple[int, ...] = (24, 1)
+
+# Time handlers get to finish updates already received on shutdown, the platform kills the process after 30 s
+SHUTDOWN_TIMEOUT: float = 20
+
+# Cluster mode (python bet_bot.py --cluster): one elected leader polls Telegram and runs the scheduler,
+# every process handles updates from the shared work queue
+LEADER_LEASE_SECONDS: int = 15
+LEADER_LEASE_RENEW_SECONDS: int = 5
+CLUSTER_WORKER_THREADS: int = 4
+WORK_QUEUE_POLL_INTERVAL: float = 0.5  # seconds a worker waits when the queue is empty
+WORK_QUEUE_BATCH_SIZE: int = 10
+WORK_QUEUE_VISIBILITY_TIMEOUT: int = 120  # seconds after which an item claimed by a dead worker is handed out again
+WORK_QUEUE_MAX_ATTEMPTS: int = 3
+WORK_QUEUE_RETENTION_HOURS: int = 24
+CLUSTER_CACHE_CHECK_SECONDS: float = 2  # how stale cached reference data and statistics may get on other nodes
+
+# Outbound Telegram messages, limits are per process
+# https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+OUTBOX_GLOBAL_RATE: float = 30  # messages per second to all chats
+OUTBOX_CHAT_RATE: float = 1  # messages per second to a single private chat
+OUTBOX_CHAT_BURST: int = 3
+OUTBOX_GROUP_RATE: float = 20 / 60  # messages per second to a single group
+OUTBOX_CHAT_BUCKETS_MAX: int = 10_000  # per sender, buckets of idle chats are dropped first
+OUTBOX_SENDERS: int = 4
+OUTBOX_MAX_RETRY_AFTER: int = 60  # seconds, a longer 429 pause sends the message to the retry queue instead
+OUTBOX_RETRY_INTERVAL: int = 30  # seconds between checks of the retry queue
+OUTBOX_RETRY_BASE_DELAY: int = 30  # seconds, doubles with every attempt
+OUTBOX_MAX_ATTEMPTS: int = 5
@@ -1,84 +1,110 @@
-import mysql.connector
-from mysql.connector import errorcode
 import logging
+import threading
 import config
 from utilities import initialize_logging, load_confidentials_from_env
 import datetime
-from typing import Literal
+from typing import Iterable, Literal
+from metrics import timed
+from asset_store import AssetStore
+from reference_cache import ReferenceCache
+from storage import create_backend, BackendName, MySQLBackend, SQLiteBackend
 
+# Tables whose data processes keep in memory (reference cache, user statistics), in cluster mode a write
+# to one of them is announced to the other processes through `cache_versions`
+SHARED_CACHE_TABLES: frozenset[str] = frozenset({'contests', 'teams', 'matches', 'team_identities', 'user_stats',
+                                                 'user_round_points', 'processed_results'})
 
-DB_HOST = str(load_confidentials_from_env("MYSQL_DB_HOST"))
-DB_LOGIN = str(load_confidentials_from_env("MYSQL_DB_USERNAME"))
-DB_PASSWORD = str(load_confidentials_from_env("MYSQL_DB_PASSWORD"))
-# todo input host name used by railway.app before deploying https://docs.railway.app/guides/mysql
-DB_NAME = 'my_rpl_bet_bot_db'
+# Match columns that change after a match is stored: rescheduled kickoffs and results
+MATCH_COLUMNS_TO_REFRESH: tuple[str, ...] = ('match_datetime', 'score', 'home_goals', 'away_goals',
+                                             'status_long', 'status_short')
 
 initialize_logging()
 
 
 class Database:
-    def __init__(self):
-        self.name = DB_NAME
-        self.conn = None
-        self.cur = None
+    def __init__(self, pool_size: int = config.DB_POOL_SIZE,
+                 backend: BackendName | MySQLBackend | SQLiteBackend = config.DB_BACKEND,
+                 shared_cache: bool = False):
+        """`shared_cache`: other processes cache the same data (cluster mode), writes bump `cache_versions`."""
+        if isinstance(backend, str):
+            backend = create_backend(backend, pool_size)
+        self.backend = backend
+        self.name = self.backend.name
+        self.shared_cache = shared_cache
+        # Connection and cursor are per thread: the bot, the scheduler and the API handler share one instance
+        self._local = threading.local()
+        self.assets = AssetStore(self)
+        self.cache = ReferenceCache()
         self._init_db()
 
+    @property
+    def conn(self):
+        return getattr(self._local, 'conn', None)
+
+    @conn.setter
+    def conn(self, value):
+        self._local.conn = value
+
+    @property
+    def cur(self):
+        return getattr(self._local, 'cur', None)
+
+    @cur.setter
+    def cur(self, value):
+        self._local.cur = value
+
     def __enter__(self):
-        self.conn = mysql.connector.connect(
-            host=DB_HOST,
-            user=DB_LOGIN,
-            password=DB_PASSWORD,
-            database=self.name
-        )
-        self.cur = self.conn.cursor()
+        self.conn = self.backend.acquire()
+        try:
+            self.cur = self.backend.cursor(self.conn)
+        except Exception:
+            self.backend.release(self.conn)
+            raise
         return self
 
     def __exit__(self, ext_type, exc_value, traceback):
-        self.cur.close()
-        if isinstance(exc_value, Exception):
-            self.conn.rollback()
-        else:
-            self.conn.commit()
-        self.conn.close()
+        written, self._local.written_tables = getattr(self._local, 'written_tables', set()), set()
+        try:
+            shared = sorted(written & SHARED_CACHE_TABLES) if self.shared_cache else ()
+            if shared and not isinstance(exc_value, Exception):
+                try:
+                    # In the same transaction, other processes can't see the data without the new version
+                    self.cur.executemany("INSERT INTO cache_versions (table_name, version) VALUES (%s, 1) "
+                                         "ON DUPLICATE KEY UPDATE version = version + 1", [(t,) for t in shared])
+                except Exception:
+                    self.cur.close()
+                    self.conn.rollback()
+                    raise
+            self.cur.close()
+            if isinstance(exc_value, Exception):
+                self.conn.rollback()
+            else:
+                self.conn.commit()
+                # Only after the commit, a reader must not cache what is about to change under a new version
+                self.cache.invalidate(*written)
+        finally:
+            self.backend.release(self.conn)
+
+    def _written(self, *tables: str) -> None:
+        """Marks tables changed by the current transaction, their cached data is dropped once it commits."""
+        if not hasattr(self._local, 'written_tables'):
+            self._local.written_tables = set()
+        self._local.written_tables.update(tables)
 
     def _init_db(self):
         try:
-            if not self._db_exists():
-                self._create_db()
+            created = self.backend.setup()
+            if created:
                 self._create_tables()
                 self._populate_db()
-        except mysql.connector.Error as e:
+            self._apply_migrations()
+        except self.backend.Error as e:
             logging.exception(f"Error during database initialization: {e}")
             raise  # Re-raise the exception to see the traceback in the console
 
-    def _db_exists(self) -> bool:
-        self.conn = mysql.connector.connect(host=DB_HOST, user=DB_LOGIN, password=DB_PASSWORD)
-        self.cur = self.conn.cursor()
-        self.cur.execute(f"SELECT SCHEMA_NAME FROM INFORMATION_SCHEMA.SCHEMATA WHERE SCHEMA_NAME = '{DB_NAME}'")
-        db_exists = bool(self.cur.fetchall())
-        self.cur.close()
-        self.conn.close()
-        return db_exists
-
-    def _create_db(self):
-        try:
-            self.conn = mysql.connector.connect(host=DB_HOST, user=DB_LOGIN, password=DB_PASSWORD)
-            self.cur = self.conn.cursor()
-            create_db_query = f"CREATE DATABASE IF NOT EXISTS {self.name} CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci;"
-            use_db_query = f"USE {self.name};"
-            for q in (create_db_query, use_db_query):
-                self.cur.execute(q)
-            self.conn.commit()
-            self.cur.close()
-            self.conn.close()
-            logging.info(f"'{self.name}' created!")
-        except mysql.connector.Error as e:
-            logging.exception(f"Error during database creation: {e}")
-            raise  # Re-raise the exception to see the traceback in the console
-
     def _create_tables(self):
         with self:
-            self._execute_sql_script("db/create_db_tables_mysql.sql")
+            self._execute_sql_script(self.backend.schema_path)
             logging.info(f"SQL script executed successfully. "
                          f"Tables created!")
 
@@ -91,6 +117,44 @@ class Database:
             if q.strip():
                 self.cur.execute(q)
 
+    def _apply_migrations(self) -> None:
+        """
+        Applies migrations not recorded in `schema_migrations`. MySQL commits every DDL statement on its own,
+        so a migration is not atomic: each statement is recorded in `schema_migration_steps` as it completes
+        and a migration interrupted halfway continues from the first statement not recorded. A DDL statement
+        that took effect right before the crash, without its record, is recognized by the backend and skipped.
+        """
+        with self:
+            self.cur.execute("CREATE TABLE IF NOT EXISTS schema_migrations ("
+                             "name VARCHAR(100) NOT NULL PRIMARY KEY, applied_datetime VARCHAR(20) NOT NULL)")
+            self.cur.execute("CREATE TABLE IF NOT EXISTS schema_migration_steps ("
+                             "name VARCHAR(100) NOT NULL, step SMALLINT UNSIGNED NOT NULL, PRIMARY KEY (name, step))")
+            self.cur.execute("SELECT name FROM schema_migrations")
+            applied = {r[0] for r in self.cur.fetchall()}
+
+        for name, statements in self.backend.migrations:
+            if name in applied:
+                continue
+            with self:
+                self.cur.execute("SELECT step FROM schema_migration_steps WHERE name = %s", (name,))
+                done_steps = {r[0] for r in self.cur.fetchall()}
+            if done_steps:
+                logging.warning(f"Migration '{name}' was interrupted, resuming after {len(done_steps)} statements.")
+            for step, q in enumerate(statements):
+                if step in done_steps:
+                    continue
+                with self:
+                    if self.backend.is_applied(self.cur, q):
+                        logging.warning(f"Statement {step} of migration '{name}' already applied, recording it.")
+                    else:
+                        self.cur.execute(q)
+                    self.cur.execute("INSERT INTO schema_migration_steps (name, step) VALUES (%s, %s)", (name, step))
+            with self:
+                self.cur.execute("INSERT INTO schema_migrations (name, applied_datetime) VALUES (%s, %s)",
+                                 (name, datetime.datetime.now().strftime(config.PREFERRED_DATETIME_FORMAT)))
+                self.cur.execute("DELETE FROM schema_migration_steps WHERE name = %s", (name,))
+            logging.info(f"Migration '{name}' applied.")
+
     def _populate_db(self) -> None:
         admin_user_data = {
             'telegram_id': load_confidentials_from_env('ADMIN_ID'),
@@ -115,6 +179,7 @@ class Database:
 
         logging.info(f"'{self.name}' populated. Initial data stored.")
 
+    @timed()
     def _insert_into_table(self, table_name: str, data_to_insert: dict) -> None:
         with self:
             columns = ', '.join((data_to_insert.keys()))
@@ -123,27 +188,73 @@ class Database:
             query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
             params = values
 
-            data_to_log = data_to_insert
-            if 'logo' in data_to_log: data_to_log['logo'] = 'BINARY DATA NOT LOGGED DUE TO SIZE'
+            data_to_log = {k: ('BINARY DATA NOT LOGGED DUE TO SIZE' if isinstance(v, bytes) else v)
+                           for k, v in data_to_insert.items()}
 
             try:
                 self.cur.execute(query, params)
-                logging.info(f"Data inserted. "
-                             f"Table: '{table_name}', data_to_insert: {data_to_log}.")
-            except mysql.connector.Error as e:
+                self._written(table_name)
+                logging.debug(f"Data inserted. "
+                              f"Table: '{table_name}', data_to_insert: {data_to_log}.")
+            except self.backend.Error as e:
                 logging.error(f"Failed to insert data. "
                               f"Received: table_name: '{table_name}', data_to_insert: {data_to_log}. "
                               f"Error: {e.__repr__()}.")
                 return
 
-    def _read_table(self, table: str) -> tuple[dict]:
+    @timed()
+    def _read_rows(self, query: str, params: tuple = ()) -> tuple[dict]:
         with self:
-            self.cur.execute(f"SELECT * FROM {table}")
+            self.cur.execute(query, params)
             columns = tuple(i[0] for i in self.cur.description)
             rows = self.cur.fetchall()
             result = tuple({c: r for c, r in zip(columns, r)} for r in rows)
             return result
 
+    def _read_table(self, table: str) -> tuple[dict]:
+        return self._read_rows(f"SELECT * FROM {table}")
+
+    @staticmethod
+    def _insert_query(table_name: str, columns: tuple[str, ...], ignore: bool = False) -> str:
+        return f"INSERT {'IGNORE ' if ignore else ''}INTO {table_name} ({', '.join(columns)}) " \
+               f"VALUES ({', '.join(['%s'] * len(columns))})"
+
+    @staticmethod
+    def _upsert_query(table_name: str, columns: tuple[str, ...], columns_to_update: tuple[str, ...]) -> str:
+        placeholders = ', '.join(['%s'] * len(columns))
+        updates = ', '.join(f'{c} = VALUES({c})' for c in columns_to_update)
+        return f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders}) " \
+               f"ON DUPLICATE KEY UPDATE {updates}"
+
+    @timed()
+    def _upsert_rows(self, table_name: str, rows: list[dict], columns_to_update: tuple[str, ...]) -> None:
+        """
+        Inserts rows in one batch, rows whose key already exists get `columns_to_update` overwritten instead.
+        All rows must have the same keys.
+        """
+        if not rows:
+            return
+        columns = tuple(rows[0].keys())
+        self._upsert_tuples(table_name, columns, [tuple(r[c] for c in columns) for r in rows], columns_to_update)
+
+    @timed()
+    def _upsert_tuples(self, table_name: str, columns: tuple[str, ...], rows: list[tuple],
+                       columns_to_update: tuple[str, ...]) -> None:
+        """Same as _upsert_rows() for rows already laid out as tuples in `columns` order."""
+        if not rows:
+            return
+        query = self._upsert_query(table_name, columns, columns_to_update)
+        with self:
+            try:
+                self.cur.executemany(query, rows)
+                self._written(table_name)
+                logging.info(f"Rows upserted. Table: '{table_name}', rows: {len(rows)}.")
+            except self.backend.Error as e:
+                logging.error(f"Failed to upsert rows. "
+                              f"Table: '{table_name}', rows: {len(rows)}. "
+                              f"Error: {e.__repr__()}.")
+
+    @timed()
     def _update_table(self, table_name: str, data_to_update: dict) -> None:
         with self:
             query = f"UPDATE {table_name} " \
@@ -153,19 +264,24 @@ class Database:
             values_to_update = tuple(data_to_update.values())
             try:
                 self.cur.execute(query, values_to_update)
+                self._written(table_name)
                 logging.info(f"Table updated. "
                              f"Table '{table_name}', columns: {columns_to_update}, new values: {values_to_update}'.")
-            except mysql.connector.Error as e:
+            except self.backend.Error as e:
                 logging.error(f"Failed to update table. "
                               f"Table: {table_name}, columns: {columns_to_update}, new values: {values_to_update}. "
                               f"Error: {e.__repr__()}.")
                 return
 
+    @timed()
     def _update_requests_counter(self, action: Literal['increment', 'reset']) -> None:
         """ Updates requests made today either by incrementing it by 1 either resetting it to zero. """
-        requests_today_stored = self.read_requests_counter()
-        requests_today_updated = requests_today_stored + 1 if action == 'increment' else 0
-        self._update_table('api_requests', {'requests_today': requests_today_updated})
+        if action == 'reset':
+            self._update_table('api_requests', {'requests_today': 0})
+            return
+        # Incremented in place, sync workers of different leagues make requests concurrently
+        with self:
+            self.cur.execute("UPDATE api_requests SET requests_today = requests_today + 1")
 
     def increment_requests_counter(self) -> None:
         """Increments the value of requests made today by one"""
@@ -176,37 +292,378 @@ class Database:
         self._update_requests_counter('reset')
         logging.info(f"Daily requests quota reset.")
 
+    @timed()
     def read_requests_counter(self) -> int:
         """ Gets a number of requests to the statistics data API made today. """
         return self._read_table('api_requests')[0]['requests_today']
 
+    @timed()
     def read_contests(self):
         return self._read_table('contests')
 
+    @timed()
+    def read_active_contests(self) -> tuple[dict]:
+        return self.cache.get('contests', 'active',
+                              lambda: self._read_rows("SELECT * FROM contests WHERE is_active = 1"))
+
+    @timed()
+    def read_active_contest(self, league_country: str, league_name: str) -> dict | None:
+        for c in self.read_active_contests():
+            if c['league_country'] == league_country and c['league_name'] == league_name:
+                return c
+        return None
+
+    @timed()
+    def read_teams(self) -> dict[int, dict]:
+        """Returns teams by team_id."""
+        return self.cache.get('teams', 'all', lambda: {t['team_id']: t for t in self._read_table('teams')})
+
+    def read_team(self, team_id: int) -> dict | None:
+        return self.read_teams().get(team_id)
+
+    @timed()
+    def read_team_identities(self) -> dict[int, dict]:
+        """Returns clubs scraped from premierliga.ru by the team_id they were matched to."""
+        return self.cache.get('team_identities', 'all',
+                              lambda: {t['team_id']: t for t in self._read_table('team_identities')})
+
+    def team_display_name(self, team_id: int, lang: Literal['ru', 'eng'] = 'ru') -> str | None:
+        """Name of the team as the league itself spells it, the api-football name if the club isn't matched."""
+        identity = self.read_team_identities().get(team_id)
+        if identity and identity[f'name_{lang}']:
+            return identity[f'name_{lang}']
+        team = self.read_team(team_id)
+        return team['name'] if team else None
+
+    @timed()
+    def upsert_team_identities(self, rows: list[dict]) -> None:
+        self._upsert_rows('team_identities', rows, columns_to_update=('name_ru', 'city_ru', 'name_eng', 'city_eng',
+                                                                      'url', 'url_eng', 'match_key',
+                                                                      'updated_datetime'))
+
+    @timed()
+    def read_round_matches(self, season_api_id: int, year: int) -> dict[int, tuple[dict]]:
+        """Returns matches of the season grouped by round, in kickoff order."""
+        def load() -> dict[int, tuple[dict]]:
+            rounds: dict[int, list[dict]] = {}
+            for m in self.read_season_matches(season_api_id, year):
+                rounds.setdefault(m['round'], []).append(m)
+            return {r: tuple(matches) for r, matches in sorted(rounds.items())}
+
+        return self.cache.get('matches', ('rounds', season_api_id, year), load)
+
+    def read_cache_versions(self) -> dict[str, int]:
+        """Versions of cached tables as bumped by writers in every process, see SHARED_CACHE_TABLES."""
+        return {r['table_name']: r['version'] for r in self._read_table('cache_versions')}
+
+    def warm_up_cache(self) -> None:
+        """Reads reference data of active contests ahead of the first request that needs it."""
+        self.read_teams()
+        self.read_team_identities()
+        for c in self.read_active_contests():
+            self.read_round_matches(c['season_api_id'], c['year'])
+        logging.info(f"Reference cache warmed up. Entries: {len(self.cache)}.")
+
+    def _move_logo_to_assets(self, row: dict) -> dict:
+        """Returns a copy of the row with 'logo' bytes stored as an asset and replaced by 'logo_hash'."""
+        if 'logo' not in row:
+            return row
+        row = dict(row)
+        logo = row.pop('logo')
+        row['logo_hash'] = self.assets.put(logo) if logo else None
+        return row
+
+    def read_logo(self, logo_hash: str) -> memoryview | None:
+        return self.assets.get(logo_hash)
+
+    @timed()
     def add_contest(self, contest: dict) -> None:
-        self._insert_into_table('contests', contest)
-
+        self._insert_into_table('contests', self._move_logo_to_assets(contest))
+
+    @timed()
+    def create_contest(self, contest: dict, team_list: list[dict], matches_list: list[dict]) -> None:
+        """
+        Stores a new contest with its teams and calendar in one transaction: after a crash the contest
+        either exists complete or doesn't exist at all. Teams and matches already stored are skipped.
+        """
+        # Logos go to the asset store first, it uses connections of its own
+        contest = self._move_logo_to_assets(contest)
+        team_list = [self._move_logo_to_assets(t) for t in team_list]
+        with self:
+            self.cur.execute(self._insert_query('contests', tuple(contest.keys())), tuple(contest.values()))
+            for table_name, rows in (('teams', team_list), ('matches', matches_list)):
+                if rows:
+                    columns = tuple(rows[0].keys())
+                    self.cur.executemany(self._insert_query(table_name, columns, ignore=True),
+                                         [tuple(r[c] for c in columns) for r in rows])
+            self._written('contests', 'teams', 'matches')
+        logging.info(f"Contest {contest['season_api_id']} ({contest['year']}) stored. "
+                     f"Teams: {len(team_list)}, matches: {len(matches_list)}.")
+
+    @timed()
+    def read_incomplete_contests(self) -> tuple[dict]:
+        """Active contests without a calendar, left behind by a contest creation that was interrupted."""
+        return self._read_rows("SELECT c.* FROM contests c WHERE c.is_active = 1 AND NOT EXISTS ("
+                               "SELECT 1 FROM matches m WHERE m.season_api_id = c.season_api_id "
+                               "AND m.season_year = c.year)")
+
+    @timed()
     def insert_missing_teams(self, team_list: list) -> None:
-        # TODO add logging to success on inserting each team and overall 'Team list is up to date'
-        for t in team_list:
-            try:
-                self._insert_into_table('teams', t)
-            except mysql.connector.IntegrityError as e:
-                if e.errno == errorcode.ER_DUP_ENTRY: # duplicate key error (team already exists)
-                    continue
-                logging.error(f"Failed to insert team. "
-                              f"Error: {e.__repr__()}.")
-
+        """Stores teams in one batch, teams already stored are skipped."""
+        if not team_list:
+            return
+        teams = [self._move_logo_to_assets(t) for t in team_list]
+        columns = tuple(teams[0].keys())
+        self.insert_rows('teams', columns, (tuple(t[c] for c in columns) for t in teams))
+
+    @timed()
     def insert_matches(self, matches_list: list[dict]) -> None:
-        for m in matches_list:
-            try:
-                self._insert_into_table('matches', m)
-            except mysql.connector.IntegrityError as e:
-                if e.errno == errorcode.ER_DUP_ENTRY:  # duplicate key error (match already exists)
-                    continue
-                else:
-                    logging.error(f"Failed to insert team. "
-                                  f"Error: {e.__repr__()}.")
+        """Stores matches in batches, matches already stored are skipped."""
+        if not matches_list:
+            return
+        columns = tuple(matches_list[0].keys())
+        self.insert_rows('matches', columns, (tuple(m[c] for c in columns) for m in matches_list))
+
+    @timed()
+    def upsert_matches(self, matches_list: list[dict]) -> None:
+        """Stores new matches and refreshes kickoff time, score and status of the known ones."""
+        self._upsert_rows('matches', matches_list, columns_to_update=MATCH_COLUMNS_TO_REFRESH)
+
+    @timed()
+    def upsert_match_rows(self, columns: tuple[str, ...], rows: list[tuple]) -> None:
+        """Same as upsert_matches() for rows laid out as tuples in `columns` order."""
+        self._upsert_tuples('matches', columns, rows, columns_to_update=MATCH_COLUMNS_TO_REFRESH)
+
+    @timed()
+    def upsert_teams(self, team_list: list[dict]) -> None:
+        self._upsert_rows('teams', [self._move_logo_to_assets(t) for t in team_list],
+                          columns_to_update=('name', 'city', 'logo_hash', 'logo_url'))
+
+    @timed()
+    def read_match_bets(self, match_id: int) -> tuple[dict]:
+        return self._read_rows("SELECT telegram_id, home_goals, away_goals FROM bets WHERE match_id = %s", (match_id,))
+
+    def read_user_stats(self) -> tuple[dict]:
+        return self._read_table('user_stats')
+
+    def read_user_round_points(self) -> tuple[dict]:
+        return self._read_table('user_round_points')
+
+    def read_processed_results(self) -> set[int]:
+        return {r['match_id'] for r in self._read_table('processed_results')}
+
+    @timed()
+    def store_processed_result(self, match_id: int, user_stats: list[dict], round_points: list[dict]) -> None:
+        """
+        Stores statistics updated by a match result together with the mark that the result is accounted for,
+        in one transaction, so a result can never be counted twice.
+        """
+        batches = (
+            ('user_stats', user_stats, ('predictions', 'hits', 'exact_scores', 'points', 'current_streak',
+                                        'best_streak', 'best_round', 'best_round_points')),
+            ('user_round_points', round_points, ('points',)),
+            ('processed_results', [{'match_id': match_id}], ('match_id',)),
+        )
+        with self:
+            for table_name, rows, columns_to_update in batches:
+                if rows:
+                    columns = tuple(rows[0].keys())
+                    self.cur.executemany(self._upsert_query(table_name, columns, columns_to_update),
+                                         [tuple(r[c] for c in columns) for r in rows])
+                    self._written(table_name)
+
+    def read_contest(self, season_api_id: int, year: int) -> dict | None:
+        contests = self._read_rows("SELECT * FROM contests WHERE season_api_id = %s AND year = %s",
+                                   (season_api_id, year))
+        return contests[0] if contests else None
+
+    @timed()
+    def read_season_matches(self, season_api_id: int, year: int) -> tuple[dict]:
+        return self._read_rows("SELECT * FROM matches WHERE season_api_id = %s AND season_year = %s "
+                               "ORDER BY match_datetime", (season_api_id, year))
+
+    @timed()
+    def read_season_bets(self, season_api_id: int, year: int) -> tuple[dict]:
+        return self._read_rows("SELECT b.* FROM bets b JOIN matches m ON m.match_id = b.match_id "
+                               "WHERE m.season_api_id = %s AND m.season_year = %s", (season_api_id, year))
+
+    @timed()
+    def read_season_user_stats(self, season_api_id: int, year: int) -> tuple[dict]:
+        return self._read_rows("SELECT * FROM user_stats WHERE season_api_id = %s AND season_year = %s",
+                               (season_api_id, year))
+
+    @timed()
+    def read_season_user_round_points(self, season_api_id: int, year: int) -> tuple[dict]:
+        return self._read_rows("SELECT * FROM user_round_points WHERE season_api_id = %s AND season_year = %s",
+                               (season_api_id, year))
+
+    @timed()
+    def read_season_processed_results(self, season_api_id: int, year: int) -> tuple[dict]:
+        return self._read_rows("SELECT r.* FROM processed_results r JOIN matches m ON m.match_id = r.match_id "
+                               "WHERE m.season_api_id = %s AND m.season_year = %s", (season_api_id, year))
+
+    @timed()
+    def read_users_without_round_bets(self, season_api_id: int, year: int, round_: int) -> list[int]:
+        """Telegram ids of users who haven't bet on any match of the round."""
+        rows = self._read_rows("SELECT u.telegram_id FROM users u WHERE NOT EXISTS ("
+                               "SELECT 1 FROM bets b JOIN matches m ON m.match_id = b.match_id "
+                               "WHERE b.telegram_id = u.telegram_id AND m.season_api_id = %s "
+                               "AND m.season_year = %s AND m.round = %s)", (season_api_id, year, round_))
+        return [r['telegram_id'] for r in rows]
+
+    def read_column_names(self, table_name: str) -> list[str]:
+        with self:
+            self.cur.execute(f"SELECT * FROM {table_name} LIMIT 0")
+            self.cur.fetchall()
+            return [i[0] for i in self.cur.description]
+
+    @timed()
+    def delete_contest(self, season_api_id: int, year: int) -> None:
+        """Deletes the contest with its matches, bets and user statistics in one transaction."""
+        params = (season_api_id, year)
+        with self:
+            for table_name in ('bets', 'processed_results'):
+                self.cur.execute(f"DELETE FROM {table_name} WHERE match_id IN (SELECT match_id FROM matches "
+                                 f"WHERE season_api_id = %s AND season_year = %s)", params)
+            for table_name in ('user_stats', 'user_round_points', 'matches'):
+                self.cur.execute(f"DELETE FROM {table_name} WHERE season_api_id = %s AND season_year = %s", params)
+            self.cur.execute("DELETE FROM contests WHERE season_api_id = %s AND year = %s", params)
+            self._written('bets', 'processed_results', 'user_stats', 'user_round_points', 'matches', 'contests')
+        logging.info(f"Contest {season_api_id} ({year}) deleted with its matches, bets and user statistics.")
+
+    @timed()
+    def insert_rows(self, table_name: str, columns: tuple[str, ...], rows: Iterable[tuple],
+                    batch_size: int = config.INSERT_BATCH_SIZE) -> int:
+        """
+        Bulk inserts rows in batches within one transaction, rows already present are skipped.
+        Returns the number of rows inserted, skipped ones not included.
+        """
+        query = self._insert_query(table_name, columns, ignore=True)
+        inserted, batch = 0, []
+        with self:
+            for r in rows:
+                batch.append(tuple(r))
+                if len(batch) == batch_size:
+                    self.cur.executemany(query, batch)
+                    inserted, batch = inserted + self.cur.rowcount, []
+            if batch:
+                self.cur.executemany(query, batch)
+                inserted += self.cur.rowcount
+            self._written(table_name)
+        logging.info(f"Rows inserted. Table: '{table_name}', rows: {inserted}.")
+        return inserted
+
+    def enqueue_backfill_jobs(self, seasons: list[tuple[str, str, int]]) -> int:
+        """Adds a job per (league_country, league_name, year), seasons already queued are left as they are."""
+        now = datetime.datetime.now().strftime(config.PREFERRED_DATETIME_FORMAT)
+        return self.insert_rows('backfill_jobs', ('league_country', 'league_name', 'year', 'updated_datetime'),
+                                ((country, league, year, now) for country, league, year in seasons))
+
+    def read_unfinished_backfill_jobs(self) -> tuple[dict]:
+        return self._read_rows("SELECT * FROM backfill_jobs WHERE status = 'pending' ORDER BY job_id")
+
+    def update_backfill_job(self, job_id: int, **fields) -> None:
+        fields['updated_datetime'] = datetime.datetime.now().strftime(config.PREFERRED_DATETIME_FORMAT)
+        with self:
+            self.cur.execute(f"UPDATE backfill_jobs SET {', '.join(f'{k} = %s' for k in fields)} WHERE job_id = %s",
+                             (*fields.values(), job_id))
+
+    def try_acquire_lease(self, name: str, holder: str, ttl: int) -> bool:
+        """
+        Takes the lease if it is free or expired, renews it if `holder` already has it.
+        Returns whether `holder` holds the lease for the next `ttl` seconds.
+        """
+        with self:
+            # The row is created expired the first time, then taken over by the conditional update
+            self.cur.execute("INSERT IGNORE INTO leader_leases (name, holder, expires_at) "
+                             "VALUES (%s, %s, NOW(3) - INTERVAL %s SECOND)", (name, holder, 1))
+            self.cur.execute("UPDATE leader_leases SET holder = %s, expires_at = NOW(3) + INTERVAL %s SECOND "
+                             "WHERE name = %s AND (holder = %s OR expires_at < NOW(3))", (holder, ttl, name, holder))
+            self.cur.execute("SELECT holder FROM leader_leases WHERE name = %s", (name,))
+            return self.cur.fetchone()[0] == holder
+
+    def release_lease(self, name: str, holder: str) -> None:
+        with self:
+            # Already in the past, a release within the same millisecond as the next claim must not block it
+            self.cur.execute("UPDATE leader_leases SET expires_at = NOW(3) - INTERVAL %s SECOND "
+                             "WHERE name = %s AND holder = %s", (1, name, holder))
+
+    def enqueue_work(self, kind: str, items: list[tuple[str, str]]) -> int:
+        """Adds (dedup_key, payload) items, an item whose key is already queued is skipped. Returns the number added."""
+        return self.insert_rows('work_queue', ('kind', 'dedup_key', 'payload'),
+                                ((kind, key, payload) for key, payload in items))
+
+    def claim_work(self, kind: str, worker: str, limit: int) -> tuple[dict]:
+        """
+        Hands pending items out to `worker`. Rows locked by a concurrent claim are skipped rather than
+        waited for, so any number of workers can claim at the same time without getting the same item.
+        """
+        with self:
+            self.cur.execute("SELECT item_id, payload, attempts FROM work_queue "
+                             "WHERE status = 'pending' AND kind = %s ORDER BY item_id LIMIT %s "
+                             "FOR UPDATE SKIP LOCKED", (kind, limit))
+            columns = tuple(i[0] for i in self.cur.description)
+            items = tuple(dict(zip(columns, r)) for r in self.cur.fetchall())
+            if items:
+                ids = tuple(i['item_id'] for i in items)
+                self.cur.execute(f"UPDATE work_queue SET status = 'processing', worker = %s, claimed_at = NOW(3), "
+                                 f"attempts = attempts + 1 WHERE item_id IN ({', '.join(['%s'] * len(ids))})",
+                                 (worker, *ids))
+        return items
+
+    def finish_work(self, item_id: int, status: Literal['done', 'pending', 'failed']) -> None:
+        with self:
+            self.cur.execute("UPDATE work_queue SET status = %s WHERE item_id = %s", (status, item_id))
+
+    def requeue_stale_work(self, visibility_timeout: int) -> int:
+        """Returns items claimed by workers that died before finishing them to the queue."""
+        with self:
+            self.cur.execute("UPDATE work_queue SET status = 'pending', worker = NULL WHERE status = 'processing' "
+                             "AND claimed_at < NOW(3) - INTERVAL %s SECOND", (visibility_timeout,))
+            return self.cur.rowcount
+
+    def delete_finished_work(self, retention_hours: int) -> None:
+        with self:
+            self.cur.execute("DELETE FROM work_queue WHERE status = 'done' "
+                             "AND created_at < NOW(3) - INTERVAL %s HOUR", (retention_hours,))
+
+    def enqueue_outbound_messages(self, messages: list[tuple[int, str, str | None, str | None, int, int]]) -> int:
+        """Adds (chat_id, text, parse_mode, reply_markup, attempts, delay in seconds) to the retry queue."""
+        if not messages:
+            return 0
+        with self:
+            self.cur.executemany("INSERT INTO outbound_messages (chat_id, text, parse_mode, reply_markup, attempts, "
+                                 "next_attempt_at) VALUES (%s, %s, %s, %s, %s, NOW(3) + INTERVAL %s SECOND)",
+                                 messages)
+        return len(messages)
+
+    def claim_outbound_messages(self, limit: int, visibility_timeout: int) -> tuple[dict]:
+        """
+        Returns messages due for another attempt. They stay in the queue, hidden for `visibility_timeout`
+        seconds, and are only deleted once sent, so a process dying mid-send loses nothing.
+        """
+        with self:
+            self.cur.execute("SELECT * FROM outbound_messages WHERE next_attempt_at <= NOW(3) "
+                             "ORDER BY outbound_id LIMIT %s FOR UPDATE SKIP LOCKED", (limit,))
+            columns = tuple(i[0] for i in self.cur.description)
+            messages = tuple(dict(zip(columns, r)) for r in self.cur.fetchall())
+            if messages:
+                ids = tuple(m['outbound_id'] for m in messages)
+                self.cur.execute(f"UPDATE outbound_messages SET next_attempt_at = NOW(3) + INTERVAL %s SECOND "
+                                 f"WHERE outbound_id IN ({', '.join(['%s'] * len(ids))})",
+                                 (visibility_timeout, *ids))
+        return messages
+
+    def reschedule_outbound_message(self, outbound_id: int, attempts: int, delay: int) -> None:
+        with self:
+            self.cur.execute("UPDATE outbound_messages SET attempts = %s, "
+                             "next_attempt_at = NOW(3) + INTERVAL %s SECOND WHERE outbound_id = %s",
+                             (attempts, delay, outbound_id))
+
+    def delete_outbound_message(self, outbound_id: int) -> None:
+        with self:
+            self.cur.execute("DELETE FROM outbound_messages WHERE outbound_id = %s", (outbound_id,))
+
 
 if __name__ == '__main__':
     from pprint import pprint
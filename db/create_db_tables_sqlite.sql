@@ -0,0 +1,139 @@
+-- Schema of db/create_db_tables_mysql.sql with all of migrations.MIGRATIONS applied, for the SQLite backend.
+-- Times are stored as 'YYYY-MM-DD HH:MM:SS.SSS' text in UTC, as storage.to_sqlite() writes NOW(3).
+
+CREATE TABLE IF NOT EXISTS users (
+    telegram_id INTEGER NOT NULL PRIMARY KEY,
+    is_admin INTEGER NOT NULL DEFAULT 0,
+    creation_datetime TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS api_requests (
+    requests_today INTEGER NOT NULL DEFAULT 0,
+    daily_requests_quota INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS contests (
+    season_api_id INTEGER NOT NULL,
+    league_name TEXT NOT NULL,
+    league_country TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    start_date TEXT NOT NULL,
+    finish_date TEXT NOT NULL,
+    logo_url TEXT NULL,
+    logo_hash TEXT NULL,
+    creation_datetime TEXT NOT NULL,
+    is_active INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (season_api_id, year)
+);
+
+CREATE TABLE IF NOT EXISTS teams (
+    team_id INTEGER NOT NULL PRIMARY KEY,
+    name TEXT NOT NULL,
+    city TEXT NULL,
+    logo_url TEXT NULL,
+    logo_hash TEXT NULL
+);
+
+CREATE TABLE IF NOT EXISTS matches (
+    match_id INTEGER NOT NULL PRIMARY KEY,
+    season_api_id INTEGER NOT NULL,
+    season_year INTEGER NULL,
+    match_datetime TEXT NOT NULL,
+    round INTEGER NOT NULL,
+    home_team_id INTEGER NOT NULL,
+    away_team_id INTEGER NOT NULL,
+    score TEXT NULL,
+    home_goals INTEGER NULL,
+    away_goals INTEGER NULL,
+    status_long TEXT NULL,
+    status_short TEXT NULL
+);
+CREATE INDEX IF NOT EXISTS matches_season ON matches (season_api_id, season_year, round);
+
+CREATE TABLE IF NOT EXISTS assets (
+    asset_hash TEXT NOT NULL PRIMARY KEY,
+    content BLOB NOT NULL,
+    size INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS bets (
+    telegram_id INTEGER NOT NULL,
+    match_id INTEGER NOT NULL,
+    home_goals INTEGER NOT NULL,
+    away_goals INTEGER NOT NULL,
+    creation_datetime TEXT NOT NULL,
+    PRIMARY KEY (telegram_id, match_id)
+);
+CREATE INDEX IF NOT EXISTS bets_match_id ON bets (match_id);
+
+CREATE TABLE IF NOT EXISTS user_stats (
+    telegram_id INTEGER NOT NULL,
+    season_api_id INTEGER NOT NULL,
+    season_year INTEGER NOT NULL DEFAULT 0,
+    predictions INTEGER NOT NULL DEFAULT 0,
+    hits INTEGER NOT NULL DEFAULT 0,
+    exact_scores INTEGER NOT NULL DEFAULT 0,
+    points INTEGER NOT NULL DEFAULT 0,
+    current_streak INTEGER NOT NULL DEFAULT 0,
+    best_streak INTEGER NOT NULL DEFAULT 0,
+    best_round INTEGER NULL,
+    best_round_points INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (telegram_id, season_api_id, season_year)
+);
+
+CREATE TABLE IF NOT EXISTS user_round_points (
+    telegram_id INTEGER NOT NULL,
+    season_api_id INTEGER NOT NULL,
+    season_year INTEGER NOT NULL DEFAULT 0,
+    round INTEGER NOT NULL,
+    points INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (telegram_id, season_api_id, season_year, round)
+);
+
+CREATE TABLE IF NOT EXISTS processed_results (
+    match_id INTEGER NOT NULL PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS backfill_jobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    league_country TEXT NOT NULL,
+    league_name TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    stage TEXT NOT NULL DEFAULT 'season',
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    season_api_id INTEGER NULL,
+    updated_datetime TEXT NOT NULL,
+    UNIQUE (league_country, league_name, year)
+);
+
+CREATE TABLE IF NOT EXISTS leader_leases (
+    name TEXT NOT NULL PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS work_queue (
+    item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    dedup_key TEXT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT NULL,
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+    claimed_at TEXT NULL,
+    UNIQUE (kind, dedup_key)
+);
+CREATE INDEX IF NOT EXISTS work_queue_status ON work_queue (status, kind, item_id);
+
+CREATE TABLE IF NOT EXISTS outbound_messages (
+    outbound_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    parse_mode TEXT NULL,
+    reply_markup TEXT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+);
+CREATE INDEX IF NOT EXISTS outbound_messages_due ON outbound_messages (next_attempt_at)
@@ -0,0 +1,60 @@
+"""
+Process lifecycle: turns SIGTERM/SIGINT into an orderly shutdown.
+
+Components register a stop step with on_shutdown() as they start. On a signal the `on_signal` callback
+(stopping Telegram polling) runs right away in the main thread, shutdown() then runs the steps in
+registration order, each one isolated from failures of the others. Buffered log records are flushed
+at exit by the logging listener itself.
+"""
+import logging
+import signal
+import threading
+import time
+from typing import Callable
+from utilities import initialize_logging
+
+initialize_logging()
+
+
+class Lifecycle:
+    def __init__(self):
+        self._steps: list[tuple[str, Callable[[], None]]] = []
+        self._stopping = threading.Event()
+        self._shutdown_lock = threading.Lock()
+        self._shut_down = False
+
+    @property
+    def stopping(self) -> bool:
+        return self._stopping.is_set()
+
+    def on_shutdown(self, name: str, step: Callable[[], None]) -> None:
+        self._steps.append((name, step))
+
+    def install_signal_handlers(self, on_signal: Callable[[], None]) -> None:
+        """Must be called from the main thread."""
+        def handler(signum, frame):
+            if self._stopping.is_set():
+                return
+            self._stopping.set()
+            logging.info(f"{signal.Signals(signum).name} received. Shutting down...")
+            on_signal()
+
+        for s in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(s, handler)
+
+    def shutdown(self) -> None:
+        """Runs every registered step once, later calls do nothing."""
+        with self._shutdown_lock:
+            if self._shut_down:
+                return
+            self._shut_down = True
+        self._stopping.set()
+
+        started = time.monotonic()
+        for name, step in self._steps:
+            try:
+                step()
+                logging.info(f"Shutdown step '{name}' done.")
+            except Exception as e:
+                logging.error(f"Shutdown step '{name}' failed. Error: {e.__repr__()}.")
+        logging.info(f"Shutdown completed in {time.monotonic() - started:.1f} s.")
@@ -0,0 +1,248 @@
+"""
+In-process metrics shared by the bot, the scheduler and the data layer.
+
+Counters and histograms keep one cell per writing thread, so recording a value never takes a lock,
+cells are only summed up when metrics are collected. Everything registered here is exposed in
+Prometheus text format by start_http_server().
+"""
+import bisect
+import functools
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+DEFAULT_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+_registry: dict[str, 'Counter | Gauge | Histogram'] = {}
+_registry_lock = threading.Lock()
+
+
+def _labels_key(labels: dict[str, str]) -> tuple[tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class _ThreadCells:
+    """One dict per writing thread. Only the owning thread writes to its cell."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._cells: list[dict] = []
+        self._lock = threading.Lock()
+
+    def own(self) -> dict:
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = self._local.cell = {}
+            with self._lock:  # once per thread
+                self._cells.append(cell)
+            return cell
+
+    def all(self) -> list[dict]:
+        with self._lock:
+            cells = list(self._cells)
+        return [dict(c) for c in cells]
+
+
+class Counter:
+    """Monotonically increasing value, optionally split by labels."""
+    type_name = 'counter'
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._cells = _ThreadCells()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        cell = self._cells.own()
+        key = _labels_key(labels)
+        cell[key] = cell.get(key, 0) + amount
+
+    def collect(self) -> dict[tuple, float]:
+        result = {}
+        for cell in self._cells.all():
+            for key, value in cell.items():
+                result[key] = result.get(key, 0) + value
+        return result
+
+
+class Gauge:
+    """Value that goes up and down, either set explicitly or read from a callback on collection."""
+    type_name = 'gauge'
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._values: dict[tuple, float] = {}
+        self._functions: dict[tuple, Callable[[], float]] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels) -> None:
+        self._values[_labels_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float], **labels) -> None:
+        self._functions[_labels_key(labels)] = function
+
+    def collect(self) -> dict[tuple, float]:
+        result = dict(self._values)
+        for key, function in list(self._functions.items()):
+            try:
+                result[key] = function()
+            except Exception as e:
+                logging.error(f"Failed to collect gauge '{self.name}'. Error: {e.__repr__()}.")
+        return result
+
+
+class Histogram:
+    """Distribution of observed values (seconds by convention) over fixed buckets."""
+    type_name = 'histogram'
+
+    def __init__(self, name: str, description: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self._cells = _ThreadCells()  # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, **labels) -> None:
+        cell = self._cells.own()
+        key = _labels_key(labels)
+        series = cell.get(key)
+        if series is None:
+            series = cell[key] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def collect(self) -> dict[tuple, dict[str, float | list[int]]]:
+        """Returns cumulative bucket counts, total count and sum per label set."""
+        merged: dict[tuple, list] = {}
+        for cell in self._cells.all():
+            for key, series in cell.items():
+                target = merged.setdefault(key, [0] * len(series))
+                for i, value in enumerate(list(series)):
+                    target[i] += value
+        result = {}
+        for key, series in merged.items():
+            cumulative, running = [], 0
+            for count in series[:-1]:
+                running += count
+                cumulative.append(running)
+            result[key] = {'buckets': cumulative, 'count': running, 'sum': series[-1]}
+        return result
+
+
+def _get_or_create(metric_class, name: str, description: str, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = metric_class(name, description, **kwargs)
+        elif not isinstance(metric, metric_class):
+            raise ValueError(f"Metric '{name}' already registered as {type(metric).__name__}")
+        return metric
+
+
+def counter(name: str, description: str) -> Counter:
+    """Returns the process-wide counter with this name, creating it on first use."""
+    return _get_or_create(Counter, name, description)
+
+
+def gauge(name: str, description: str) -> Gauge:
+    """Returns the process-wide gauge with this name, creating it on first use."""
+    return _get_or_create(Gauge, name, description)
+
+
+def histogram(name: str, description: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    """Returns the process-wide histogram with this name, creating it on first use."""
+    return _get_or_create(Histogram, name, description, buckets=buckets)
+
+
+def registered_metrics() -> list['Counter | Gauge | Histogram']:
+    with _registry_lock:
+        return list(_registry.values())
+
+
+def timed(metric_name: str = 'function_latency_seconds') -> Callable:
+    """
+    Decorator recording wall time of every call of the decorated function into a latency histogram,
+    labeled with the function's qualified name. Calls that raise are recorded as well.
+    """
+    latency = histogram(metric_name, 'Latency of instrumented functions')
+
+    def decorator(func: Callable) -> Callable:
+        label = func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                latency.observe(time.perf_counter() - started, function=label)
+
+        return wrapper
+
+    return decorator
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key: tuple[tuple[str, str], ...], extra: tuple[tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape_label_value(v)}"' for k, v in pairs) + '}'
+
+
+def render_text() -> str:
+    """Renders all registered metrics in Prometheus text exposition format."""
+    lines = []
+    for metric in registered_metrics():
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.type_name}")
+        if isinstance(metric, Histogram):
+            for key, data in metric.collect().items():
+                bounds = [str(b) for b in metric.buckets] + ['+Inf']
+                for bound, count in zip(bounds, data['buckets']):
+                    lines.append(f"{metric.name}_bucket{_format_labels(key, (('le', bound),))} {count}")
+                lines.append(f"{metric.name}_sum{_format_labels(key)} {data['sum']}")
+                lines.append(f"{metric.name}_count{_format_labels(key)} {data['count']}")
+        else:
+            for key, value in metric.collect().items():
+                lines.append(f"{metric.name}{_format_labels(key)} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_text().encode('UTF-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes are too frequent to be worth logging
+
+
+def start_http_server(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Serves GET /metrics from a daemon thread. Call shutdown() on the returned server to stop it."""
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logging.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,173 @@
+"""
+Schema changes applied on top of db/create_db_tables_mysql.sql.
+
+Every migration runs once, in order, its name is recorded in `schema_migrations`. Statements are applied
+and recorded one by one (see Database._apply_migrations), a failed migration is retried from the statement
+that failed. MySQL commits a DDL statement before its step is recorded, so DDL must be safe to run again:
+CREATE ... IF NOT EXISTS, ALTER TABLE ... ADD/DROP COLUMN (MySQLBackend.is_applied() checks those in
+information_schema) or a change that ends the same when repeated. Never edit or reorder migrations that have
+been released, append new ones instead.
+
+db/create_db_tables_sqlite.sql already includes everything up to 0005_outbound_messages. A new migration
+goes to both lists, written in each database's own dialect under the same name.
+"""
+
+MIGRATIONS: list[tuple[str, tuple[str, ...]]] = [
+    # Image bytes leave the hot tables, rows keep a SHA-256 reference into `assets`
+    ('0001_asset_store', (
+        """CREATE TABLE IF NOT EXISTS assets (
+            asset_hash CHAR(64) NOT NULL PRIMARY KEY,
+            content LONGBLOB NOT NULL,
+            size INT UNSIGNED NOT NULL
+        )""",
+        "ALTER TABLE teams ADD COLUMN logo_hash CHAR(64) NULL",
+        "ALTER TABLE contests ADD COLUMN logo_hash CHAR(64) NULL",
+        "INSERT IGNORE INTO assets (asset_hash, content, size) "
+        "SELECT SHA2(logo, 256), logo, LENGTH(logo) FROM teams WHERE logo IS NOT NULL",
+        "INSERT IGNORE INTO assets (asset_hash, content, size) "
+        "SELECT SHA2(logo, 256), logo, LENGTH(logo) FROM contests WHERE logo IS NOT NULL",
+        "UPDATE teams SET logo_hash = SHA2(logo, 256) WHERE logo IS NOT NULL",
+        "UPDATE contests SET logo_hash = SHA2(logo, 256) WHERE logo IS NOT NULL",
+        "ALTER TABLE teams DROP COLUMN logo",
+        "ALTER TABLE contests DROP COLUMN logo",
+    )),
+    # Parsed goals next to the score string, bets, and incrementally maintained per-user statistics
+    ('0002_user_stats', (
+        "ALTER TABLE matches ADD COLUMN home_goals TINYINT UNSIGNED NULL, ADD COLUMN away_goals TINYINT UNSIGNED NULL",
+        """CREATE TABLE IF NOT EXISTS bets (
+            telegram_id BIGINT NOT NULL,
+            match_id INT NOT NULL,
+            home_goals TINYINT UNSIGNED NOT NULL,
+            away_goals TINYINT UNSIGNED NOT NULL,
+            creation_datetime VARCHAR(20) NOT NULL,
+            PRIMARY KEY (telegram_id, match_id),
+            INDEX bets_match_id (match_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS user_stats (
+            telegram_id BIGINT NOT NULL,
+            season_api_id INT NOT NULL,
+            predictions INT UNSIGNED NOT NULL DEFAULT 0,
+            hits INT UNSIGNED NOT NULL DEFAULT 0,
+            exact_scores INT UNSIGNED NOT NULL DEFAULT 0,
+            points INT UNSIGNED NOT NULL DEFAULT 0,
+            current_streak INT UNSIGNED NOT NULL DEFAULT 0,
+            best_streak INT UNSIGNED NOT NULL DEFAULT 0,
+            best_round INT UNSIGNED NULL,
+            best_round_points INT UNSIGNED NOT NULL DEFAULT 0,
+            PRIMARY KEY (telegram_id, season_api_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS user_round_points (
+            telegram_id BIGINT NOT NULL,
+            season_api_id INT NOT NULL,
+            round INT UNSIGNED NOT NULL,
+            points INT UNSIGNED NOT NULL DEFAULT 0,
+            PRIMARY KEY (telegram_id, season_api_id, round)
+        )""",
+        "CREATE TABLE IF NOT EXISTS processed_results (match_id INT NOT NULL PRIMARY KEY)",
+    )),
+    # season_api_id is the league id and repeats every year, matches and statistics also need the season year.
+    # Existing rows belong to the active contest of their league.
+    ('0003_season_year_and_backfill', (
+        "ALTER TABLE matches ADD COLUMN season_year SMALLINT UNSIGNED NULL AFTER season_api_id",
+        "UPDATE matches m JOIN contests c ON c.season_api_id = m.season_api_id AND c.is_active = 1 "
+        "SET m.season_year = c.year",
+        "ALTER TABLE user_stats ADD COLUMN season_year SMALLINT UNSIGNED NOT NULL DEFAULT 0 AFTER season_api_id",
+        "UPDATE user_stats s JOIN contests c ON c.season_api_id = s.season_api_id AND c.is_active = 1 "
+        "SET s.season_year = c.year",
+        "ALTER TABLE user_stats DROP PRIMARY KEY, ADD PRIMARY KEY (telegram_id, season_api_id, season_year)",
+        "ALTER TABLE user_round_points ADD COLUMN season_year SMALLINT UNSIGNED NOT NULL DEFAULT 0 "
+        "AFTER season_api_id",
+        "UPDATE user_round_points p JOIN contests c ON c.season_api_id = p.season_api_id AND c.is_active = 1 "
+        "SET p.season_year = c.year",
+        "ALTER TABLE user_round_points DROP PRIMARY KEY, "
+        "ADD PRIMARY KEY (telegram_id, season_api_id, season_year, round)",
+        """CREATE TABLE IF NOT EXISTS backfill_jobs (
+            job_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            league_country VARCHAR(100) NOT NULL,
+            league_name VARCHAR(100) NOT NULL,
+            year SMALLINT UNSIGNED NOT NULL,
+            stage VARCHAR(20) NOT NULL DEFAULT 'season',
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            attempts TINYINT UNSIGNED NOT NULL DEFAULT 0,
+            season_api_id INT NULL,
+            updated_datetime VARCHAR(20) NOT NULL,
+            UNIQUE KEY backfill_jobs_season (league_country, league_name, year)
+        )""",
+    )),
+    ('0004_leader_lease_and_work_queue', (
+        # Times are the database server's own (NOW(3)), processes never compare their clocks with each other
+        """CREATE TABLE IF NOT EXISTS leader_leases (
+            name VARCHAR(50) NOT NULL PRIMARY KEY,
+            holder VARCHAR(100) NOT NULL,
+            expires_at DATETIME(3) NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS work_queue (
+            item_id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            kind VARCHAR(30) NOT NULL,
+            dedup_key VARCHAR(100) NULL,
+            payload MEDIUMTEXT NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            attempts TINYINT UNSIGNED NOT NULL DEFAULT 0,
+            worker VARCHAR(100) NULL,
+            created_at DATETIME(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+            claimed_at DATETIME(3) NULL,
+            UNIQUE KEY work_queue_dedup (kind, dedup_key),
+            KEY work_queue_status (status, kind, item_id)
+        )""",
+    )),
+    ('0005_outbound_messages', (
+        """CREATE TABLE IF NOT EXISTS outbound_messages (
+            outbound_id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            chat_id BIGINT NOT NULL,
+            text TEXT NOT NULL,
+            parse_mode VARCHAR(20) NULL,
+            reply_markup TEXT NULL,
+            attempts TINYINT UNSIGNED NOT NULL DEFAULT 0,
+            next_attempt_at DATETIME(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+            KEY outbound_messages_due (next_attempt_at)
+        )""",
+    )),
+    # Clubs scraped from premierliga.ru linked to api-football teams, for names in Russian
+    ('0006_team_identities', (
+        """CREATE TABLE IF NOT EXISTS team_identities (
+            team_id INT NOT NULL PRIMARY KEY,
+            name_ru VARCHAR(100) NULL,
+            city_ru VARCHAR(100) NULL,
+            name_eng VARCHAR(100) NULL,
+            city_eng VARCHAR(100) NULL,
+            url VARCHAR(255) NULL,
+            url_eng VARCHAR(255) NULL,
+            match_key VARCHAR(200) NOT NULL,
+            updated_datetime VARCHAR(20) NOT NULL
+        )""",
+    )),
+    # Cluster mode: writers bump the version of a cached table, other processes drop their copies when it changes
+    ('0007_cache_versions', (
+        """CREATE TABLE IF NOT EXISTS cache_versions (
+            table_name VARCHAR(50) NOT NULL PRIMARY KEY,
+            version BIGINT UNSIGNED NOT NULL
+        )""",
+    )),
+]
+
+SQLITE_MIGRATIONS: list[tuple[str, tuple[str, ...]]] = [
+    ('0006_team_identities', (
+        """CREATE TABLE IF NOT EXISTS team_identities (
+            team_id INTEGER NOT NULL PRIMARY KEY,
+            name_ru TEXT NULL,
+            city_ru TEXT NULL,
+            name_eng TEXT NULL,
+            city_eng TEXT NULL,
+            url TEXT NULL,
+            url_eng TEXT NULL,
+            match_key TEXT NOT NULL,
+            updated_datetime TEXT NOT NULL
+        )""",
+    )),
+    ('0007_cache_versions', (
+        """CREATE TABLE IF NOT EXISTS cache_versions (
+            table_name TEXT NOT NULL PRIMARY KEY,
+            version INTEGER NOT NULL
+        )""",
+    )),
+]
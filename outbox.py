@@ -0,0 +1,265 @@
+"""
+Rate-limit aware delivery of outbound Telegram messages.
+
+Messages are queued and sent by a pool of senders, handlers never wait for Telegram. Each chat is always
+served by the same sender, so messages to a chat arrive in the order they were queued. Sending is paced
+by a global token bucket shared by all senders and a token bucket per chat (a slower one for groups).
+
+A 429 reply is answered by waiting `retry_after` and sending again. Messages that can't be sent right now
+(network errors, 5xx, long 429 pauses, shutdown) go to the `outbound_messages` table and are retried with
+exponential backoff until OUTBOX_MAX_ATTEMPTS. Chats that blocked the bot or no longer exist are skipped.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Iterable
+import telebot
+from telebot.apihelper import ApiTelegramException
+import config
+import metrics
+from database import Database
+from utilities import initialize_logging
+
+# Telegram error codes after which sending the same message again is pointless
+UNDELIVERABLE_ERROR_CODES: frozenset[int] = frozenset({400, 403})
+OUTBOX_RETRY_BATCH_SIZE = 100
+
+OUTBOX_MESSAGES = metrics.counter('outbox_messages_total', 'Outbound Telegram messages by outcome')
+OUTBOX_THROTTLED = metrics.counter('outbox_throttled_total', 'Times a sender waited for a rate limit')
+OUTBOX_SEND_SECONDS = metrics.histogram('outbox_send_seconds', 'Time from queueing a message to sending it')
+OUTBOX_QUEUED = metrics.gauge('outbox_queued_messages', 'Messages waiting in the in-memory queues')
+
+initialize_logging()
+
+
+class TokenBucket:
+    """`rate` tokens per second, at most `capacity` saved up. Not thread-safe unless `shared`."""
+
+    def __init__(self, rate: float, capacity: float, shared: bool = False,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = threading.Lock() if shared else None
+
+    def reserve(self) -> float:
+        """Takes a token. Returns how many seconds to wait before it may be used, 0 if right away."""
+        if self._lock:
+            with self._lock:
+                return self._reserve()
+        return self._reserve()
+
+    def _reserve(self) -> float:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate) - 1
+        self._updated = now
+        return -self._tokens / self.rate if self._tokens < 0 else 0
+
+    def pause(self, seconds: float) -> None:
+        """Makes the bucket empty for `seconds`, used when Telegram asks to retry after a while."""
+        if self._lock:
+            with self._lock:
+                return self._pause(seconds)
+        self._pause(seconds)
+
+    def _pause(self, seconds: float) -> None:
+        now = self._clock()
+        tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._tokens = min(tokens, -seconds * self.rate)
+        self._updated = now
+
+
+@dataclass
+class OutboundMessage:
+    chat_id: int
+    text: str
+    parse_mode: str | None = None
+    reply_markup: str | None = None  # JSON, as Telegram takes it
+    outbound_id: int | None = None  # set for messages from the retry queue
+    attempts: int = 0
+    queued_at: float = 0.0
+
+
+class Outbox:
+    def __init__(self, bot: telebot.TeleBot, database: Database, senders: int = config.OUTBOX_SENDERS,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        """`clock` and `sleep` pace sending, tests replace them to run without waiting."""
+        self.bot = bot
+        self.db = database
+        self._clock = clock
+        self._sleep = sleep
+        self._queues: list[queue.Queue[OutboundMessage | None]] = [queue.Queue() for _ in range(senders)]
+        self._global_bucket = TokenBucket(config.OUTBOX_GLOBAL_RATE, config.OUTBOX_GLOBAL_RATE, shared=True,
+                                          clock=clock)
+        self._threads: list[threading.Thread] = []
+        self._stop = threading.Event()
+        OUTBOX_QUEUED.set_function(lambda: sum(q.qsize() for q in self._queues))
+
+    def start(self) -> None:
+        for i, q in enumerate(self._queues):
+            thread = threading.Thread(target=self._send_loop, args=(q,), name=f'outbox-sender-{i + 1}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._retry_loop, name='outbox-retry', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        logging.info(f"Outbox started. Senders: {len(self._queues)}.")
+
+    def send(self, chat_id: int, text: str, parse_mode: str | None = None,
+             reply_markup: telebot.types.JsonSerializable | str | None = None) -> None:
+        if isinstance(reply_markup, telebot.types.JsonSerializable):
+            reply_markup = reply_markup.to_json()
+        self._put(OutboundMessage(chat_id, text, parse_mode, reply_markup))
+
+    def broadcast(self, chat_ids: Iterable[int], text: str, parse_mode: str | None = None) -> int:
+        """Queues the same message for every chat. Returns the number of messages queued."""
+        count = 0
+        for chat_id in chat_ids:
+            self.send(chat_id, text, parse_mode)
+            count += 1
+        logging.info(f"Broadcast of {count} messages queued.")
+        return count
+
+    def stop(self, timeout: float = config.SHUTDOWN_TIMEOUT) -> None:
+        """Sends what is queued for at most `timeout` seconds, whatever is left goes to the retry queue."""
+        self._stop.set()
+        for q in self._queues:
+            q.put(None)
+        deadline = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(max(deadline - time.monotonic(), 0))
+
+        left = []
+        for q in self._queues:
+            while True:
+                try:
+                    message = q.get_nowait()
+                except queue.Empty:
+                    break
+                if message is not None and message.outbound_id is None:  # retried ones are still in the table
+                    left.append(message)
+        if left:
+            self._persist(left, delay=0)
+            logging.warning(f"Outbox stopped. {len(left)} unsent messages moved to the retry queue.")
+
+    def _put(self, message: OutboundMessage) -> None:
+        message.queued_at = self._clock()
+        self._queues[hash(message.chat_id) % len(self._queues)].put(message)
+
+    def _send_loop(self, q: queue.Queue) -> None:
+        chat_buckets: OrderedDict[int, TokenBucket] = OrderedDict()
+        while True:
+            message = q.get()
+            if message is None:
+                return
+            bucket = chat_buckets.get(message.chat_id)
+            if bucket is None:
+                bucket = chat_buckets[message.chat_id] = self._chat_bucket(message.chat_id)
+                if len(chat_buckets) > config.OUTBOX_CHAT_BUCKETS_MAX:
+                    chat_buckets.popitem(last=False)
+            chat_buckets.move_to_end(message.chat_id)
+            try:
+                self._deliver(message, bucket)
+            except Exception as e:
+                # A message from the retry queue is still in the table and comes back with the next claim
+                OUTBOX_MESSAGES.inc(outcome='error')
+                logging.exception(f"Failed to deliver message to chat {message.chat_id}. Error: {e.__repr__()}.")
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        if chat_id < 0:  # groups and channels
+            return TokenBucket(config.OUTBOX_GROUP_RATE, 1, clock=self._clock)
+        return TokenBucket(config.OUTBOX_CHAT_RATE, config.OUTBOX_CHAT_BURST, clock=self._clock)
+
+    def _deliver(self, message: OutboundMessage, chat_bucket: TokenBucket) -> None:
+        rate_limited = 0
+        while True:
+            wait = max(chat_bucket.reserve(), self._global_bucket.reserve())
+            if wait:
+                OUTBOX_THROTTLED.inc()
+                self._sleep(wait)
+            try:
+                self.bot.send_message(message.chat_id, message.text, parse_mode=message.parse_mode,
+                                      reply_markup=message.reply_markup)
+            except ApiTelegramException as e:
+                if e.error_code == 429:
+                    retry_after = e.result_json.get('parameters', {}).get('retry_after', 1)
+                    rate_limited += 1
+                    if retry_after <= config.OUTBOX_MAX_RETRY_AFTER and rate_limited < config.OUTBOX_MAX_ATTEMPTS:
+                        OUTBOX_MESSAGES.inc(outcome='rate_limited')
+                        logging.warning(f"Telegram rate limit hit, pausing for {retry_after} s.")
+                        # Flood limits are per bot as much as per chat, other senders must hold off as well
+                        chat_bucket.pause(retry_after)
+                        self._global_bucket.pause(retry_after)
+                        continue
+                    self._retry_later(message, e, delay=retry_after)
+                elif e.error_code in UNDELIVERABLE_ERROR_CODES:
+                    self._give_up(message, e)
+                else:
+                    self._retry_later(message, e)
+                return
+            except Exception as e:
+                self._retry_later(message, e)
+                return
+            OUTBOX_MESSAGES.inc(outcome='sent')
+            OUTBOX_SEND_SECONDS.observe(self._clock() - message.queued_at)
+            if message.outbound_id is not None:
+                self._delete_persisted(message)
+            return
+
+    def _retry_later(self, message: OutboundMessage, error: Exception, delay: int | None = None) -> None:
+        attempts = message.attempts + 1
+        if attempts >= config.OUTBOX_MAX_ATTEMPTS:
+            self._give_up(message, error)
+            return
+        delay = delay if delay is not None else config.OUTBOX_RETRY_BASE_DELAY * 2 ** message.attempts
+        OUTBOX_MESSAGES.inc(outcome='retry_queued')
+        logging.warning(f"Failed to send message to chat {message.chat_id}, retrying in {delay} s. "
+                        f"Error: {error.__repr__()}.")
+        try:
+            if message.outbound_id is None:
+                self._persist([OutboundMessage(message.chat_id, message.text, message.parse_mode,
+                                               message.reply_markup, attempts=attempts)], delay)
+            else:
+                self.db.reschedule_outbound_message(message.outbound_id, attempts, delay)
+        except Exception as e:
+            logging.error(f"Failed to queue message to chat {message.chat_id} for retry, it is lost. "
+                          f"Error: {e.__repr__()}.")
+
+    def _give_up(self, message: OutboundMessage, error: Exception) -> None:
+        OUTBOX_MESSAGES.inc(outcome='failed')
+        logging.error(f"Message to chat {message.chat_id} dropped after {message.attempts + 1} attempts. "
+                      f"Error: {error.__repr__()}.")
+        if message.outbound_id is not None:
+            self._delete_persisted(message)
+
+    def _delete_persisted(self, message: OutboundMessage) -> None:
+        try:
+            self.db.delete_outbound_message(message.outbound_id)
+        except Exception as e:
+            # Sent again after the visibility timeout, a duplicate is better than a dead sender
+            logging.error(f"Failed to delete message {message.outbound_id} from the retry queue. "
+                          f"Error: {e.__repr__()}.")
+
+    def _persist(self, messages: list[OutboundMessage], delay: int) -> None:
+        self.db.enqueue_outbound_messages([(m.chat_id, m.text, m.parse_mode, m.reply_markup, m.attempts, delay)
+                                           for m in messages])
+
+    def _retry_loop(self) -> None:
+        while True:
+            try:
+                # Hidden for long enough to get through the in-memory queue before another check sees them
+                rows = self.db.claim_outbound_messages(limit=OUTBOX_RETRY_BATCH_SIZE,
+                                                       visibility_timeout=config.OUTBOX_RETRY_INTERVAL * 4)
+            except Exception as e:
+                logging.error(f"Failed to read the outbound retry queue. Error: {e.__repr__()}.")
+                rows = ()
+            for r in rows:
+                self._put(OutboundMessage(r['chat_id'], r['text'], r['parse_mode'], r['reply_markup'],
+                                          outbound_id=r['outbound_id'], attempts=r['attempts']))
+            if self._stop.wait(config.OUTBOX_RETRY_INTERVAL):
+                return
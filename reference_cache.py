@@ -0,0 +1,59 @@
+"""
+In-process read-through cache of reference data (teams, active contests, round-to-matches maps).
+
+Every entry remembers the version of the table it was read from. Write methods of Database bump
+the version of the tables they touch, which makes every entry read from them stale at once. A value
+loaded while a write was in progress is returned to its caller but never stored, so the cache can't
+keep data older than the last write. Cached values are shared between threads and must not be modified.
+"""
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, TypeVar
+import config
+import metrics
+
+T = TypeVar('T')
+
+CACHE_HITS = metrics.counter('db_reference_cache_hits_total', 'Reference data lookups answered from memory')
+CACHE_MISSES = metrics.counter('db_reference_cache_misses_total', 'Reference data lookups that went to the database')
+CACHE_INVALIDATIONS = metrics.counter('db_reference_cache_invalidations_total',
+                                      'Reference tables invalidated by writes')
+
+
+class ReferenceCache:
+    def __init__(self, max_entries: int = config.REFERENCE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[str, Hashable], tuple[int, object]] = OrderedDict()
+        self._versions: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, table: str, key: Hashable, loader: Callable[[], T]) -> T:
+        """Returns the cached value for (table, key), calls loader to read it from the database on a miss."""
+        with self._lock:
+            version = self._versions.get(table, 0)
+            entry = self._entries.get((table, key))
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end((table, key))
+                CACHE_HITS.inc(table=table)
+                return entry[1]
+
+        CACHE_MISSES.inc(table=table)
+        value = loader()
+        with self._lock:
+            if self._versions.get(table, 0) == version:
+                self._entries[(table, key)] = (version, value)
+                self._entries.move_to_end((table, key))
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, *tables: str) -> None:
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+                CACHE_INVALIDATIONS.inc(table=table)
+            for k in [k for k in self._entries if k[0] in tables]:
+                del self._entries[k]
+
+    def __len__(self):
+        return len(self._entries)
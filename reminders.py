@@ -0,0 +1,85 @@
+"""
+Reminders to bet before a round starts.
+
+Reminders are per round, not per match: one job for every (round, offset) pair fires
+REMINDER_HOURS_BEFORE_KICKOFF hours before the first kickoff of the round and messages the users who
+haven't bet on the round yet. plan() derives the whole set of jobs from the cached round maps in one pass,
+the scheduler only adds, moves or removes the jobs whose run time differs from what it already has, so
+a calendar sync where fixtures moved touches just the affected rounds.
+"""
+import datetime
+import logging
+from pytz import timezone
+import config
+import metrics
+from bot_text_messages import BOT_ROUND_REMINDER, BOT_ROUND_REMINDER_MATCH
+from database import Database
+from utilities import initialize_logging, parse_match_datetime
+
+REMINDER_JOB_PREFIX = 'round_reminder'
+LOCAL_TIMEZONE = timezone(config.SCHEDULER_TIMEZONE)  # kickoff times in the text are Moscow time
+
+REMINDERS_SENT = metrics.counter('round_reminders_total', 'Round reminder runs by outcome')
+
+initialize_logging()
+
+
+def reminder_job_id(season_api_id: int, year: int, round_: int, hours_before: int) -> str:
+    return f"{REMINDER_JOB_PREFIX}_{season_api_id}_{year}_{round_}_{hours_before}h"
+
+
+class RoundReminders:
+    def __init__(self, bot, database: Database,
+                 hours_before: tuple[int, ...] = config.REMINDER_HOURS_BEFORE_KICKOFF):
+        self.bot = bot
+        self.db = database
+        self.hours_before = hours_before
+
+    def first_kickoff(self, season_api_id: int, year: int, round_: int) -> datetime.datetime | None:
+        matches = self.db.read_round_matches(season_api_id, year).get(round_)
+        return min(parse_match_datetime(m['match_datetime']) for m in matches) if matches else None
+
+    def format_round_matches(self, season_api_id: int, year: int, round_: int) -> str:
+        """One line per match of the round with team names as the league spells them."""
+        return '\n'.join(
+            BOT_ROUND_REMINDER_MATCH.format(
+                parse_match_datetime(m['match_datetime']).astimezone(LOCAL_TIMEZONE).strftime('%d.%m %H:%M'),
+                self.db.team_display_name(m['home_team_id']) or m['home_team_id'],
+                self.db.team_display_name(m['away_team_id']) or m['away_team_id'])
+            for m in self.db.read_round_matches(season_api_id, year).get(round_, ()))
+
+    def plan(self, now: datetime.datetime) -> dict[str, tuple[datetime.datetime, tuple[int, int, int, int]]]:
+        """Returns run time and job arguments of every reminder still ahead, by job id."""
+        planned = {}
+        for c in self.db.read_active_contests():
+            season_api_id, year = c['season_api_id'], c['year']
+            for round_, matches in self.db.read_round_matches(season_api_id, year).items():
+                kickoff = min(parse_match_datetime(m['match_datetime']) for m in matches)
+                for hours in self.hours_before:
+                    run_at = kickoff - datetime.timedelta(hours=hours)
+                    if run_at > now:
+                        planned[reminder_job_id(season_api_id, year, round_, hours)] = \
+                            (run_at, (season_api_id, year, round_, hours))
+        return planned
+
+    def send(self, season_api_id: int, year: int, round_: int, hours_before: int) -> int:
+        """Messages users without bets on the round. Returns the number of messages queued."""
+        contest = next((c for c in self.db.read_active_contests()
+                        if c['season_api_id'] == season_api_id and c['year'] == year), None)
+        kickoff = self.first_kickoff(season_api_id, year, round_)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if contest is None or kickoff is None or kickoff <= now:
+            # The job outlived its round: the contest was archived or fixtures moved before the plan caught up
+            REMINDERS_SENT.inc(outcome='skipped')
+            logging.info(f"Reminder '{reminder_job_id(season_api_id, year, round_, hours_before)}' skipped. "
+                         f"The round is no longer ahead.")
+            return 0
+
+        text = BOT_ROUND_REMINDER.format(contest['league_country'], contest['league_name'], round_,
+                                         kickoff.astimezone(LOCAL_TIMEZONE).strftime('%d.%m %H:%M'),
+                                         self.format_round_matches(season_api_id, year, round_))
+        sent = self.bot.broadcast(self.db.read_users_without_round_bets(season_api_id, year, round_), text,
+                                  parse_mode='HTML')
+        REMINDERS_SENT.inc(outcome='sent')
+        logging.info(f"Round {round_} reminder ({hours_before} h before kickoff) sent to {sent} users.")
+        return sent
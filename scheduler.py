@@ -1,23 +1,156 @@
+import datetime
+import logging
+import time
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.base import STATE_RUNNING
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED
 from pytz import timezone
 from dotenv import load_dotenv
+import metrics
 from database import Database
-from config import REQUESTS_COUNTER_RESET_TIME, SCHEDULER_TIMEZONE
+from storage import create_backend
+from sync import SyncCoordinator, SyncTask
+from backfill import BackfillRunner
+from reminders import RoundReminders, REMINDER_JOB_PREFIX
+from team_identity import refresh_team_identities
+from config import (REQUESTS_COUNTER_RESET_TIME, SCHEDULER_TIMEZONE, SCHEDULER_JOBSTORE, SCHEDULER_MAX_WORKERS,
+                    SCHEDULER_MISFIRE_GRACE_TIME, SYNC_LIVE_SCORES_INTERVAL_MINUTES, SYNC_CALENDAR_TIME,
+                    SYNC_TEAMS_DAY_OF_WEEK, BACKFILL_INTERVAL_MINUTES)
+from utilities import initialize_logging
 
-DB_URL = 'db/MyRPLBetBot.db'
+# Stable job ids: jobs are looked up and replaced by these names across restarts
+TEST_PRINT_JOB_ID = 'test_print'
+RESET_REQUESTS_COUNTER_JOB_ID = 'reset_requests_counter'
+ADMIN_MESSAGE_JOB_ID = 'admin_message'
+BACKFILL_JOB_ID = 'backfill'
+TEAM_IDENTITIES_JOB_ID = 'refresh_team_identities'
+SYNC_JOB_IDS: dict[str, str] = {'calendar': 'sync_calendar', 'live_scores': 'sync_live_scores', 'teams': 'sync_teams'}
+
+JOB_LAG = metrics.histogram('scheduler_job_lag_seconds',
+                            'Delay between the scheduled run time of a job and its submission to the executor')
+JOB_RUNTIME = metrics.histogram('scheduler_job_runtime_seconds', 'Time a job spent in the executor')
+JOB_ERRORS = metrics.counter('scheduler_job_errors_total', 'Jobs that raised an exception')
+JOB_MISSED = metrics.counter('scheduler_job_missed_total', 'Runs skipped because they missed the grace time')
 
 load_dotenv()
+initialize_logging()
+
+# Process-wide instances the jobs run against, bound once by init_scheduler()
+_bot = None
+_db: Database | None = None
+_sync: SyncCoordinator | None = None
+_backfill: BackfillRunner | None = None
+_reminders: RoundReminders | None = None
+_job_started: dict[str, float] = {}
+
+
+def _create_jobstore(kind: str) -> SQLAlchemyJobStore | MemoryJobStore:
+    if kind == 'memory':
+        return MemoryJobStore()
+    if kind == 'database':
+        # Jobs live next to the bot's own data, whichever storage backend that is
+        return SQLAlchemyJobStore(url=create_backend().sqlalchemy_url(), tablename='scheduled_jobs')
+    raise ValueError(f"Unknown scheduler job store: '{kind}'")
+
+
+def create_scheduler(jobstore: str = SCHEDULER_JOBSTORE,
+                     max_workers: int = SCHEDULER_MAX_WORKERS) -> BackgroundScheduler:
+    """
+    Builds a background scheduler.
 
-jobstores = {'default': SQLAlchemyJobStore(url=f'sqlite:///{DB_URL}', tablename='scheduled_jobs')}
-executors = {'default': ThreadPoolExecutor(20)}
-bot_scheduler = BackgroundScheduler(jobstores=jobstores,
-                                    executors=executors,
+    Missed runs are coalesced into a single one and dropped entirely once they are older than
+    SCHEDULER_MISFIRE_GRACE_TIME, a job never runs concurrently with itself.
+    """
+    scheduler = BackgroundScheduler(jobstores={'default': _create_jobstore(jobstore)},
+                                    executors={'default': ThreadPoolExecutor(max_workers)},
+                                    job_defaults={'coalesce': True,
+                                                  'max_instances': 1,
+                                                  'misfire_grace_time': SCHEDULER_MISFIRE_GRACE_TIME},
                                     timezone=timezone(SCHEDULER_TIMEZONE)
                                     )
+    scheduler.add_listener(_on_job_submitted, EVENT_JOB_SUBMITTED)
+    scheduler.add_listener(_on_job_finished, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+    scheduler.add_listener(_on_job_missed, EVENT_JOB_MISSED)
+    return scheduler
+
+
+def _on_job_submitted(event) -> None:
+    now = time.time()
+    for run_time in event.scheduled_run_times:
+        JOB_LAG.observe(max(now - run_time.timestamp(), 0), job=event.job_id)
+    _job_started[event.job_id] = time.perf_counter()
+
+
+def _on_job_finished(event) -> None:
+    started = _job_started.pop(event.job_id, None)
+    if started is not None:
+        JOB_RUNTIME.observe(time.perf_counter() - started, job=event.job_id)
+    if event.exception:
+        JOB_ERRORS.inc(job=event.job_id)
+        logging.error(f"Scheduled job '{event.job_id}' failed. Error: {event.exception.__repr__()}.")
+
+
+def _on_job_missed(event) -> None:
+    JOB_MISSED.inc(job=event.job_id)
+    logging.warning(f"Scheduled job '{event.job_id}' missed its run at {event.scheduled_run_time}.")
+
+
+bot_scheduler = create_scheduler()
+
+
+def _runs_jobs() -> bool:
+    """Whether jobs run in this process: the scheduler is started and not paused by a cluster leader stepping down."""
+    return bot_scheduler.state == STATE_RUNNING
+
+
+def init_scheduler(bot, db_instance: Database) -> None:
+    """Binds the process-wide bot and database to the scheduled jobs, registers recurring jobs and starts."""
+    global _bot, _db, _sync, _backfill, _reminders
+    _bot, _db = bot, db_instance
+    _sync = SyncCoordinator(bot.api, db_instance, bot.analytics)
+    _backfill = BackfillRunner(bot.api, db_instance)
+    _reminders = RoundReminders(bot, db_instance)
+    schedule_reset_requests_counter()
+    schedule_sync_jobs()
+    schedule_backfill()
+    bot_scheduler.start()
+    # After start(), before it get_jobs() doesn't see the jobs persisted by the previous run
+    schedule_round_reminders()
+    if not db_instance.read_team_identities():
+        schedule_team_identities_refresh()  # first start after migration 0006, don't wait for the weekly teams sync
+    logging.info(f"Scheduler started. Jobs: {[j.id for j in bot_scheduler.get_jobs()]}")
+
+
+def start_or_resume_scheduler(bot, db_instance: Database) -> None:
+    """Starts the scheduler the first time, resumes it afterwards. Used by the cluster leader."""
+    if bot_scheduler.running:
+        bot_scheduler.resume()
+        logging.info("Scheduler resumed.")
+        schedule_round_reminders()  # contests may have been created on other nodes meanwhile
+    else:
+        init_scheduler(bot, db_instance)
+
+
+def pause_scheduler() -> None:
+    """Stops starting new runs, runs in progress finish. Used when the cluster leader steps down."""
+    if bot_scheduler.running:
+        bot_scheduler.pause()
+        logging.info("Scheduler paused.")
+
+
+def shutdown_scheduler(wait: bool = True) -> None:
+    """Stops starting new runs, waits for running jobs (sync included) and stops the sync workers."""
+    if bot_scheduler.running:
+        bot_scheduler.shutdown(wait=wait)
+    if _sync is not None:
+        _sync.shutdown(wait=wait)
+    logging.info("Scheduler shut down.")
 
 
 def test_print_job():
@@ -25,7 +158,7 @@ def test_print_job():
 
 
 def schedule_test_print_job():
-    bot_scheduler.add_job(id='1',
+    bot_scheduler.add_job(id=TEST_PRINT_JOB_ID,
                           func=test_print_job,
                           name='TEST PRINT JOB',
                           trigger=IntervalTrigger(seconds=2),
@@ -33,24 +166,87 @@ def schedule_test_print_job():
                           )
 
 
-def schedule_reset_requests_counter(db_instance: Database):
+def reset_requests_counter() -> None:
+    if _db is None:
+        logging.error("Failed to reset requests counter. Scheduler is not bound to a database.")
+        return
+    _db.reset_requests_counter()
+
+
+def schedule_reset_requests_counter():
     h, m, s = REQUESTS_COUNTER_RESET_TIME.split(':')
-    bot_scheduler.add_job(id='2',
-                          func=db_instance.reset_requests_counter,
+    bot_scheduler.add_job(id=RESET_REQUESTS_COUNTER_JOB_ID,
+                          func=reset_requests_counter,
                           name='RESET REQUESTS COUNTER',
                           trigger=CronTrigger(hour=h, minute=m, second=s),
                           replace_existing=True
                           )
 
 
+def run_sync(task: SyncTask) -> None:
+    if _sync is None:
+        logging.error(f"Failed to run '{task}' sync. Scheduler is not bound to a bot.")
+        return
+    _sync.run(task)
+    if task == 'calendar':
+        schedule_round_reminders()  # kickoffs may have moved
+    elif task == 'teams':
+        run_team_identities_refresh()  # promoted clubs get their Russian names
+
+
+def schedule_sync_jobs() -> None:
+    h, m, s = SYNC_CALENDAR_TIME.split(':')
+    triggers = {
+        'live_scores': IntervalTrigger(minutes=SYNC_LIVE_SCORES_INTERVAL_MINUTES),
+        'calendar': CronTrigger(hour=h, minute=m, second=s),
+        'teams': CronTrigger(day_of_week=SYNC_TEAMS_DAY_OF_WEEK, hour=h, minute=m, second=s),
+    }
+    for task, trigger in triggers.items():
+        bot_scheduler.add_job(id=SYNC_JOB_IDS[task],
+                              func=run_sync,
+                              name=f'SYNC {task.upper()}',
+                              trigger=trigger,
+                              replace_existing=True,
+                              args=[task]
+                              )
+
+
+def run_backfill() -> None:
+    if _backfill is None:
+        logging.error("Failed to run backfill. Scheduler is not bound to a bot.")
+        return
+    _backfill.run_pending()
+
+
+def schedule_backfill() -> None:
+    bot_scheduler.add_job(id=BACKFILL_JOB_ID,
+                          func=run_backfill,
+                          name='BACKFILL PAST SEASONS',
+                          trigger=IntervalTrigger(minutes=BACKFILL_INTERVAL_MINUTES),
+                          replace_existing=True
+                          )
+
+
+def run_backfill_now() -> None:
+    """Moves the next backfill run to now instead of waiting for the interval to pass."""
+    if not _runs_jobs():
+        # A cluster node that isn't the leader, the leader's interval job picks up the queued backfill jobs
+        logging.info("Backfill not run now. The scheduler doesn't run in this process.")
+        return
+    bot_scheduler.modify_job(BACKFILL_JOB_ID, next_run_time=datetime.datetime.now(bot_scheduler.timezone))
+
+
 def send_admin_message(text: str) -> None:
-    from bet_bot import BetBot
-    bot = BetBot()
-    bot.notify_admin(text)
+    if _bot is None:
+        logging.error(f"Failed to send scheduled admin message. Scheduler is not bound to a bot. Text: {text}")
+        return
+    _bot.notify_admin(text)
 
 
-def schedule_bot_message_sending(message_text: str, trigger: IntervalTrigger | CronTrigger) -> None:
-    bot_scheduler.add_job(id='3',
+def schedule_bot_message_sending(message_text: str, trigger: IntervalTrigger | CronTrigger | DateTrigger,
+                                 job_id: str = ADMIN_MESSAGE_JOB_ID) -> None:
+    """Schedules a message to the admin, a message scheduled earlier under the same job_id is replaced."""
+    bot_scheduler.add_job(id=job_id,
                           func=send_admin_message,
                           name='BOT ADMIN MESSAGE SENDING',
                           trigger=trigger,
@@ -59,13 +255,61 @@ def schedule_bot_message_sending(message_text: str, trigger: IntervalTrigger | C
                           )
 
 
-# if __name__ == '__main__':
-#     db = Database()
-#     schedule_test_print_job()
-#
-#     try:
-#         bot_scheduler.start()
-#         while True:
-#             pass
-#     except (KeyboardInterrupt, SystemExit):
-#         bot_scheduler.shutdown()
+def run_round_reminder(season_api_id: int, year: int, round_: int, hours_before: int) -> None:
+    if _reminders is None:
+        logging.error(f"Failed to send round {round_} reminder. Scheduler is not bound to a bot.")
+        return
+    _reminders.send(season_api_id, year, round_, hours_before)
+
+
+def schedule_round_reminders() -> None:
+    """
+    Brings reminder jobs in line with the calendar: adds jobs of new rounds, moves the ones whose round
+    kickoff changed and removes the ones of rounds that are gone. Jobs that are still right are untouched.
+    """
+    if _reminders is None or not _runs_jobs():
+        # A cluster node that isn't or is no longer the leader, or startup before init_scheduler(), which plans them
+        logging.info("Round reminders not scheduled. The scheduler doesn't run in this process.")
+        return
+    planned = _reminders.plan(datetime.datetime.now(bot_scheduler.timezone))
+    existing = {j.id: j for j in bot_scheduler.get_jobs() if j.id.startswith(REMINDER_JOB_PREFIX)}
+
+    added = moved = 0
+    for job_id, (run_at, args) in planned.items():
+        job = existing.pop(job_id, None)
+        if job is None:
+            bot_scheduler.add_job(id=job_id,
+                                  func=run_round_reminder,
+                                  name='ROUND REMINDER',
+                                  trigger=DateTrigger(run_date=run_at),
+                                  replace_existing=True,
+                                  args=list(args)
+                                  )
+            added += 1
+        elif job.next_run_time != run_at:
+            job.reschedule(DateTrigger(run_date=run_at))
+            moved += 1
+    for job in existing.values():
+        job.remove()
+    logging.info(f"Round reminders scheduled. Added: {added}, moved: {moved}, removed: {len(existing)}, "
+                 f"unchanged: {len(planned) - added - moved}.")
+
+
+def run_team_identities_refresh() -> None:
+    if _db is None:
+        logging.error("Failed to refresh team identities. Scheduler is not bound to a database.")
+        return
+    try:
+        refresh_team_identities(_db)
+    except Exception as e:
+        logging.error(f"Failed to refresh team identities. Error: {e.__repr__()}.")
+
+
+def schedule_team_identities_refresh() -> None:
+    """Refreshes team identities once, right away, in the background."""
+    bot_scheduler.add_job(id=TEAM_IDENTITIES_JOB_ID,
+                          func=run_team_identities_refresh,
+                          name='REFRESH TEAM IDENTITIES',
+                          trigger=DateTrigger(),
+                          replace_existing=True
+                          )
@@ -1,27 +1,70 @@
 import datetime
+import json
 import logging
+import time
 from utilities import initialize_logging, load_confidentials_from_env, download_logo
 from urllib.parse import urljoin
 import requests
 from typing import List, Dict
-from config import SCHEDULER_TIMEZONE, PREFERRED_DATETIME_FORMAT
+from config import SCHEDULER_TIMEZONE, PREFERRED_DATETIME_FORMAT, DAILY_REQUESTS_QUOTA, COUNTRIES_CACHE_TTL
 from pytz import timezone
 from database import Database
+import metrics
+from metrics import timed
+
+try:
+    import orjson
+except ImportError:  # optional, the standard library decoder is used without it
+    orjson = None
 
 STAT_API_BASE_URL = 'https://api-football-beta.p.rapidapi.com'
 STAT_API_HOST = 'api-football-beta.p.rapidapi.com'
 HEADERS = {"X-RapidAPI-Host": STAT_API_HOST, "X-RapidAPI-Key": load_confidentials_from_env("STAT_API_KEY")}
 
+# Column order of match rows produced by fixtures_to_rows()
+MATCH_COLUMNS: tuple[str, ...] = ('match_id', 'season_api_id', 'season_year', 'match_datetime', 'round',
+                                  'home_team_id', 'away_team_id', 'score', 'home_goals', 'away_goals',
+                                  'status_long', 'status_short')
+
+API_REQUESTS = metrics.counter('stats_api_requests_total', 'Requests made to the statistics API')
+API_CACHE_HITS = metrics.counter('stats_api_cache_hits_total', 'Statistics API lookups answered from cache')
+API_CACHE_MISSES = metrics.counter('stats_api_cache_misses_total', 'Statistics API lookups that had to hit the API')
+API_QUOTA_REMAINING = metrics.gauge('stats_api_quota_remaining', 'Requests left in the daily statistics API quota')
+
 initialize_logging()
 
 
+def decode_json(content: bytes) -> dict:
+    return orjson.loads(content) if orjson else json.loads(content)
+
+
+def fixtures_to_rows(raw_matches_data: list[dict], season_api_id: int, year: int) -> list[tuple]:
+    """
+    Turns the 'response' list of the fixtures endpoint into match rows ordered as MATCH_COLUMNS,
+    reading only the fields stored. Round names look like 'Regular Season - 12'.
+    """
+    rows = []
+    append = rows.append
+    for m in raw_matches_data:
+        fixture, teams, goals = m['fixture'], m['teams'], m['goals']
+        status = fixture['status']
+        home, away = goals['home'], goals['away']
+        append((fixture['id'], season_api_id, year, fixture['date'], int(m['league']['round'].rpartition(' ')[2]),
+                teams['home']['id'], teams['away']['id'], f"{home}-{away}", home, away,
+                status['long'], status['short']))
+    return rows
+
+
 class StatsAPIHandler:
-    def __init__(self):
+    def __init__(self, database: Database | None = None, session: requests.Session | None = None):
         self.timezone = timezone(SCHEDULER_TIMEZONE)
-        self.db = Database()
+        self.db = database or Database()
+        self.session = session or requests.Session()  # keeps connections to the API alive between requests
+        self._countries_cache: dict[str, tuple[float, bool]] = {}  # country -> (cached at, supported)
         # TODO add a counter for requests per day, erase it every day, keep in mind permitted
         # TODO requests per day by stats service
 
+    @timed()
     def _make_request(self, endpoint: str, params: dict[str, str | int] = None) -> None | dict:
         """
         Makes request to a certain endpoint of the API stats server
@@ -35,7 +78,9 @@ class StatsAPIHandler:
             raise ValueError('Endpoint must be a string')
 
         requests_today = self.db.read_requests_counter()
-        if requests_today == 100:
+        API_QUOTA_REMAINING.set(DAILY_REQUESTS_QUOTA - requests_today)
+        if requests_today >= DAILY_REQUESTS_QUOTA:
+            API_REQUESTS.inc(endpoint=endpoint, status='quota_exceeded')
             return
 
         request_url = urljoin(base=STAT_API_BASE_URL, url=endpoint)
@@ -61,15 +106,19 @@ class StatsAPIHandler:
         #     print(e.args[0])
 
         logging.info(f"Requesting {request_url} with params: {params}...")
-        response = requests.get(request_url, headers=HEADERS, params=params)
+        response = self.session.get(request_url, headers=HEADERS, params=params)
         self.db.increment_requests_counter()
+        API_QUOTA_REMAINING.set(DAILY_REQUESTS_QUOTA - requests_today - 1)
 
         if not response.ok:
+            API_REQUESTS.inc(endpoint=endpoint, status='error')
             logging.error('BAD RESPONSE')
             return None
 
+        API_REQUESTS.inc(endpoint=endpoint, status='ok')
+
         logging.info(f"Request successful")
-        valued_data = response.json()
+        valued_data = decode_json(response.content)
         return valued_data
 
     def country_supported(self, country_name: str) -> bool:
@@ -78,14 +127,22 @@ class StatsAPIHandler:
         :return: True if country is supported, False otherwise
         """
 
-        # TODO add supported countries to DB or cache to avoid excessive API requests and update it once per week
         if not isinstance(country_name, str):
             raise ValueError('Country parameter must only be string')
 
+        cached = self._countries_cache.get(country_name)
+        if cached and time.time() - cached[0] < COUNTRIES_CACHE_TTL:
+            API_CACHE_HITS.inc(endpoint='countries')
+            return cached[1]
+        API_CACHE_MISSES.inc(endpoint='countries')
+
         logging.info(f'Checking if country ({country_name}) supported by STATS API ...')
         response = self._make_request(endpoint='countries', params={'name': country_name})
+        if response is None:
+            return False
 
         result = response['results'] != 0
+        self._countries_cache[country_name] = (time.time(), result)
         logging.info(f'Country supported: {result}')
         return result
 
@@ -111,16 +168,30 @@ class StatsAPIHandler:
 
         """
 
+        return self._get_season(league_country, league_name, {'current': 'true'})
+
+    def get_season(self, league_country: str, league_name: str, year: int) -> None | Dict[str, str | int]:
+        """
+        Gets the details of a past season of a football league, same keys as get_current_season() returns
+        with 'is_active' set to False. None if the statistics service has no such season.
+        """
+        season = self._get_season(league_country, league_name, {'season': year})
+        if season:
+            season['is_active'] = False
+        return season
+
+    def _get_season(self, league_country: str, league_name: str, season_params: dict[str, str | int]) \
+            -> None | Dict[str, str | int]:
         response = self._make_request(endpoint='leagues',
-                                      params={'name': league_name, 'current': 'true', 'country': league_country}
+                                      params={'name': league_name, 'country': league_country, **season_params}
                                       )
 
-        if response['results'] == 0:  # League hasn't started yet
+        if not response or response['results'] == 0:  # League hasn't started yet
             return None
 
         season_id = response['response'][0]['league']['id']
         logo_url = response['response'][0]['league']['logo']
-        logo = download_logo(logo_url)
+        logo = download_logo(logo_url, self.session)
         season_data = response['response'][0]['seasons'][0]
 
         return {
@@ -136,44 +207,40 @@ class StatsAPIHandler:
             'is_active': True
         }
 
-    def get_calendar(self, contest: Dict[str, str | int]) -> list[dict]:
+    def get_calendar(self, contest: Dict[str, str | int],
+                     date_from: str | None = None, date_to: str | None = None) -> list[dict]:
         """Get the match calendar for a contest.
 
         Args:
             contest (dict): Contest details including API ID, season, etc.
+            date_from (str): Optional 'YYYY-MM-DD' to narrow the calendar down, defaults to the season start.
+            date_to (str): Optional 'YYYY-MM-DD' to narrow the calendar down, defaults to the season end.
 
         Returns:
             list: List of dictionaries containing match details.
 
         """
+        return [dict(zip(MATCH_COLUMNS, r)) for r in self.get_calendar_rows(contest, date_from, date_to)]
+
+    def get_calendar_rows(self, contest: Dict[str, str | int],
+                          date_from: str | None = None, date_to: str | None = None) -> list[tuple]:
+        """Same as get_calendar(), matches come as tuples ordered as MATCH_COLUMNS, ready for executemany."""
 
         response = self._make_request(
             endpoint='fixtures',
             params={
-                "from": contest['start_date'],
-                "to": contest['finish_date'],
+                "from": date_from or contest['start_date'],
+                "to": date_to or contest['finish_date'],
                 "timezone": self.timezone.zone,
                 "season": contest['year'],
                 "league": contest['season_api_id']
             }
         )
 
-        raw_matches_data = response['response']
-        matches = [
-            {
-                'match_id': m['fixture']['id'],
-                'season_api_id': contest['season_api_id'],
-                'match_datetime': m['fixture']['date'],
-                'round': int(m['league']['round'].split(' - ')[-1]),
-                'home_team_id': m['teams']['home']['id'],
-                'away_team_id': m['teams']['away']['id'],
-                'score': f"{m['goals']['home']}-{m['goals']['away']}",
-                'status_long': m['fixture']['status']['long'],
-                'status_short': m['fixture']['status']['short']
-            }
-            for m in raw_matches_data
-        ]
-        return matches
+        if response is None:
+            return []
+
+        return fixtures_to_rows(response['response'], contest['season_api_id'], contest['year'])
 
     def get_league_teams(self, season_api_id: int, year: int) -> List[Dict[str, str | bytes]]:
         """Gets a list of teams to participate in this football tournament."""
@@ -186,6 +253,9 @@ class StatsAPIHandler:
             }
         )
 
+        if response is None:
+            return []
+
         teams_list = response['response']
         result = []
         for t in teams_list:
@@ -193,7 +263,7 @@ class StatsAPIHandler:
             name = t['team']['name']
             city = t['venue']['city']
             logo_url = t['team']['logo']
-            logo = download_logo(logo_url)
+            logo = download_logo(logo_url, self.session)
             result.append({'team_id': team_id, 'name': name, 'city': city, 'logo': logo, 'logo_url': logo_url})
 
         return result
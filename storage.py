@@ -0,0 +1,251 @@
+"""
+Storage backends behind Database: MySQL (the default) and embedded SQLite.
+
+Database speaks MySQL: `%s` placeholders, INSERT IGNORE, ON DUPLICATE KEY UPDATE, NOW(3) ± INTERVAL and
+SELECT ... FOR UPDATE SKIP LOCKED. A backend hands out connections and cursors taking exactly those queries.
+SQLiteBackend rewrites them once per distinct query (sqlite3 then reuses the prepared statement from its
+statement cache). The SQLite schema (db/create_db_tables_sqlite.sql) mirrors the MySQL one after all
+migrations.
+
+SQLite allows a single writer at a time. A transaction starting with a write or with SELECT ... FOR UPDATE
+takes the write lock up front (BEGIN IMMEDIATE), so it never fails halfway on a lock upgrade, other
+transactions read in WAL mode without blocking anybody.
+"""
+import functools
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Literal
+from urllib.parse import quote_plus
+import mysql.connector
+from mysql.connector import pooling
+import config
+import metrics
+from migrations import MIGRATIONS, SQLITE_MIGRATIONS
+from utilities import initialize_logging, load_confidentials_from_env
+
+DB_HOST = str(load_confidentials_from_env("MYSQL_DB_HOST"))
+DB_LOGIN = str(load_confidentials_from_env("MYSQL_DB_USERNAME"))
+DB_PASSWORD = str(load_confidentials_from_env("MYSQL_DB_PASSWORD"))
+# todo input host name used by railway.app before deploying https://docs.railway.app/guides/mysql
+DB_NAME = load_confidentials_from_env("MYSQL_DB_NAME") or 'my_rpl_bet_bot_db'
+
+BackendName = Literal['mysql', 'sqlite']
+
+POOL_CONNECTIONS_IN_USE = metrics.gauge('db_pool_connections_in_use', 'Pooled DB connections currently checked out')
+POOL_SIZE = metrics.gauge('db_pool_size', 'Maximum number of pooled DB connections')
+POOL_WAIT = metrics.histogram('db_pool_wait_seconds', 'Time spent waiting for a free pooled DB connection')
+
+SQLITE_PRAGMAS: tuple[str, ...] = (
+    'PRAGMA journal_mode = WAL',  # readers and the writer don't block each other
+    'PRAGMA synchronous = NORMAL',  # fsync on checkpoints only, safe with WAL
+    f'PRAGMA busy_timeout = {config.SQLITE_BUSY_TIMEOUT_MS}',  # wait for the write lock instead of failing
+    'PRAGMA temp_store = MEMORY',
+    f'PRAGMA cache_size = -{config.SQLITE_CACHE_KIB}',
+    f'PRAGMA mmap_size = {config.SQLITE_MMAP_BYTES}',
+)
+SQLITE_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+# Migration statements whose effect is visible in information_schema, see MySQLBackend.is_applied()
+_ALTER_COLUMN = re.compile(r"^\s*ALTER TABLE (\w+) (ADD|DROP) COLUMN (\w+)", re.IGNORECASE)
+
+initialize_logging()
+
+
+class MySQLBackend:
+    dialect = 'mysql'
+    Error = mysql.connector.Error
+    schema_path = 'db/create_db_tables_mysql.sql'
+    migrations = MIGRATIONS
+
+    def __init__(self, db_name: str = DB_NAME, pool_size: int = config.DB_POOL_SIZE):
+        self.name = db_name
+        self.pool_size = pool_size
+        self._pool = None
+        self._pool_slots = None
+
+    def setup(self) -> bool:
+        """Creates the database if it doesn't exist yet and opens the pool. Returns whether it was created."""
+        conn = mysql.connector.connect(host=DB_HOST, user=DB_LOGIN, password=DB_PASSWORD)
+        cur = conn.cursor()
+        cur.execute("SELECT SCHEMA_NAME FROM INFORMATION_SCHEMA.SCHEMATA WHERE SCHEMA_NAME = %s", (self.name,))
+        created = not cur.fetchall()
+        if created:
+            cur.execute(f"CREATE DATABASE IF NOT EXISTS {self.name} "
+                        f"CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci")
+            logging.info(f"'{self.name}' created!")
+        cur.close()
+        conn.close()
+
+        self._pool = pooling.MySQLConnectionPool(pool_name=f"{self.name}_pool", pool_size=self.pool_size,
+                                                 host=DB_HOST, user=DB_LOGIN, password=DB_PASSWORD,
+                                                 database=self.name)
+        # The connector's pool raises instead of waiting when exhausted, the semaphore makes callers wait
+        self._pool_slots = threading.BoundedSemaphore(self.pool_size)
+        POOL_SIZE.set(self.pool_size)
+        return created
+
+    def acquire(self):
+        started = time.perf_counter()
+        self._pool_slots.acquire()
+        POOL_WAIT.observe(time.perf_counter() - started)
+        POOL_CONNECTIONS_IN_USE.inc()
+        try:
+            return self._pool.get_connection()
+        except Exception:
+            POOL_CONNECTIONS_IN_USE.dec()
+            self._pool_slots.release()
+            raise
+
+    @staticmethod
+    def cursor(conn):
+        return conn.cursor()
+
+    @staticmethod
+    def is_applied(cur, statement: str) -> bool:
+        """
+        Whether a migration statement already took effect. DDL commits on its own, before its step is recorded,
+        so a crash in between leaves ADD/DROP COLUMN applied but not recorded. Other statements of migrations
+        are safe to run again (IF NOT EXISTS, INSERT IGNORE, updates recorded in the same transaction).
+        """
+        match = _ALTER_COLUMN.match(statement)
+        if match is None:
+            return False
+        table, action, column = match.groups()
+        cur.execute("SELECT COUNT(*) FROM information_schema.COLUMNS "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s", (table, column))
+        exists = cur.fetchall()[0][0] > 0
+        return exists if action.upper() == 'ADD' else not exists
+
+    def release(self, conn) -> None:
+        try:
+            conn.close()  # returns the connection to the pool
+        finally:
+            POOL_CONNECTIONS_IN_USE.dec()
+            self._pool_slots.release()
+
+    def drop(self) -> None:
+        conn = mysql.connector.connect(host=DB_HOST, user=DB_LOGIN, password=DB_PASSWORD)
+        cur = conn.cursor()
+        cur.execute(f"DROP DATABASE IF EXISTS {self.name}")
+        cur.close()
+        conn.close()
+
+    def sqlalchemy_url(self) -> str:
+        return f"mysql+mysqlconnector://{quote_plus(DB_LOGIN)}:{quote_plus(DB_PASSWORD)}@{DB_HOST}/{self.name}"
+
+
+_INTERVAL = re.compile(r"NOW\(3\) ([+-]) INTERVAL %s (SECOND|HOUR)")
+_UPSERT_VALUES = re.compile(r"VALUES\((\w+)\)")
+_EXCLUDED = r'excluded.\1'
+_WRITE_INTENT = re.compile(r"^\s*(INSERT|UPDATE|DELETE|REPLACE|CREATE|ALTER|DROP)\b|\bFOR UPDATE\b", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=512)
+def to_sqlite(query: str) -> str:
+    """Rewrites a query written for MySQL into SQLite's dialect."""
+    if ' ON DUPLICATE KEY UPDATE ' in query:
+        head, updates = query.split(' ON DUPLICATE KEY UPDATE ')
+        query = f"{head} ON CONFLICT DO UPDATE SET {_UPSERT_VALUES.sub(_EXCLUDED, updates)}"
+    query = _INTERVAL.sub(lambda m: f"strftime('%Y-%m-%d %H:%M:%f', 'now', '{m[1]}' || %s || ' {m[2].lower()}s')",
+                          query)
+    query = query.replace('NOW(3)', SQLITE_NOW)
+    query = query.replace('INSERT IGNORE ', 'INSERT OR IGNORE ')
+    query = query.replace(' FOR UPDATE SKIP LOCKED', '').replace(' FOR UPDATE', '')
+    return query.replace('%s', '?')
+
+
+class SQLiteCursor:
+    """sqlite3 cursor taking MySQL queries, opens the transaction on the first statement."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+        self._cur = conn.cursor()
+
+    def _begin(self, query: str) -> None:
+        if not self._conn.in_transaction:
+            self._cur.execute('BEGIN IMMEDIATE' if _WRITE_INTENT.search(query) else 'BEGIN')
+
+    def execute(self, query: str, params: tuple = ()) -> None:
+        self._begin(query)
+        self._cur.execute(to_sqlite(query), params)
+
+    def executemany(self, query: str, rows) -> None:
+        self._begin(query)
+        self._cur.executemany(to_sqlite(query), rows)
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    @property
+    def rowcount(self) -> int:
+        return self._cur.rowcount
+
+    def close(self) -> None:
+        self._cur.close()
+
+
+class SQLiteBackend:
+    dialect = 'sqlite'
+    Error = sqlite3.Error
+    schema_path = 'db/create_db_tables_sqlite.sql'
+    migrations = SQLITE_MIGRATIONS
+
+    def __init__(self, path: str = config.SQLITE_PATH):
+        self.name = path
+        # A connection per thread, kept open: opening one costs more than most queries
+        self._local = threading.local()
+
+    def setup(self) -> bool:
+        created = not os.path.exists(self.name)
+        if created:
+            os.makedirs(os.path.dirname(self.name) or '.', exist_ok=True)
+            logging.info(f"'{self.name}' created!")
+        return created
+
+    def acquire(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.name, isolation_level=None, cached_statements=config.SQLITE_CACHED_STATEMENTS)
+            for pragma in SQLITE_PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def cursor(conn: sqlite3.Connection) -> SQLiteCursor:
+        return SQLiteCursor(conn)
+
+    @staticmethod
+    def is_applied(cur: SQLiteCursor, statement: str) -> bool:
+        """DDL is transactional in SQLite, a statement is always recorded together with its effect."""
+        return False
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        pass
+
+    def drop(self) -> None:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.name + suffix):
+                os.remove(self.name + suffix)
+
+    def sqlalchemy_url(self) -> str:
+        return f"sqlite:///{self.name}"
+
+
+def create_backend(dialect: BackendName = config.DB_BACKEND,
+                   pool_size: int = config.DB_POOL_SIZE) -> MySQLBackend | SQLiteBackend:
+    if dialect == 'mysql':
+        return MySQLBackend(pool_size=pool_size)
+    if dialect == 'sqlite':
+        return SQLiteBackend()
+    raise ValueError(f"Unknown storage backend: '{dialect}'")
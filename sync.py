@@ -0,0 +1,139 @@
+"""
+Keeps calendars, live scores and teams of all active contests up to date.
+
+Work is sharded by league: every league is one task on a shared worker pool, so leagues are refreshed
+in parallel while requests for a single league stay sequential. Before each run the daily requests
+quota left is split evenly between leagues, the remainder rotates between leagues from run to run.
+Leagues whose share does not cover the task are skipped until the next run.
+
+Live scores are only requested for leagues with a match being played by the stored calendar, from
+kickoff until SYNC_LIVE_MATCH_HOURS later or until it is finished, so the quota goes to the hours that
+need it, and never out of the SYNC_LIVE_SCORES_RESERVED_REQUESTS kept for the other tasks.
+"""
+import datetime
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Literal
+import metrics
+from config import DAILY_REQUESTS_QUOTA, SYNC_WORKERS, SYNC_LIVE_MATCH_HOURS, SYNC_LIVE_SCORES_RESERVED_REQUESTS
+from analytics import SeasonAnalytics, FINISHED_STATUSES
+from database import Database
+from stats_api import StatsAPIHandler, MATCH_COLUMNS
+from utilities import initialize_logging, parse_match_datetime
+
+SyncTask = Literal['calendar', 'live_scores', 'teams']
+
+# Requests a single league needs for one run of each task
+REQUESTS_PER_TASK: dict[str, int] = {'calendar': 1, 'live_scores': 1, 'teams': 1}
+
+STATUS_SHORT_INDEX = MATCH_COLUMNS.index('status_short')
+
+SYNC_RUNS = metrics.counter('sync_league_runs_total', 'League sync tasks by outcome')
+SYNC_LATENCY = metrics.histogram('sync_league_seconds', 'Time to sync a single league')
+
+initialize_logging()
+
+
+def share_quota(league_keys: list, requests_left: int, first: int = 0) -> dict:
+    """
+    Splits requests left evenly between leagues. The remainder goes one by one to leagues starting with
+    the one at index `first`, so that rotating `first` between runs keeps the split fair over time.
+    """
+    if not league_keys:
+        return {}
+    base, remainder = divmod(max(requests_left, 0), len(league_keys))
+    shares = {}
+    for offset in range(len(league_keys)):
+        key = league_keys[(first + offset) % len(league_keys)]
+        shares[key] = base + (1 if offset < remainder else 0)
+    return shares
+
+
+class SyncCoordinator:
+    def __init__(self, stats_api: StatsAPIHandler, database: Database, analytics: SeasonAnalytics | None = None,
+                 workers: int = SYNC_WORKERS):
+        self.api = stats_api
+        self.db = database
+        self.analytics = analytics
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sync')
+        self._turn = 0
+
+    def run(self, task: SyncTask) -> dict[int, str]:
+        """Runs the task for every active contest. Returns the outcome per season_api_id."""
+        contests = list(self.db.read_active_contests())
+        requests_left = DAILY_REQUESTS_QUOTA - self.db.read_requests_counter()
+        if task == 'live_scores':
+            now = datetime.datetime.now(self.api.timezone)
+            contests = [c for c in contests if self.has_live_matches(c, now)]
+            requests_left -= SYNC_LIVE_SCORES_RESERVED_REQUESTS
+        if not contests:
+            return {}
+
+        keys = [c['season_api_id'] for c in contests]
+        shares = share_quota(keys, requests_left, self._turn)
+        self._turn = (self._turn + 1) % len(keys)
+
+        worker = self._task_worker(task)
+        futures = {}
+        for c in contests:
+            key = c['season_api_id']
+            if shares[key] < REQUESTS_PER_TASK[task]:
+                SYNC_RUNS.inc(task=task, outcome='no_quota')
+                logging.warning(f"Skipping '{task}' sync for {c['league_country']} {c['league_name']}. "
+                                f"Not enough requests quota left.")
+                continue
+            futures[key] = self._pool.submit(self._run_shard, task, worker, c)
+
+        return {key: future.result() for key, future in futures.items()}
+
+    def has_live_matches(self, contest: dict, now: datetime.datetime) -> bool:
+        """Whether a match of the contest has kicked off less than SYNC_LIVE_MATCH_HOURS ago and isn't finished."""
+        started_since = now - datetime.timedelta(hours=SYNC_LIVE_MATCH_HOURS)
+        for matches in self.db.read_round_matches(contest['season_api_id'], contest['year']).values():
+            for m in matches:
+                if m['status_short'] not in FINISHED_STATUSES \
+                        and started_since <= parse_match_datetime(m['match_datetime']) <= now:
+                    return True
+        return False
+
+    def _task_worker(self, task: SyncTask) -> Callable[[dict], None]:
+        return {'calendar': self.sync_calendar, 'live_scores': self.sync_live_scores, 'teams': self.sync_teams}[task]
+
+    @staticmethod
+    def _run_shard(task: SyncTask, worker: Callable[[dict], None], contest: dict) -> str:
+        league = f"{contest['league_country']} {contest['league_name']}"
+        started = time.perf_counter()
+        try:
+            worker(contest)
+        except Exception as e:
+            SYNC_RUNS.inc(task=task, outcome='error')
+            logging.exception(f"Failed to sync '{task}' for {league}. Error: {e.__repr__()}.")
+            return 'error'
+        finally:
+            SYNC_LATENCY.observe(time.perf_counter() - started, task=task)
+        SYNC_RUNS.inc(task=task, outcome='ok')
+        logging.info(f"'{task}' synced for {league}.")
+        return 'ok'
+
+    def sync_calendar(self, contest: dict) -> None:
+        self._store_matches(self.api.get_calendar_rows(contest))
+
+    def sync_live_scores(self, contest: dict) -> None:
+        now = datetime.datetime.now(self.api.timezone)
+        # A match kicked off late yesterday is still played after midnight
+        date_from = (now - datetime.timedelta(hours=SYNC_LIVE_MATCH_HOURS)).strftime('%Y-%m-%d')
+        self._store_matches(self.api.get_calendar_rows(contest, date_from=date_from, date_to=now.strftime('%Y-%m-%d')))
+
+    def _store_matches(self, rows: list[tuple]) -> None:
+        self.db.upsert_match_rows(MATCH_COLUMNS, rows)
+        if self.analytics:
+            # Only finished matches are of interest to statistics, the rest are never turned into dicts
+            self.analytics.apply_results(dict(zip(MATCH_COLUMNS, r)) for r in rows
+                                         if r[STATUS_SHORT_INDEX] in FINISHED_STATUSES)
+
+    def sync_teams(self, contest: dict) -> None:
+        self.db.upsert_teams(self.api.get_league_teams(contest['season_api_id'], contest['year']))
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,146 @@
+"""
+Links clubs scraped from premierliga.ru (team_parser) to api-football teams (`teams.team_id`).
+
+Both sides are reduced to match keys: names and cities are transliterated to Latin, lowercased, stripped
+of punctuation and club prefixes (FC, ФК, ...) and stemmed so spelling variants meet ('Dynamo'/'Dinamo',
+'Krylya'/'Krylia', 'Moskva'/'Moscow'). Every api-football team is indexed under several keys, from
+'name city' down to the bare name without the city, a key shared by several teams is dropped as
+ambiguous. A scraped club then takes its keys from the most specific one and the first hit wins, so the
+whole league resolves in one pass of dict lookups. TEAM_NAME_OVERRIDES covers clubs whose names differ
+altogether (sponsor names). Resolved clubs are stored in `team_identities`, displayed names are read from there.
+"""
+import datetime
+import logging
+import re
+import unicodedata
+import config
+import metrics
+import team_parser
+from database import Database
+from utilities import initialize_logging
+
+CYRILLIC_TO_LATIN: dict[str, str] = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z', 'и': 'i',
+    'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't',
+    'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ъ': '', 'ы': 'y', 'ь': '',
+    'э': 'e', 'ю': 'yu', 'я': 'ya',
+}
+_TRANSLITERATION = str.maketrans(CYRILLIC_TO_LATIN)
+# Applied in order to transliterated words, folds the usual spelling variants into one form
+_STEMS: tuple[tuple[re.Pattern, str], ...] = tuple((re.compile(p), r) for p, r in (
+    (r'kh', 'h'), (r'ts', 'c'), (r'y', 'i'), (r'(.)\1', r'\1'),
+))
+_NON_WORD = re.compile(r'[^a-z0-9 ]+')
+# Words that say nothing about which club it is
+STOP_WORDS: frozenset[str] = frozenset({'fc', 'fk', 'pfk', 'pfc', 'sk', 'club', 'football', 'futbolnii', 'klub'})
+# English names of cities next to their transliterated Russian ones
+CITY_SYNONYMS: dict[str, str] = {'moscow': 'moskva', 'saint petersburg': 'sankt peterburg',
+                                 'st petersburg': 'sankt peterburg'}
+
+TEAM_IDENTITIES_RESOLVED = metrics.counter('team_identities_total', 'Scraped clubs by resolution outcome')
+
+initialize_logging()
+
+
+def transliterate(text: str) -> str:
+    return text.lower().translate(_TRANSLITERATION)
+
+
+def match_key(*parts: str | None) -> str:
+    """Normalized, stemmed key of a name (and city), '' if nothing is left of it."""
+    text = ' '.join(p for p in parts if p)
+    text = unicodedata.normalize('NFKD', transliterate(text)).encode('ascii', 'ignore').decode()
+    words = [w for w in _NON_WORD.sub(' ', text.replace('-', ' ')).split() if w not in STOP_WORDS]
+    text = ' '.join(words)
+    for city, canonical in CITY_SYNONYMS.items():
+        text = re.sub(rf'\b{city}\b', canonical, text)
+    for pattern, replacement in _STEMS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def _without_city(name: str, city: str | None) -> str:
+    key, city_key = match_key(name), match_key(city)
+    if not city_key:
+        return key
+    return ' '.join(w for w in key.split() if w not in city_key.split())
+
+
+def team_keys(team: dict) -> list[str]:
+    """Keys of an api-football team, most specific first."""
+    name, city = team['name'], team.get('city')
+    bare = _without_city(name, city)
+    return list(dict.fromkeys(k for k in (match_key(name, city), match_key(bare, city), match_key(name), bare) if k))
+
+
+def club_keys(club: dict) -> list[str]:
+    """Keys of a club scraped by team_parser, most specific first, English names before transliterated ones."""
+    keys = []
+    for name, city in ((club.get('name_eng'), club.get('city_eng')), (club.get('name'), club.get('city'))):
+        if name:
+            keys += [match_key(name, city), match_key(name), _without_city(name, city)]
+    return list(dict.fromkeys(k for k in keys if k))
+
+
+class TeamIdentityIndex:
+    """Match keys of api-football teams, built once per resolution."""
+
+    def __init__(self, teams: dict[int, dict], overrides: dict[str, str] = config.TEAM_NAME_OVERRIDES):
+        owners: dict[str, set[int]] = {}
+        for team_id, team in teams.items():
+            for key in team_keys(team):
+                owners.setdefault(key, set()).add(team_id)
+        self.ambiguous_keys = {k for k, ids in owners.items() if len(ids) > 1}
+        self._index: dict[str, int] = {k: next(iter(ids)) for k, ids in owners.items() if len(ids) == 1}
+        # Overrides name the api-football team, they win over anything derived
+        self._overrides: dict[str, int] = {}
+        for scraped_name, api_name in overrides.items():
+            team_id = self._index.get(match_key(api_name))
+            if team_id is None:
+                logging.warning(f"Team name override '{scraped_name}' -> '{api_name}' ignored. No such team.")
+                continue
+            self._overrides[match_key(scraped_name)] = team_id
+
+    def resolve(self, club: dict) -> tuple[int, str] | None:
+        """Returns (team_id, matched key) for a scraped club, None if no key identifies a single team."""
+        for key in (match_key(club.get('name_eng')), match_key(club.get('name'))):
+            if key in self._overrides:
+                return self._overrides[key], key
+        for key in club_keys(club):
+            team_id = self._index.get(key)
+            if team_id is not None:
+                return team_id, key
+        return None
+
+
+def resolve_team_identities(clubs: list[dict], teams: dict[int, dict]) -> list[dict]:
+    """Maps scraped clubs onto teams. Returns `team_identities` rows, clubs that didn't resolve are logged."""
+    index = TeamIdentityIndex(teams)
+    now = datetime.datetime.now().strftime(config.PREFERRED_DATETIME_FORMAT)
+    rows: dict[int, dict] = {}
+    for club in clubs:
+        resolved = index.resolve(club)
+        if resolved is None:
+            TEAM_IDENTITIES_RESOLVED.inc(outcome='unresolved')
+            logging.warning(f"Club '{club.get('name')}' ({club.get('name_eng')}) not matched to any team.")
+            continue
+        team_id, key = resolved
+        if team_id in rows:
+            TEAM_IDENTITIES_RESOLVED.inc(outcome='conflict')
+            logging.warning(f"Clubs '{rows[team_id]['name_ru']}' and '{club.get('name')}' both matched team "
+                            f"{team_id}, the second one is skipped.")
+            continue
+        TEAM_IDENTITIES_RESOLVED.inc(outcome='resolved')
+        rows[team_id] = {'team_id': team_id, 'name_ru': club.get('name'), 'city_ru': club.get('city'),
+                         'name_eng': club.get('name_eng'), 'city_eng': club.get('city_eng'),
+                         'url': club.get('url'), 'url_eng': club.get('url_eng'), 'match_key': key,
+                         'updated_datetime': now}
+    return list(rows.values())
+
+
+def refresh_team_identities(database: Database) -> int:
+    """Scrapes the clubs of the league, maps them onto stored teams and stores the mapping. Returns its size."""
+    rows = resolve_team_identities(team_parser.main(), database.read_teams())
+    database.upsert_team_identities(rows)
+    logging.info(f"Team identities refreshed. Clubs matched: {len(rows)}.")
+    return len(rows)
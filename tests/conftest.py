@@ -0,0 +1,57 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('TELEGRAM_TOKEN', '000000:TEST')
+os.environ.setdefault('ADMIN_ID', '1')
+os.environ.setdefault('TEST_ACCOUNT_ID', '2')
+os.environ.setdefault('STAT_API_KEY', 'test')
+
+import config
+
+config.LOG_FILE = os.path.join(tempfile.gettempdir(), 'MyRPLBetBot-tests.log')
+
+import pytest
+from database import Database
+from storage import SQLiteBackend
+
+SEASON_API_ID = 235
+YEAR = 2024
+
+
+@pytest.fixture(autouse=True)
+def repo_root(monkeypatch):
+    # Schema files are opened relative to the repository, as when the bot runs
+    monkeypatch.chdir(ROOT)
+
+
+@pytest.fixture
+def db(tmp_path) -> Database:
+    database = Database(backend=SQLiteBackend(str(tmp_path / 'test.sqlite3')))
+    yield database
+    database.backend.drop()
+
+
+@pytest.fixture
+def contest(db) -> dict:
+    contest = {'season_api_id': SEASON_API_ID, 'league_name': 'Premier League', 'league_country': 'Russia',
+               'year': YEAR, 'start_date': f'{YEAR}-07-20', 'finish_date': f'{YEAR + 1}-05-31',
+               'creation_datetime': '01.07.2024 12:00:00', 'is_active': 1}
+    db.add_contest(contest)
+    return contest
+
+
+def match_row(match_id: int, kickoff: str, round_: int = 1, home_goals: int | None = None,
+              away_goals: int | None = None, status_short: str = 'NS') -> dict:
+    return {'match_id': match_id, 'season_api_id': SEASON_API_ID, 'season_year': YEAR, 'match_datetime': kickoff,
+            'round': round_, 'home_team_id': 2 * match_id, 'away_team_id': 2 * match_id + 1,
+            'score': None if home_goals is None else f'{home_goals}:{away_goals}', 'home_goals': home_goals,
+            'away_goals': away_goals, 'status_long': None, 'status_short': status_short}
+
+
+@pytest.fixture
+def make_match():
+    return match_row
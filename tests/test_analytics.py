@@ -0,0 +1,94 @@
+import pytest
+from analytics import SeasonAnalytics, UserStats, score_prediction
+from config import POINTS_PER_DIFF, POINTS_PER_RESULT, POINTS_PER_SCORE
+
+USER, OTHER_USER = 5, 6
+
+
+@pytest.mark.parametrize('predicted, actual, expected', [
+    ((2, 1), (2, 1), (POINTS_PER_SCORE, 'score')),
+    ((0, 0), (0, 0), (POINTS_PER_SCORE, 'score')),
+    ((3, 2), (2, 1), (POINTS_PER_DIFF, 'diff')),
+    ((1, 1), (2, 2), (POINTS_PER_DIFF, 'diff')),
+    ((0, 2), (1, 3), (POINTS_PER_DIFF, 'diff')),
+    ((2, 0), (1, 0), (POINTS_PER_RESULT, 'result')),
+    ((0, 3), (1, 2), (POINTS_PER_RESULT, 'result')),
+    ((1, 1), (2, 1), (0, 'miss')),
+    ((0, 1), (2, 1), (0, 'miss')),
+    ((2, 1), (1, 1), (0, 'miss')),
+])
+def test_score_prediction(predicted, actual, expected):
+    assert score_prediction(*predicted, *actual) == expected
+
+
+def place_bets(db, bets: list[tuple[int, int, int, int]]) -> None:
+    db.insert_rows('bets', ('telegram_id', 'match_id', 'home_goals', 'away_goals', 'creation_datetime'),
+                   [(*b, '01.08.2024 12:00:00') for b in bets])
+
+
+@pytest.fixture
+def season(db, contest, make_match) -> list[dict]:
+    """Four finished matches in two rounds and one still to be played, bets of two users."""
+    matches = [make_match(1, '2024-08-03T17:00:00+03:00', 1, 2, 1, 'FT'),
+               make_match(2, '2024-08-04T19:30:00+03:00', 1, 3, 0, 'FT'),
+               make_match(3, '2024-08-10T17:00:00+03:00', 2, 1, 1, 'FT'),
+               make_match(4, '2024-08-11T19:30:00+03:00', 2, 0, 2, 'AET'),
+               make_match(5, '2024-08-17T17:00:00+03:00', 3)]
+    db.insert_matches(matches)
+    place_bets(db, [(USER, 1, 2, 1),  # score
+                    (USER, 2, 1, 0),  # result
+                    (USER, 3, 2, 0),  # miss
+                    (USER, 4, 1, 3),  # diff
+                    (USER, 5, 1, 0),
+                    (OTHER_USER, 3, 0, 0)])  # diff
+    return matches
+
+
+def expected_user_stats(contest) -> UserStats:
+    return UserStats(USER, contest['season_api_id'], contest['year'], predictions=4, hits=3, exact_scores=1,
+                     points=POINTS_PER_SCORE + POINTS_PER_RESULT + POINTS_PER_DIFF, current_streak=1, best_streak=2,
+                     best_round=1, best_round_points=POINTS_PER_SCORE + POINTS_PER_RESULT)
+
+
+def test_apply_results(db, contest, season):
+    analytics = SeasonAnalytics(db)
+    analytics.load()
+    analytics.apply_results(reversed(season))  # streaks follow kickoff order, not the order results come in
+
+    assert analytics.get_user_stats(USER, contest['season_api_id'], contest['year']) == expected_user_stats(contest)
+    other = analytics.get_user_stats(OTHER_USER, contest['season_api_id'], contest['year'])
+    assert (other.predictions, other.points, other.best_round, other.best_round_points) == \
+           (1, POINTS_PER_DIFF, 2, POINTS_PER_DIFF)
+    assert db.read_processed_results() == {1, 2, 3, 4}
+
+
+def test_statistics_survive_reload(db, contest, season):
+    SeasonAnalytics(db).apply_results(season)
+    analytics = SeasonAnalytics(db)
+    analytics.load()
+    assert analytics.get_user_stats(USER, contest['season_api_id'], contest['year']) == expected_user_stats(contest)
+
+
+def test_result_accounted_for_once(db, contest, season):
+    analytics = SeasonAnalytics(db)
+    analytics.load()
+    analytics.apply_results(season[:2])
+    analytics.apply_results(season)
+    analytics.apply_results(season)
+    analytics.apply_result(season[0])
+    assert analytics.get_user_stats(USER, contest['season_api_id'], contest['year']) == expected_user_stats(contest)
+
+    # A restarted bot loads the marks stored with the statistics and doesn't count the results again
+    reloaded = SeasonAnalytics(db)
+    reloaded.load()
+    reloaded.apply_results(season)
+    assert reloaded.get_user_stats(USER, contest['season_api_id'], contest['year']) == expected_user_stats(contest)
+    stored = [r for r in db.read_user_stats() if r['telegram_id'] == USER]
+    assert [UserStats(**r) for r in stored] == [expected_user_stats(contest)]
+
+
+def test_unfinished_match_not_accounted_for(db, contest, season):
+    analytics = SeasonAnalytics(db)
+    analytics.apply_results(season[4:])
+    assert analytics.get_user_stats(USER, contest['season_api_id'], contest['year']) is None
+    assert db.read_processed_results() == set()
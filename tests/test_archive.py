@@ -0,0 +1,115 @@
+import json
+import os
+import pytest
+import archive
+from analytics import SeasonAnalytics
+from archive import ArchivedSeason, export_contest, import_contest, list_archived_seasons
+
+FINISHED_YEAR = 2023
+
+
+@pytest.fixture
+def finished(db, contest, make_match) -> dict:
+    """A finished season with results accounted for in statistics, next to the active one."""
+    finished = dict(contest, year=FINISHED_YEAR, is_active=0)
+    db.add_contest(finished)
+    matches = [dict(make_match(1, '2023-08-03T17:00:00+03:00', 1, 2, 1, 'FT'), status_long='Матч завершён'),
+               dict(make_match(2, '2023-08-04T19:30:00+03:00', 1, 0, 0, 'FT'), status_long='Match Finished'),
+               make_match(3, '2024-05-25T17:00:00+03:00', 30)]  # never played, NULL goals and score
+    db.insert_matches([dict(m, season_year=FINISHED_YEAR) for m in matches])
+    db.insert_matches([make_match(10, '2024-08-03T17:00:00+03:00')])
+    db.insert_rows('bets', ('telegram_id', 'match_id', 'home_goals', 'away_goals', 'creation_datetime'),
+                   [(5, 1, 2, 1, 'x'), (5, 2, 1, 0, 'x'), (6, 1, 1, 0, 'x'), (6, 3, 1, 1, 'x'), (5, 10, 1, 1, 'x')])
+    SeasonAnalytics(db).apply_results(db.read_season_matches(contest['season_api_id'], FINISHED_YEAR))
+    return finished
+
+
+def season_rows(db, contest: dict) -> dict[str, list[dict]]:
+    return {t: sorted(map(dict, rows), key=lambda r: tuple(r.values()))
+            for t, rows in archive._read_season_tables(db, contest['season_api_id'], contest['year']).items()}
+
+
+def test_export_moves_season_out_of_live_tables(db, contest, finished, tmp_path):
+    path = export_contest(db, finished['season_api_id'], FINISHED_YEAR, str(tmp_path))
+
+    assert path == os.path.join(str(tmp_path), f"{finished['season_api_id']}_{FINISHED_YEAR}")
+    assert db.read_contest(finished['season_api_id'], FINISHED_YEAR) is None
+    assert all(not rows for rows in season_rows(db, finished).values())
+    # The active season is untouched
+    assert [m['match_id'] for m in db.read_season_matches(contest['season_api_id'], contest['year'])] == [10]
+    assert len(db.read_season_bets(contest['season_api_id'], contest['year'])) == 1
+
+
+def test_archived_columns(db, finished, tmp_path):
+    export_contest(db, finished['season_api_id'], FINISHED_YEAR, str(tmp_path))
+    season, = list_archived_seasons(str(tmp_path))
+
+    assert season.contest['year'] == FINISHED_YEAR
+    assert season.manifest['version'] == archive.ARCHIVE_FORMAT_VERSION
+    assert {t: v['rows'] for t, v in season.manifest['tables'].items()} == \
+           {'matches': 3, 'bets': 4, 'user_stats': 2, 'user_round_points': 2, 'processed_results': 2}
+    assert list(season.column('matches', 'match_id')) == [1, 2, 3]
+    assert list(season.column('matches', 'home_goals')) == [2, 0, None]
+    assert list(season.column('matches', 'score')) == ['2:1', '0:0', None]
+    assert list(season.column('matches', 'status_long')) == ['Матч завершён', 'Match Finished', None]
+    assert season.column('matches', 'status_long')[0] == 'Матч завершён'
+    assert season.leaderboard() == [(5, 4), (6, 2)]
+
+
+def test_import_restores_season(db, finished, tmp_path):
+    before = season_rows(db, finished)
+    path = export_contest(db, finished['season_api_id'], FINISHED_YEAR, str(tmp_path))
+    import_contest(db, path)
+
+    assert season_rows(db, finished) == before
+    assert db.read_contest(finished['season_api_id'], FINISHED_YEAR)['is_active'] == 0
+
+
+def test_import_version_1_archive(db, finished, tmp_path):
+    path = export_contest(db, finished['season_api_id'], FINISHED_YEAR, str(tmp_path))
+    manifest_path = os.path.join(path, 'manifest.json')
+    with open(manifest_path, encoding='UTF-8') as f:
+        manifest = json.load(f)
+    manifest['version'] = 1
+    manifest['tables'] = {t: manifest['tables'][t] for t in ('matches', 'bets')}
+    with open(manifest_path, 'w', encoding='UTF-8') as f:
+        json.dump(manifest, f)
+
+    import_contest(db, path)
+    restored = season_rows(db, finished)
+    assert (len(restored['matches']), len(restored['bets'])) == (3, 4)
+    assert not restored['user_stats'] and not restored['processed_results']
+
+
+def test_export_resumes_after_crash_before_deletion(db, finished, tmp_path, monkeypatch):
+    before = season_rows(db, finished)
+
+    def crash(*args):
+        raise RuntimeError('killed')
+    monkeypatch.setattr(db, 'delete_contest', crash)
+    with pytest.raises(RuntimeError):
+        export_contest(db, finished['season_api_id'], FINISHED_YEAR, str(tmp_path))
+    monkeypatch.undo()
+
+    path = export_contest(db, finished['season_api_id'], FINISHED_YEAR, str(tmp_path))
+    assert path is not None
+    assert db.read_contest(finished['season_api_id'], FINISHED_YEAR) is None
+    import_contest(db, path)
+    assert season_rows(db, finished) == before
+
+
+def test_export_refuses_archive_not_matching_live_rows(db, finished, tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'delete_contest', lambda *args: None)
+    path = export_contest(db, finished['season_api_id'], FINISHED_YEAR, str(tmp_path))
+    monkeypatch.undo()
+    db.insert_rows('bets', ('telegram_id', 'match_id', 'home_goals', 'away_goals', 'creation_datetime'),
+                   [(7, 1, 3, 3, 'x')])
+
+    assert export_contest(db, finished['season_api_id'], FINISHED_YEAR, str(tmp_path)) is None
+    assert db.read_contest(finished['season_api_id'], FINISHED_YEAR) is not None
+    assert ArchivedSeason(path).manifest['tables']['bets']['rows'] == 4
+
+
+def test_active_contest_not_exported(db, contest, tmp_path):
+    assert export_contest(db, contest['season_api_id'], contest['year'], str(tmp_path)) is None
+    assert list_archived_seasons(str(tmp_path)) == []
@@ -0,0 +1,186 @@
+import pytest
+from telebot.apihelper import ApiTelegramException
+import config
+from outbox import Outbox, OutboundMessage, TokenBucket
+
+PRIVATE_CHAT, OTHER_PRIVATE_CHAT, GROUP_CHAT = 1, 2, -100
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class FakeBot:
+    """Records the time of every message sent, raises the errors queued for a chat first."""
+
+    def __init__(self, clock: FakeClock):
+        self.clock = clock
+        self.sent: list[tuple[float, int, str]] = []
+        self.errors: dict[int, list[Exception]] = {}
+
+    def send_message(self, chat_id, text, parse_mode=None, reply_markup=None):
+        if self.errors.get(chat_id):
+            raise self.errors[chat_id].pop(0)
+        self.sent.append((self.clock() - 1000.0, chat_id, text))
+
+    def times(self, chat_id: int) -> list[float]:
+        return [t for t, c, _ in self.sent if c == chat_id]
+
+
+def telegram_error(code: int, retry_after: int | None = None) -> ApiTelegramException:
+    result_json = {'ok': False, 'error_code': code, 'description': f'error {code}'}
+    if retry_after is not None:
+        result_json['parameters'] = {'retry_after': retry_after}
+    return ApiTelegramException('sendMessage', None, result_json)
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture
+def bot(clock) -> FakeBot:
+    return FakeBot(clock)
+
+
+@pytest.fixture
+def outbox(bot, db, clock) -> Outbox:
+    return Outbox(bot, db, senders=1, clock=clock, sleep=clock.sleep)
+
+
+def deliver(outbox: Outbox, messages: list[OutboundMessage]) -> None:
+    """Runs the sender loop in the test's thread over the given messages."""
+    for m in messages:
+        outbox._put(m)
+    outbox._queues[0].put(None)
+    outbox._send_loop(outbox._queues[0])
+
+
+def test_bucket_refills_at_rate_up_to_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=3, clock=clock)
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+    assert bucket.reserve() == pytest.approx(0.5)
+    clock.sleep(1)  # pays back the token taken ahead and refills one more
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.5)
+    clock.sleep(100)
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+    assert bucket.reserve() > 0
+
+
+def test_bucket_pause(clock):
+    bucket = TokenBucket(rate=1, capacity=3, shared=True, clock=clock)
+    bucket.pause(5)
+    assert bucket.reserve() >= 5
+    clock.sleep(100)
+    assert bucket.reserve() == 0
+
+
+def test_private_chat_limit(outbox, bot):
+    deliver(outbox, [OutboundMessage(PRIVATE_CHAT, str(i)) for i in range(5)])
+    burst, rate = config.OUTBOX_CHAT_BURST, config.OUTBOX_CHAT_RATE
+    assert bot.times(PRIVATE_CHAT) == pytest.approx([0] * burst + [(i + 1) / rate for i in range(5 - burst)])
+    assert [text for _, _, text in bot.sent] == ['0', '1', '2', '3', '4']
+
+
+def test_group_chat_limit(outbox, bot):
+    deliver(outbox, [OutboundMessage(GROUP_CHAT, str(i)) for i in range(3)])
+    assert bot.times(GROUP_CHAT) == pytest.approx([i / config.OUTBOX_GROUP_RATE for i in range(3)])
+
+
+def test_global_limit(outbox, bot):
+    chats = int(config.OUTBOX_GLOBAL_RATE) + 2
+    deliver(outbox, [OutboundMessage(chat_id, 'hi') for chat_id in range(1, chats + 1)])
+    times = [t for t, _, _ in bot.sent]
+    assert times[:chats - 2] == [0] * (chats - 2)
+    assert times[chats - 2:] == pytest.approx([1 / config.OUTBOX_GLOBAL_RATE, 2 / config.OUTBOX_GLOBAL_RATE])
+
+
+def test_rate_limit_pauses_chat_and_all_chats(bot, db, clock):
+    other_sender_waits = []
+
+    def sleep(seconds):
+        # Meanwhile a sender serving other chats asks for a token
+        other_sender_waits.append(outbox._global_bucket.reserve())
+        clock.sleep(seconds)
+    outbox = Outbox(bot, db, senders=1, clock=clock, sleep=sleep)
+    bot.errors[PRIVATE_CHAT] = [telegram_error(429, retry_after=5)]
+    deliver(outbox, [OutboundMessage(PRIVATE_CHAT, 'a')])
+
+    assert bot.times(PRIVATE_CHAT)[0] >= 5
+    assert other_sender_waits[0] >= 5
+    assert db._read_table('outbound_messages') == ()
+
+
+def test_long_rate_limit_goes_to_retry_queue(outbox, bot, db, monkeypatch):
+    delays = spy_on_retry_queue(db, monkeypatch)
+    bot.errors[PRIVATE_CHAT] = [telegram_error(429, retry_after=config.OUTBOX_MAX_RETRY_AFTER + 1)]
+    deliver(outbox, [OutboundMessage(PRIVATE_CHAT, 'a')])
+
+    assert bot.sent == []
+    assert delays == [config.OUTBOX_MAX_RETRY_AFTER + 1]
+    assert [r['attempts'] for r in db._read_table('outbound_messages')] == [1]
+
+
+def spy_on_retry_queue(db, monkeypatch) -> list[int]:
+    """Records the delay of every message put into or moved in the retry queue."""
+    delays = []
+    enqueue, reschedule = db.enqueue_outbound_messages, db.reschedule_outbound_message
+
+    def enqueue_spy(messages):
+        delays.extend(m[-1] for m in messages)
+        return enqueue(messages)
+
+    def reschedule_spy(outbound_id, attempts, delay):
+        delays.append(delay)
+        reschedule(outbound_id, attempts, delay)
+    monkeypatch.setattr(db, 'enqueue_outbound_messages', enqueue_spy)
+    monkeypatch.setattr(db, 'reschedule_outbound_message', reschedule_spy)
+    return delays
+
+
+def test_failed_message_retried_with_backoff(outbox, bot, db, monkeypatch):
+    delays = spy_on_retry_queue(db, monkeypatch)
+    bot.errors[PRIVATE_CHAT] = [ConnectionError('down'), ConnectionError('down'), telegram_error(502)]
+    deliver(outbox, [OutboundMessage(PRIVATE_CHAT, 'a')])
+    row, = db._read_table('outbound_messages')
+    assert row['attempts'] == 1
+    assert db.claim_outbound_messages(limit=10, visibility_timeout=60) == ()  # not due yet
+
+    for _ in range(2):
+        row, = db._read_table('outbound_messages')
+        deliver(outbox, [OutboundMessage(row['chat_id'], row['text'], outbound_id=row['outbound_id'],
+                                         attempts=row['attempts'])])
+    assert delays == [config.OUTBOX_RETRY_BASE_DELAY * 2 ** i for i in range(3)]
+    assert [r['attempts'] for r in db._read_table('outbound_messages')] == [3]
+
+    row, = db._read_table('outbound_messages')
+    deliver(outbox, [OutboundMessage(row['chat_id'], row['text'], outbound_id=row['outbound_id'],
+                                     attempts=row['attempts'])])
+    assert [text for _, _, text in bot.sent] == ['a']
+    assert db._read_table('outbound_messages') == ()
+
+
+def test_message_dropped_after_max_attempts(outbox, bot, db):
+    bot.errors[PRIVATE_CHAT] = [ConnectionError('down')]
+    db.enqueue_outbound_messages([(PRIVATE_CHAT, 'a', None, None, config.OUTBOX_MAX_ATTEMPTS - 1, 0)])
+    row, = db.claim_outbound_messages(limit=10, visibility_timeout=60)
+    deliver(outbox, [OutboundMessage(row['chat_id'], row['text'], outbound_id=row['outbound_id'],
+                                     attempts=row['attempts'])])
+    assert db._read_table('outbound_messages') == ()
+
+
+def test_undeliverable_message_not_retried(outbox, bot, db):
+    bot.errors[PRIVATE_CHAT] = [telegram_error(403)]
+    bot.errors[OTHER_PRIVATE_CHAT] = [telegram_error(400)]
+    deliver(outbox, [OutboundMessage(PRIVATE_CHAT, 'a'), OutboundMessage(OTHER_PRIVATE_CHAT, 'b')])
+    assert bot.sent == []
+    assert db._read_table('outbound_messages') == ()
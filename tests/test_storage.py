@@ -0,0 +1,135 @@
+import sqlite3
+import pytest
+from database import Database
+from migrations import SQLITE_MIGRATIONS
+from storage import MySQLBackend, SQLiteBackend, SQLiteCursor, SQLITE_NOW, to_sqlite
+
+
+@pytest.mark.parametrize('mysql, sqlite', [
+    ("SELECT * FROM teams WHERE team_id = %s",
+     "SELECT * FROM teams WHERE team_id = ?"),
+    ("INSERT INTO teams (team_id, name) VALUES (%s, %s) ON DUPLICATE KEY UPDATE name = VALUES(name)",
+     "INSERT INTO teams (team_id, name) VALUES (?, ?) ON CONFLICT DO UPDATE SET name = excluded.name"),
+    ("INSERT INTO matches (match_id, score, status_short) VALUES (%s, %s, %s) "
+     "ON DUPLICATE KEY UPDATE score = VALUES(score), status_short = VALUES(status_short)",
+     "INSERT INTO matches (match_id, score, status_short) VALUES (?, ?, ?) "
+     "ON CONFLICT DO UPDATE SET score = excluded.score, status_short = excluded.status_short"),
+    ("INSERT INTO cache_versions (table_name, version) VALUES (%s, 1) ON DUPLICATE KEY UPDATE version = version + 1",
+     "INSERT INTO cache_versions (table_name, version) VALUES (?, 1) ON CONFLICT DO UPDATE SET version = version + 1"),
+    ("INSERT IGNORE INTO work_queue (kind, dedup_key) VALUES (%s, %s)",
+     "INSERT OR IGNORE INTO work_queue (kind, dedup_key) VALUES (?, ?)"),
+    ("UPDATE work_queue SET claimed_at = NOW(3) WHERE item_id = %s",
+     f"UPDATE work_queue SET claimed_at = {SQLITE_NOW} WHERE item_id = ?"),
+    ("UPDATE leader_leases SET expires_at = NOW(3) + INTERVAL %s SECOND WHERE expires_at < NOW(3)",
+     "UPDATE leader_leases SET expires_at = strftime('%Y-%m-%d %H:%M:%f', 'now', '+' || ? || ' seconds') "
+     f"WHERE expires_at < {SQLITE_NOW}"),
+    ("DELETE FROM work_queue WHERE created_at < NOW(3) - INTERVAL %s HOUR",
+     "DELETE FROM work_queue WHERE created_at < strftime('%Y-%m-%d %H:%M:%f', 'now', '-' || ? || ' hours')"),
+    ("SELECT item_id FROM work_queue WHERE status = 'pending' LIMIT %s FOR UPDATE SKIP LOCKED",
+     "SELECT item_id FROM work_queue WHERE status = 'pending' LIMIT ?"),
+    ("SELECT holder FROM leader_leases WHERE name = %s FOR UPDATE",
+     "SELECT holder FROM leader_leases WHERE name = ?"),
+])
+def test_to_sqlite(mysql, sqlite):
+    assert to_sqlite(mysql) == sqlite
+
+
+@pytest.mark.parametrize('query, begin', [
+    ("SELECT * FROM teams", 'BEGIN'),
+    ("  insert into teams (team_id) VALUES (%s)", 'BEGIN IMMEDIATE'),
+    ("UPDATE teams SET name = %s", 'BEGIN IMMEDIATE'),
+    ("DELETE FROM teams", 'BEGIN IMMEDIATE'),
+    ("CREATE TABLE t (a INTEGER)", 'BEGIN IMMEDIATE'),
+    ("SELECT * FROM teams FOR UPDATE SKIP LOCKED", 'BEGIN IMMEDIATE'),
+])
+def test_transaction_takes_write_lock_for_writes(query, begin):
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    conn.execute("CREATE TABLE teams (team_id INTEGER PRIMARY KEY, name TEXT)")
+    statements = []
+    conn.set_trace_callback(statements.append)
+    cur = SQLiteCursor(conn)
+    cur.execute(query, (1,) if '%s' in query else ())
+    cur.execute("SELECT 1")  # same transaction, no second BEGIN
+    assert [s for s in statements if s.startswith('BEGIN')] == [begin]
+    conn.rollback()
+
+
+def test_migrations_applied_once(db):
+    assert {r['name'] for r in db._read_table('schema_migrations')} == {name for name, _ in SQLITE_MIGRATIONS}
+    assert db._read_table('schema_migration_steps') == ()
+    reopened = Database(backend=SQLiteBackend(db.name))
+    assert len(reopened._read_table('schema_migrations')) == len(SQLITE_MIGRATIONS)
+
+
+def test_interrupted_migration_resumes(db, monkeypatch):
+    statements = ("ALTER TABLE teams ADD COLUMN short_name TEXT NULL", "UPDATE teams SET short_name = name",
+                  "CREATE INDEX teams_short_name ON teams (short_name)")
+    monkeypatch.setattr(SQLiteBackend, 'migrations', SQLITE_MIGRATIONS + [('0099_test', statements[:2] + ('BROKEN',))])
+    with pytest.raises(sqlite3.Error):
+        Database(backend=SQLiteBackend(db.name))
+    assert [r['step'] for r in db._read_table('schema_migration_steps')] == [0, 1]
+
+    monkeypatch.setattr(SQLiteBackend, 'migrations', SQLITE_MIGRATIONS + [('0099_test', statements)])
+    resumed = Database(backend=SQLiteBackend(db.name))
+    assert 'short_name' in resumed.read_column_names('teams')
+    assert '0099_test' in {r['name'] for r in resumed._read_table('schema_migrations')}
+    assert resumed._read_table('schema_migration_steps') == ()
+
+
+class InformationSchemaCursor:
+    def __init__(self, columns: set[tuple[str, str]]):
+        self.columns = columns
+        self.params = None
+
+    def execute(self, query, params):
+        self.params = params
+
+    def fetchall(self):
+        return [(int(self.params in self.columns),)]
+
+
+@pytest.mark.parametrize('statement, applied', [
+    ("ALTER TABLE teams ADD COLUMN logo_hash CHAR(64) NULL", True),
+    ("ALTER TABLE contests ADD COLUMN logo_hash CHAR(64) NULL", False),
+    ("ALTER TABLE teams DROP COLUMN logo", False),
+    ("ALTER TABLE contests DROP COLUMN logo", True),
+    ("CREATE TABLE IF NOT EXISTS assets (asset_hash CHAR(64) NOT NULL PRIMARY KEY)", False),
+    ("UPDATE teams SET logo_hash = SHA2(logo, 256) WHERE logo IS NOT NULL", False),
+])
+def test_mysql_ddl_applied_before_its_step_was_recorded(statement, applied):
+    cur = InformationSchemaCursor({('teams', 'logo_hash'), ('teams', 'logo')})
+    assert MySQLBackend.is_applied(cur, statement) == applied
+
+
+def test_upsert_round_trip(db):
+    db.upsert_teams([{'team_id': 1, 'name': 'Zenit', 'city': 'Saint Petersburg', 'logo_url': None}])
+    db.upsert_teams([{'team_id': 1, 'name': 'Zenit St. Petersburg', 'city': 'Saint Petersburg', 'logo_url': None},
+                     {'team_id': 2, 'name': 'Spartak', 'city': 'Moscow', 'logo_url': None}])
+    teams = db.read_teams()
+    assert (teams[1]['name'], teams[2]['name']) == ('Zenit St. Petersburg', 'Spartak')
+
+
+def test_lease(db):
+    assert db.try_acquire_lease('leader', 'a', ttl=30)
+    assert db.try_acquire_lease('leader', 'a', ttl=30)
+    assert not db.try_acquire_lease('leader', 'b', ttl=30)
+    db.release_lease('leader', 'a')
+    assert db.try_acquire_lease('leader', 'b', ttl=30)
+    assert not db.try_acquire_lease('leader', 'a', ttl=30)
+
+
+def test_enqueue_work_counts_queued_items(db):
+    assert db.enqueue_work('update', [('1', '{"n": 1}'), ('2', '{"n": 2}'), ('1', '{"n": 1}')]) == 2
+    assert db.enqueue_work('update', [('2', '{"n": 2}'), ('3', '{"n": 3}')]) == 1
+    assert db.insert_rows('work_queue', ('kind', 'dedup_key', 'payload'),
+                          [('other', str(i % 3), '{}') for i in range(7)], batch_size=2) == 3
+
+
+def test_work_queue(db):
+    db.enqueue_work('update', [('1', '{"n": 1}'), ('2', '{"n": 2}')])
+    claimed = db.claim_work('update', 'worker-1', limit=10)
+    assert [i['payload'] for i in claimed] == ['{"n": 1}', '{"n": 2}']
+    assert db.claim_work('update', 'worker-2', limit=10) == ()
+    db.finish_work(claimed[0]['item_id'], 'pending')
+    assert [i['item_id'] for i in db.claim_work('update', 'worker-2', limit=10)] == [claimed[0]['item_id']]
+    assert db.requeue_stale_work(visibility_timeout=3600) == 0
@@ -0,0 +1,61 @@
+import datetime
+import pytest
+from pytz import timezone
+from config import DAILY_REQUESTS_QUOTA, SCHEDULER_TIMEZONE, SYNC_LIVE_MATCH_HOURS, \
+    SYNC_LIVE_SCORES_INTERVAL_MINUTES, SYNC_LIVE_SCORES_RESERVED_REQUESTS
+from sync import SyncCoordinator, REQUESTS_PER_TASK, share_quota
+
+MSK = timezone(SCHEDULER_TIMEZONE)
+MATCH_DAY = datetime.datetime(2024, 8, 10)
+TICK = datetime.timedelta(minutes=SYNC_LIVE_SCORES_INTERVAL_MINUTES)
+
+
+@pytest.fixture
+def coordinator(db):
+    coordinator = SyncCoordinator(None, db, workers=1)
+    yield coordinator
+    coordinator.shutdown()
+
+
+def simulate_match_day(coordinator, db, contest, make_match, finished_after: datetime.timedelta | None):
+    """Runs the live scores polling decision every interval of the day. Returns the times polled."""
+    kickoff = MSK.localize(MATCH_DAY.replace(hour=19, minute=30))
+    db.insert_matches([make_match(1, kickoff.isoformat())])
+    polled, spent = [], 0
+    now = MSK.localize(MATCH_DAY)
+    while now < MSK.localize(MATCH_DAY + datetime.timedelta(days=1)):
+        if finished_after is not None and now >= kickoff + finished_after:
+            db.upsert_matches([make_match(1, kickoff.isoformat(), home_goals=1, away_goals=0, status_short='FT')])
+        if coordinator.has_live_matches(contest, now):
+            # The same check SyncCoordinator.run() makes before polling
+            share = share_quota([contest['season_api_id']],
+                                DAILY_REQUESTS_QUOTA - spent - SYNC_LIVE_SCORES_RESERVED_REQUESTS)
+            assert share[contest['season_api_id']] >= REQUESTS_PER_TASK['live_scores'], f'no quota at {now}'
+            spent += REQUESTS_PER_TASK['live_scores']
+            polled.append(now)
+        now += TICK
+    return kickoff, polled, spent
+
+
+def test_live_scores_polled_only_while_match_is_played(coordinator, db, contest, make_match):
+    kickoff, polled, spent = simulate_match_day(coordinator, db, contest, make_match,
+                                                finished_after=datetime.timedelta(minutes=115))
+    assert polled[0] == kickoff
+    assert polled[-1] < kickoff + datetime.timedelta(minutes=115)
+    assert len(polled) == 115 // SYNC_LIVE_SCORES_INTERVAL_MINUTES + 1
+    assert spent == len(polled) * REQUESTS_PER_TASK['live_scores']
+
+
+def test_live_scores_polling_stops_for_a_match_never_reported_finished(coordinator, db, contest, make_match):
+    kickoff, polled, spent = simulate_match_day(coordinator, db, contest, make_match, finished_after=None)
+    assert polled[0] == kickoff
+    assert polled[-1] == kickoff + datetime.timedelta(hours=SYNC_LIVE_MATCH_HOURS)
+    assert spent == SYNC_LIVE_MATCH_HOURS * 60 // SYNC_LIVE_SCORES_INTERVAL_MINUTES + 1
+    assert spent <= DAILY_REQUESTS_QUOTA - SYNC_LIVE_SCORES_RESERVED_REQUESTS
+
+
+def test_no_live_matches_without_matches_today(coordinator, db, contest, make_match):
+    db.insert_matches([make_match(1, '2024-08-11T19:30:00+03:00'),
+                       make_match(2, '2024-08-09T19:30:00+03:00', home_goals=2, away_goals=2, status_short='FT')])
+    now = MSK.localize(MATCH_DAY.replace(hour=20))
+    assert not coordinator.has_live_matches(contest, now)
@@ -1,7 +1,20 @@
+import atexit
+import datetime
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import random
 from dotenv import load_dotenv
+from pytz import timezone
 import requests
+import config
+
+# Attributes every LogRecord has, anything else was passed through `extra=` and goes to the JSON record as is
+_STANDARD_RECORD_ATTRS = frozenset(logging.makeLogRecord({}).__dict__) | {'message', 'asctime'}
+
+_log_listener: logging.handlers.QueueListener | None = None
 
 
 def load_confidentials_from_env(conf_data_to_load: str) -> str | None:
@@ -9,20 +22,84 @@ def load_confidentials_from_env(conf_data_to_load: str) -> str | None:
     return os.getenv(conf_data_to_load)
 
 
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': datetime.datetime.fromtimestamp(record.created).strftime(config.PREFERRED_DATETIME_FORMAT),
+            'level': record.levelname,
+            'logger': record.name,
+            'file': record.filename,
+            'line': record.lineno,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_RECORD_ATTRS:
+                data[key] = value
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class DebugSamplingFilter(logging.Filter):
+    """Lets through only a share of DEBUG records, records of higher levels always pass."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
 def initialize_logging():
-    logging.basicConfig(
-        level=logging.INFO,
-        filename="MyRPLBetBot.log",
-        format="%(asctime)s [%(filename)s:%(lineno)d] %(levelname)s - %(message)s",
-        datefmt="%d.%m.%Y %H:%M:%S",
+    """
+    Routes the root logger through a queue to a listener thread writing JSON lines to a rotating file,
+    so logging never blocks the calling thread on disk I/O. Safe to call from every module.
+    """
+    global _log_listener
+    if _log_listener is not None:
+        return
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        config.LOG_FILE,
+        maxBytes=config.LOG_MAX_BYTES,
+        backupCount=config.LOG_BACKUP_COUNT,
         encoding='UTF-8'
     )
+    file_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(DebugSamplingFilter(config.LOG_DEBUG_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    root.setLevel(config.LOG_LEVEL)
+    root.addHandler(queue_handler)
 
+    _log_listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
 
-def download_logo(url: str) -> bytes:
-    response = requests.get(url)
+
+def download_logo(url: str, session: requests.Session | None = None) -> bytes:
+    response = (session or requests).get(url)
     if not response.ok:
         # Get default logo
         with open('db/Images/no logo.png', 'rb') as file:
             return file.read()
     return response.content
+
+
+def parse_match_datetime(value: str | datetime.datetime) -> datetime.datetime:
+    """
+    Kickoff time of a match row as an aware datetime. The statistics API returns ISO 8601 strings with the offset
+    of the requested timezone (SCHEDULER_TIMEZONE), a DATETIME column comes back as a naive datetime in that zone.
+    """
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = timezone(config.SCHEDULER_TIMEZONE).localize(value)
+    return value